@@ -0,0 +1,91 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.functions import Length
+
+# Username autocomplete for the invite dialog.
+#
+# Prefix matches rank ahead of substring matches; on PostgreSQL both are
+# served by expression indexes on UPPER(username) (see migration 0002).
+# Every answer is cached for a short while together with the full candidate
+# set when it is small enough, so the next keystroke (a longer prefix) can
+# usually be answered by filtering a cached set without touching the DB.
+# An empty query lists the first users, as the endpoint always has.
+RESULT_LIMIT = 10
+CANDIDATE_LIMIT = 200
+CACHE_TIMEOUT = 60
+VERSION_KEY = 'user-search:version'
+
+
+def cache_key(query):
+    # Hashed: queries are raw user input, which some backends reject as keys
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    digest = hashlib.md5(query.encode(), usedforsecurity=False).hexdigest()
+    return f'user-search:{version}:{digest}'
+
+
+def invalidate():
+    # Called when users are created or renamed; old entries simply age out
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def rank(usernames, query, limit=RESULT_LIMIT):
+    prefix = sorted((name for name in usernames if name.lower().startswith(query)), key=lambda name: (len(name), name.lower()))
+    contains = sorted((name for name in usernames if query in name.lower() and not name.lower().startswith(query)), key=lambda name: (len(name), name.lower()))
+    return (prefix + contains)[:limit]
+
+
+def fetch_candidates(query):
+    # Every username containing query, or None if there are too many to keep
+    User = get_user_model()
+    usernames = list(
+        User.objects.filter(username__icontains=query)
+        .order_by()
+        .values_list('username', flat=True)[:CANDIDATE_LIMIT + 1]
+    )
+    if len(usernames) > CANDIDATE_LIMIT:
+        return None
+    return usernames
+
+
+def fetch_ranked(query, limit=RESULT_LIMIT):
+    User = get_user_model()
+    users = User.objects.order_by()
+    prefix = list(users.filter(username__istartswith=query).order_by(Length('username'), 'username').values_list('username', flat=True)[:limit])
+    if len(prefix) < limit:
+        prefix += list(
+            users.filter(username__icontains=query)
+            .exclude(username__istartswith=query)
+            .order_by(Length('username'), 'username')
+            .values_list('username', flat=True)[:limit - len(prefix)]
+        )
+    return rank(prefix, query, limit)
+
+
+def search_usernames(query, limit=RESULT_LIMIT):
+    query = query.strip().lower()
+    if not query:
+        return list(get_user_model().objects.values_list('username', flat=True)[:limit])
+
+    cached = cache.get(cache_key(query))
+    if cached is not None:
+        return cached['results']
+
+    # A cached complete candidate set for a shorter prefix contains every
+    # match for this query as well
+    for length in range(len(query) - 1, 0, -1):
+        shorter = cache.get(cache_key(query[:length]))
+        if shorter is not None and shorter['candidates'] is not None:
+            candidates = [name for name in shorter['candidates'] if query in name.lower()]
+            results = rank(candidates, query, limit)
+            cache.set(cache_key(query), {'results': results, 'candidates': candidates}, CACHE_TIMEOUT)
+            return results
+
+    candidates = fetch_candidates(query)
+    results = rank(candidates, query, limit) if candidates is not None else fetch_ranked(query, limit)
+    cache.set(cache_key(query), {'results': results, 'candidates': candidates}, CACHE_TIMEOUT)
+    return results
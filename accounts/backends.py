@@ -0,0 +1,17 @@
+from django.contrib.auth.backends import ModelBackend
+
+from tasks import readcache
+
+
+class CachedModelBackend(ModelBackend):
+    # Session authentication loads request.user on every request; this
+    # reads it through tasks.readcache, invalidated whenever the user is
+    # saved (including password changes, which end the sessions as usual).
+    # A per-process cache would let other processes keep accepting old
+    # sessions, so the user is read from the database unless it is shared
+
+    def get_user(self, user_id):
+        if not readcache.is_shared():
+            return super().get_user(user_id)
+        user = readcache.get_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
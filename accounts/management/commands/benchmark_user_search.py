@@ -0,0 +1,69 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts import autocomplete
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'shi', 'no', 'vel', 'an', 'dor', 'is', 'qu', 'zen', 'bo', 'li', 'mar']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark username autocomplete against a synthetic user table (rolled back afterwards).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000, help='Synthetic users to insert.')
+        parser.add_argument('--queries', type=int, default=200, help='Typed queries to replay.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with transaction.atomic():
+            self.insert_users(options['users'])
+            words = [self.username() for _ in range(options['queries'])]
+
+            cold = self.measure(lambda query: autocomplete.fetch_ranked(query), words)
+            cache.clear()
+            typed = self.measure(autocomplete.search_usernames, words)
+
+            transaction.set_rollback(True)
+
+        self.report('database query per keystroke', cold)
+        self.report('search_usernames with prefix cache', typed)
+
+    def insert_users(self, count):
+        User = get_user_model()
+        started = time.perf_counter()
+        batch = []
+        for index in range(count):
+            batch.append(User(username=f'{self.username()}{index}', password='!'))
+            if len(batch) == 10_000:
+                User.objects.bulk_create(batch)
+                batch = []
+        User.objects.bulk_create(batch)
+        self.stdout.write(f"Inserted {count} users in {time.perf_counter() - started:.1f}s")
+
+    def username(self):
+        return ''.join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4)))
+
+    def measure(self, search, words):
+        # Replays each word as it is typed, one keystroke at a time
+        timings = []
+        for word in words:
+            for length in range(1, min(len(word), 6) + 1):
+                started = time.perf_counter()
+                search(word[:length])
+                timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def report(self, label, timings):
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f"{label}: {len(timings)} lookups, p50 {statistics.median(timings):.2f}ms, "
+            f"p95 {p95:.2f}ms, max {timings[-1]:.2f}ms"
+        )
@@ -0,0 +1,44 @@
+from django.db import DatabaseError, migrations, transaction
+
+# Expression indexes matching the SQL Django emits for username__istartswith
+# and username__icontains on PostgreSQL: UPPER("username"::text) LIKE ...
+PREFIX_INDEX = (
+    "CREATE INDEX IF NOT EXISTS accounts_customuser_username_prefix "
+    "ON accounts_customuser (UPPER(username::text) text_pattern_ops)"
+)
+TRIGRAM_INDEX = (
+    "CREATE INDEX IF NOT EXISTS accounts_customuser_username_trgm "
+    "ON accounts_customuser USING GIN (UPPER(username::text) gin_trgm_ops)"
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(PREFIX_INDEX)
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            schema_editor.execute(TRIGRAM_INDEX)
+    except DatabaseError:
+        # Without pg_trgm substring matches fall back to a scan; prefix
+        # matches, which are ranked first, still use the index above
+        pass
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS accounts_customuser_username_trgm")
+    schema_editor.execute("DROP INDEX IF EXISTS accounts_customuser_username_prefix")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
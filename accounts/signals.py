@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import autocomplete
+
+CustomUser = get_user_model()
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login, which does not affect autocomplete
+    if created or update_fields is None or 'username' in update_fields:
+        autocomplete.invalidate()
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    autocomplete.invalidate()
@@ -1,3 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .autocomplete import cache_key, search_usernames
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        for username in ['bobby', 'bob', 'alice', 'jimbob', 'robert']:
+            User.objects.create_user(username=username, password='pw')
+
+    def test_prefix_matches_rank_first(self):
+        self.assertEqual(search_usernames('bo'), ['bob', 'bobby', 'jimbob'])
+
+    def test_longer_prefix_uses_cached_candidates(self):
+        search_usernames('b')
+        with self.assertNumQueries(0):
+            self.assertEqual(search_usernames('bob'), ['bob', 'bobby', 'jimbob'])
+
+    def test_new_user_invalidates_cache(self):
+        search_usernames('bo')
+        get_user_model().objects.create_user(username='bo', password='pw')
+        self.assertEqual(search_usernames('bo')[0], 'bo')
+
+    def test_empty_query_lists_users(self):
+        self.assertEqual(len(search_usernames('')), 5)
+        self.assertEqual(len(search_usernames('  ', limit=2)), 2)
+
+    def test_cache_keys_do_not_embed_the_query(self):
+        query = 'bo b\n' + 'x' * 300
+        search_usernames(query)
+        self.assertNotIn(query.strip(), cache_key(query.strip()))
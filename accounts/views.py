@@ -7,7 +7,8 @@ from django.views.decorators.csrf import csrf_exempt
 import json
 from rest_framework.decorators import api_view
 from rest_framework import status
-from django.db.models import Q
+from .autocomplete import search_usernames
+from tasks import readcache
 
 CustomUser = get_user_model()
 
@@ -24,20 +25,20 @@ def current_user(request):
     
 @api_view(['GET'])
 def get_user_by_username(request, username):
-    try:
-        user = CustomUser.objects.get(username=username)
-        return Response({
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-        }, status=status.HTTP_200_OK)
-    except CustomUser.DoesNotExist:
+    user = readcache.get_user_by_username(username)
+    if user is None:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+    }, status=status.HTTP_200_OK)
     
 def search_users(request):
     query = request.GET.get('q', '')
-    users = CustomUser.objects.filter(Q(username__icontains=query))[:10]  # Limit to 10 results
-    users_data = [{'username': user.username} for user in users]
+    # Prefix matches first, answered from the autocomplete cache when possible
+    usernames = search_usernames(query, limit=10)  # Limit to 10 results
+    users_data = [{'username': username} for username in usernames]
     return JsonResponse(users_data, safe=False)
     
 @csrf_exempt
@@ -48,14 +48,88 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = 'task_manager.asgi.application'
 
+# Postgres LISTEN/NOTIFY layer so several daphne processes share groups;
+# replaced by the in-memory layer below when the database is not PostgreSQL
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'tasks.layers.PostgresChannelLayer',
+        'CONFIG': {
+            'database': 'default',
+            'capacity': 100,
+            'expiry': 60,
+            'group_expiry': 86400,
+        },
     },
 }
 
+# Chat messages are broadcast immediately and written in batches; use
+# 'write_through' to persist each message before it is broadcast. While
+# the database is unreachable at most MAX_BUFFERED messages are kept
+CHAT_PERSISTENCE = {
+    'MODE': 'write_behind',
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.25,
+    'MAX_PENDING': 5000,
+    'MAX_BUFFERED': 50000,
+}
+
+# Replay buffer for WebSocket group events (tasks.streams): clients that
+# reconnect with resume_from=<seq> get the events they missed. With more
+# than one process CACHE must be shared by all of them (check tasks.W001)
+WS_STREAM = {
+    'CACHE': 'default',
+    'BUFFER_SIZE': 500,
+    'RETENTION': 300,
+}
+
+# Activity logs and chat messages older than HOT_DAYS are moved into
+# compressed archive segments by the archive_history command, and archived
+# rows older than RETENTION_DAYS (None keeps them) are deleted
+HISTORY_ARCHIVE = {
+    'HOT_DAYS': 90,
+    'SEGMENT_SIZE': 500,
+    'RETENTION_DAYS': None,
+}
+
+# Deadline reminders sent by the run_reminders worker, times in seconds.
+# IN_PROCESS None runs the worker inside the web process instead when the
+# channel layer is the in-memory one
+REMINDERS = {
+    'CHANNEL': 'task-reminders',
+    'DUE_SOON': 60 * 60,
+    'HORIZON': 24 * 60 * 60,
+    'RELOAD_INTERVAL': 60 * 60,
+    'IN_PROCESS': None,
+}
+
+# WebSocket notifications of task changes are written to an outbox in the
+# change's transaction and published after commit: by a thread in each web
+# process ('thread'), in the committing request ('inline') or only by the
+# run_outbox command ('worker'); 'thread' drains inline with the in-memory
+# channel layer. Failed publishes are retried with backoff (seconds) and
+# dead-lettered after MAX_ATTEMPTS; a dispatcher that dies mid-publish
+# holds its claimed events for CLAIM_TIMEOUT seconds
+OUTBOX = {
+    'MODE': 'thread',
+    'BATCH_SIZE': 200,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 10,
+    'RETRY_DELAY': 1.0,
+    'MAX_RETRY_DELAY': 5 * 60,
+    'CLAIM_TIMEOUT': 60,
+}
+
+# Per-request latency and SQL numbers (tasks.middleware), served with the
+# other process metrics at /metrics
+REQUEST_METRICS = {
+    'SERVER_TIMING': True,
+    'DUPLICATE_THRESHOLD': 10,
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
 MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'tasks.middleware.QueryMetricsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -118,6 +192,46 @@ DATABASES = {
     }
 }
 
+# The Postgres channel layer needs a PostgreSQL database; anything else
+# (e.g. SQLite for local development) gets the single-process layer
+if DATABASES[CHANNEL_LAYERS['default']['CONFIG']['database']]['ENGINE'] not in (
+    'django.db.backends.postgresql',
+    'django.contrib.gis.db.backends.postgis',
+):
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+# Cache
+# Local memory is per process, which is enough for the single daphne
+# process of the Procfile (see READ_CACHE['SHARED']); point this at a
+# shared cache (Redis, Memcached) when running several daphne processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'task-manager',
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    }
+}
+
+# Cache alias holding the project membership index (tasks.membership);
+# bypassed when it is per process, like READ_CACHE (check tasks.W001)
+MEMBERSHIP_CACHE = 'default'
+
+# Read-through cache for project details, member lists and users
+# (tasks.readcache); TIMEOUT in seconds. The authenticated user, version
+# based ETags and the membership index only use it when CACHE is shared by
+# every process. The Procfile runs a single daphne process, so SHARED is
+# True: its LocMemCache is shared by every request, and tasks.W001 is not
+# raised. Set SHARED to None (or move to Redis/Memcached) before running
+# more than one web process.
+READ_CACHE = {
+    'CACHE': 'default',
+    'TIMEOUT': 5 * 60,
+    'SHARED': True,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -163,7 +277,8 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Add-on
 
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    # ModelBackend with request.user read through tasks.readcache
+    'accounts.backends.CachedModelBackend',
 ]
 
 AUTH_USER_MODEL = 'accounts.CustomUser'
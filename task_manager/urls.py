@@ -2,11 +2,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from .views import site_status
+from .views import metrics, site_status
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
     path('api/', include('tasks.urls')),
+    path('metrics', metrics),
     path('', site_status),
 ]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
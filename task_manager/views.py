@@ -1,4 +1,14 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from tasks import metrics as process_metrics
 
 def site_status(request):
-    return HttpResponse("This site is working.")
\ No newline at end of file
+    return HttpResponse("This site is working.")
+
+def metrics(request):
+    # Prometheus scrape target, see tasks.metrics
+    token = process_metrics.get_config()['TOKEN']
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(process_metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
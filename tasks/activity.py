@@ -0,0 +1,39 @@
+from .analytics import record_logs
+from .models import ActivityLog
+
+# Logs of created and deleted tasks carry the task's status in to_status /
+# from_status; with task set they feed the analytics rollups
+
+def create_activity_log(user, project, action, task_title, from_status=None, to_status=None, edited_fields=None, task=None):
+    activity_log = build_activity_log(user, project, action, task_title, from_status, to_status, edited_fields, task)
+    activity_log.save()
+    record_logs([activity_log])
+    return activity_log
+
+def build_activity_log(user, project, action, task_title, from_status=None, to_status=None, edited_fields=None, task=None):
+    # Unsaved ActivityLog, so batch paths can write many with one bulk_create
+    # Check if edited_fields are provided and are valid
+    if edited_fields:
+        formatted_edited_fields = []
+        for field in edited_fields:
+            # Check that both from_value and to_value are not None
+            from_value = field.get('from_value', 'None')
+            to_value = field.get('to_value', 'None')
+            field_name = field.get('field', 'undefined')
+
+            formatted_edited_fields.append(f"{field_name}: '{from_value}' to '{to_value}'")
+
+        edited_fields_str = ', '.join(formatted_edited_fields) if formatted_edited_fields else None
+    else:
+        edited_fields_str = None
+
+    return ActivityLog(
+        user=user,
+        project=project,
+        action=action,
+        task_title=task_title,
+        from_status=from_status,
+        to_status=to_status,
+        edited_fields=edited_fields_str,
+        task=task,
+    )
@@ -0,0 +1,242 @@
+import heapq
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Min, Sum
+from django.utils import timezone
+
+from .archive import ACTIVITY_LOG, iter_archived, to_instance
+from .models import ActivityLog, ProjectStatusDay, Task, TaskStatusPeriod
+
+# Rollups behind the analytics endpoint. Every created / moved / deleted
+# activity log updates per project, day and status counters (tasks that
+# entered and left the status, plus cycle times of tasks reaching Done)
+# and the task's status periods. Charts then read one row per day and
+# status instead of scanning the logs.
+#
+# Cycle time runs from the first time a task left To-Do (or from its
+# creation if it went straight to Done) to its arrival in Done.
+TODO = 'To-Do'
+DONE = 'Done'
+STATUSES = [value for value, _ in Task._meta.get_field('status').choices]
+TRACKED_ACTIONS = ('created', 'moved', 'deleted')
+
+
+class Rollup:
+    """
+    Replays activity logs in time order into counters and status periods,
+    then writes them: as increments on top of the existing rollups for live
+    writes, or as fresh rows when rebuilding a project.
+
+    Logs written before rollups existed may lack the task link and the
+    status of created / deleted tasks; those are filled in from the task's
+    title and from later logs where possible.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(Counter)
+        self.status = {}
+        self.created = {}
+        self.work_started = {}
+        self.open_periods = {}
+        self.new_periods = []
+        self.closed_periods = []
+        # created logs whose status is only known once the task moves
+        self.pending = {}
+
+    def load(self, task_ids):
+        # Current state of tasks that already have rollups
+        for period in TaskStatusPeriod.objects.filter(task_id__in=task_ids, ended_at__isnull=True):
+            self.open_periods[period.task_id] = period
+            self.status[period.task_id] = period.status
+        starts = (
+            TaskStatusPeriod.objects.filter(task_id__in=task_ids)
+            .values('task_id', 'status')
+            .annotate(started_at=Min('started_at'))
+        )
+        for row in starts:
+            task_id, started_at = row['task_id'], row['started_at']
+            self.created[task_id] = min(self.created.get(task_id, started_at), started_at)
+            if row['status'] != TODO:
+                self.work_started[task_id] = min(self.work_started.get(task_id, started_at), started_at)
+
+    def add(self, project_id, day, status, **counts):
+        self.counters[(project_id, day, status)].update(counts)
+
+    def enter(self, project_id, task, status, at):
+        self.add(project_id, timezone.localdate(at), status, entered=1)
+        self.status[task] = status
+        self.created.setdefault(task, at)
+        if isinstance(task, int):
+            period = TaskStatusPeriod(project_id=project_id, task_id=task, status=status, started_at=at)
+            self.open_periods[task] = period
+            self.new_periods.append(period)
+
+    def leave(self, project_id, task, status, at):
+        self.add(project_id, timezone.localdate(at), status, exited=1)
+        period = self.open_periods.pop(task, None)
+        if period is not None:
+            period.ended_at = at
+            if period.pk is not None:
+                self.closed_periods.append(period)
+
+    def apply(self, log, task):
+        # task: the task id, or a title key for unlinked old logs
+        if log.action == 'created':
+            if log.to_status:
+                self.enter(log.project_id, task, log.to_status, log.timestamp)
+                if log.to_status != TODO:
+                    self.work_started.setdefault(task, log.timestamp)
+            else:
+                self.pending[task] = (log.project_id, log.timestamp)
+            return
+
+        if task in self.pending:
+            project_id, created_at = self.pending.pop(task)
+            self.enter(project_id, task, log.from_status or TODO, created_at)
+
+        current = log.from_status or self.status.get(task) or TODO
+        self.leave(log.project_id, task, current, log.timestamp)
+        self.status.pop(task, None)
+        if log.action == 'deleted':
+            return
+
+        if log.to_status == DONE:
+            start = self.work_started.get(task, self.created.get(task))
+            if start is not None:
+                self.add(
+                    log.project_id, timezone.localdate(log.timestamp), DONE,
+                    cycle_count=1, cycle_seconds=(log.timestamp - start).total_seconds(),
+                )
+        if log.to_status != TODO:
+            self.work_started.setdefault(task, log.timestamp)
+        self.enter(log.project_id, task, log.to_status, log.timestamp)
+
+    def finish(self, current_statuses):
+        # Created tasks that never moved are in their current status
+        for task, (project_id, created_at) in self.pending.items():
+            self.enter(project_id, task, current_statuses.get(task, TODO), created_at)
+        self.pending = {}
+
+    def write(self, fresh=False):
+        TaskStatusPeriod.objects.bulk_create(self.new_periods)
+        TaskStatusPeriod.objects.bulk_update(self.closed_periods, ['ended_at'])
+        if fresh:
+            ProjectStatusDay.objects.bulk_create(
+                [ProjectStatusDay(project_id=project_id, day=day, status=status, **counts) for (project_id, day, status), counts in self.counters.items()],
+                batch_size=1000,
+            )
+            return
+        for (project_id, day, status), counts in self.counters.items():
+            increment(project_id, day, status, counts)
+
+
+def increment(project_id, day, status, counts):
+    rows = ProjectStatusDay.objects.filter(project_id=project_id, day=day, status=status)
+    increments = {field: F(field) + value for field, value in counts.items()}
+    if rows.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            ProjectStatusDay.objects.create(project_id=project_id, day=day, status=status, **counts)
+    except IntegrityError:
+        # Created concurrently since the update above
+        rows.update(**increments)
+
+
+def record_logs(logs):
+    """
+    Updates the rollups for freshly written activity logs. Created logs
+    carry the task's status in to_status, deleted logs in from_status.
+    """
+    logs = [log for log in logs if log.task_id is not None and log.action in TRACKED_ACTIONS]
+    if not logs:
+        return
+    rollup = Rollup()
+    rollup.load({log.task_id for log in logs})
+    for log in sorted(logs, key=lambda log: (log.timestamp, log.id or 0)):
+        rollup.apply(log, log.task_id)
+    rollup.write()
+
+
+def rebuild_project(project_id):
+    """
+    Recomputes a project's rollups from all of its activity logs, archived
+    ones included. Returns the number of logs replayed.
+    """
+    tasks = Task.objects.filter(project_id=project_id).values_list('id', 'title', 'status')
+    statuses, titles, duplicates = {}, {}, set()
+    for task_id, title, status in tasks:
+        statuses[task_id] = status
+        if title in titles:
+            duplicates.add(title)
+        titles[title] = task_id
+
+    def task_key(log):
+        if log.task_id is not None:
+            return log.task_id
+        if log.task_title in titles and log.task_title not in duplicates:
+            return titles[log.task_title]
+        return ('title', log.task_title)
+
+    hot = ActivityLog.objects.filter(project_id=project_id, action__in=TRACKED_ACTIONS).order_by('timestamp', 'id').iterator(chunk_size=2000)
+    archived = (to_instance(ACTIVITY_LOG, {**record, 'project_id': project_id}) for record in iter_archived(project_id, ACTIVITY_LOG))
+    rollup = Rollup()
+    replayed = 0
+    with transaction.atomic():
+        ProjectStatusDay.objects.filter(project_id=project_id).delete()
+        TaskStatusPeriod.objects.filter(project_id=project_id).delete()
+        for log in heapq.merge(archived, hot, key=lambda log: (log.timestamp, log.id)):
+            if log.action in TRACKED_ACTIONS:
+                rollup.apply(log, task_key(log))
+                replayed += 1
+        rollup.finish(statuses)
+        rollup.write(fresh=True)
+    return replayed
+
+
+def project_analytics(project_id, start, end):
+    """
+    Cumulative flow, throughput and cycle time for each day from start to
+    end (dates, inclusive), read from the daily rollups.
+    """
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    rows = ProjectStatusDay.objects.filter(project_id=project_id)
+
+    # Tasks in each status at the start of the window
+    in_status = Counter()
+    for row in rows.filter(day__lt=start).values('status').annotate(entered=Sum('entered'), exited=Sum('exited')):
+        in_status[row['status']] = row['entered'] - row['exited']
+
+    by_day = defaultdict(dict)
+    for row in rows.filter(day__gte=start, day__lte=end):
+        by_day[row.day][row.status] = row
+
+    statuses = STATUSES + sorted({status for day in by_day.values() for status in day} - set(STATUSES))
+    cumulative_flow = {status: [] for status in statuses}
+    throughput, cycle_time = [], []
+    completed, cycle_seconds = 0, 0.0
+    for day in days:
+        for status in statuses:
+            row = by_day[day].get(status)
+            if row is not None:
+                in_status[status] += row.entered - row.exited
+            cumulative_flow[status].append(in_status[status])
+        done = by_day[day].get(DONE)
+        throughput.append(done.entered if done else 0)
+        if done and done.cycle_count:
+            cycle_time.append(done.cycle_seconds / done.cycle_count)
+            completed += done.cycle_count
+            cycle_seconds += done.cycle_seconds
+        else:
+            cycle_time.append(None)
+
+    return {
+        'days': days,
+        'statuses': statuses,
+        'cumulative_flow': cumulative_flow,
+        'throughput': throughput,
+        'cycle_time': cycle_time,
+        'average_cycle_time': cycle_seconds / completed if completed else None,
+    }
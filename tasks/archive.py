@@ -0,0 +1,242 @@
+import json
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ActivityLog, ChatMessage, HistorySegment
+from .revisions import bump_revisions
+
+# Hot/cold tiering for activity logs and chat messages. Rows older than
+# HOT_DAYS leave their tables in segments of up to SEGMENT_SIZE rows per
+# project, stored zlib-compressed as one HistorySegment row each, so the
+# hot tables stay small. The history endpoints merge segments back in when
+# a page reaches past the hot rows (see tasks.pagination), and segments
+# whose newest row is older than RETENTION_DAYS are deleted.
+ACTIVITY_LOG = 'activity_log'
+CHAT_MESSAGE = 'chat_message'
+
+DEFAULTS = {
+    'HOT_DAYS': 90,
+    'SEGMENT_SIZE': 500,
+    'RETENTION_DAYS': None,
+}
+
+# kind: (model, [(column, lookup), ...]), columns as in tasks.export
+KINDS = {
+    ACTIVITY_LOG: (ActivityLog, [
+        ('id', 'id'), ('user_id', 'user_id'), ('username', 'user__username'), ('action', 'action'),
+        ('task_title', 'task_title'), ('from_status', 'from_status'), ('to_status', 'to_status'),
+        ('edited_fields', 'edited_fields'), ('timestamp', 'timestamp'), ('task_id', 'task_id'),
+    ]),
+    CHAT_MESSAGE: (ChatMessage, [
+        ('id', 'id'), ('user_id', 'user_id'), ('username', 'user__username'),
+        ('message', 'message'), ('timestamp', 'timestamp'),
+    ]),
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'HISTORY_ARCHIVE', {})}
+
+
+# Storage
+
+PARTITIONED_TABLE = """
+    CREATE TABLE tasks_historysegment (
+        id bigserial NOT NULL,
+        project_id bigint NOT NULL REFERENCES tasks_project (id) DEFERRABLE INITIALLY DEFERRED,
+        kind varchar(20) NOT NULL,
+        first_timestamp timestamp with time zone NOT NULL,
+        first_id bigint NOT NULL,
+        last_timestamp timestamp with time zone NOT NULL,
+        last_id bigint NOT NULL,
+        row_count integer NOT NULL,
+        payload bytea NOT NULL,
+        PRIMARY KEY (id, first_timestamp)
+    ) PARTITION BY RANGE (first_timestamp)
+"""
+
+
+def create_segment_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(apps.get_model('tasks', 'HistorySegment'))
+        return
+    # Monthly partitions are added by ensure_partition as segments are
+    # written; the default partition only catches what slips past it
+    schema_editor.execute(PARTITIONED_TABLE)
+    schema_editor.execute('CREATE TABLE tasks_historysegment_default PARTITION OF tasks_historysegment DEFAULT')
+    schema_editor.execute('CREATE INDEX historysegment_last ON tasks_historysegment (project_id, kind, last_timestamp, last_id)')
+    schema_editor.execute('CREATE INDEX historysegment_first ON tasks_historysegment (project_id, kind, first_timestamp, first_id)')
+
+
+def drop_segment_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.delete_model(apps.get_model('tasks', 'HistorySegment'))
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS tasks_historysegment CASCADE')
+
+
+def ensure_partition(timestamp):
+    # Monthly partition holding segments that start at timestamp
+    if connection.vendor != 'postgresql':
+        return
+    start = timestamp.astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS tasks_historysegment_{start:%Y%m} PARTITION OF tasks_historysegment '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+
+def encode_segment(names, rows):
+    rows = [[value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows]
+    return zlib.compress(json.dumps({'columns': names, 'rows': rows}, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_segment(payload):
+    data = json.loads(zlib.decompress(bytes(payload)))
+    records = [dict(zip(data['columns'], row)) for row in data['rows']]
+    for record in records:
+        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+    return records
+
+
+# Moving rows
+
+def archive_project(project_id, kind, cutoff, segment_size=None):
+    """
+    Moves the project's rows of kind older than cutoff into segments, oldest
+    first, one transaction per segment. Returns the number of rows moved.
+    """
+    model, columns = KINDS[kind]
+    segment_size = segment_size or get_config()['SEGMENT_SIZE']
+    names = [name for name, _ in columns]
+    lookups = [lookup for _, lookup in columns]
+
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                model.objects.filter(project_id=project_id, timestamp__lt=cutoff)
+                .order_by('timestamp', 'id')
+                .values_list(*lookups)[:segment_size]
+            )
+            if not rows:
+                break
+            first, last = dict(zip(names, rows[0])), dict(zip(names, rows[-1]))
+            ensure_partition(first['timestamp'])
+            HistorySegment.objects.create(
+                project_id=project_id,
+                kind=kind,
+                first_timestamp=first['timestamp'],
+                first_id=first['id'],
+                last_timestamp=last['timestamp'],
+                last_id=last['id'],
+                row_count=len(rows),
+                payload=encode_segment(names, rows),
+            )
+            model.objects.filter(id__in=[row[0] for row in rows]).delete()
+        moved += len(rows)
+        if len(rows) < segment_size:
+            break
+    return moved
+
+
+def archive_history(hot_days=None, segment_size=None, project_id=None):
+    """
+    Archives every project's activity logs and chat messages older than
+    hot_days. Returns {kind: rows moved}.
+    """
+    config = get_config()
+    cutoff = timezone.now() - timedelta(days=config['HOT_DAYS'] if hot_days is None else hot_days)
+    moved = {}
+    for kind, (model, _) in KINDS.items():
+        old_rows = model.objects.filter(timestamp__lt=cutoff)
+        if project_id is not None:
+            old_rows = old_rows.filter(project_id=project_id)
+        project_ids = old_rows.order_by().values_list('project_id', flat=True).distinct()
+        moved[kind] = sum(archive_project(project_id, kind, cutoff, segment_size) for project_id in project_ids)
+    return moved
+
+
+def apply_retention(retention_days=None):
+    # Deletes segments whose rows are all older than the retention period
+    retention_days = get_config()['RETENTION_DAYS'] if retention_days is None else retention_days
+    if retention_days is None:
+        return 0
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    with transaction.atomic():
+        expired = HistorySegment.objects.filter(last_timestamp__lt=cutoff)
+        project_ids = set(expired.order_by().values_list('project_id', flat=True).distinct())
+        deleted, _ = expired.delete()
+        bump_revisions(project_ids)
+    return deleted
+
+
+# Reading
+
+def key(row):
+    return (row.timestamp, row.id)
+
+
+def to_instance(kind, record):
+    # Unsaved model instance, enough for the history serializers
+    model, _ = KINDS[kind]
+    User = get_user_model()
+    fields = {name: value for name, value in record.items() if name not in ('user_id', 'username')}
+    return model(user=User(id=record['user_id'], username=record['username']), **fields)
+
+
+def merge_page(project_id, kind, rows, limit, before=None, after=None):
+    """
+    Merges archived rows into rows, a page of hot rows read the same way:
+    newest first before the (timestamp, id) cursor before, or oldest first
+    after the cursor after. Segments are read in key order until none of the
+    remaining ones can contribute to the first limit rows.
+    """
+    newest_first = after is None
+    segments = HistorySegment.objects.filter(project_id=project_id, kind=kind)
+    if newest_first:
+        if before is not None:
+            timestamp, pk = before
+            segments = segments.filter(Q(first_timestamp__lt=timestamp) | Q(first_timestamp=timestamp, first_id__lt=pk))
+        segments = segments.order_by('-last_timestamp', '-last_id')
+    else:
+        timestamp, pk = after
+        segments = segments.filter(Q(last_timestamp__gt=timestamp) | Q(last_timestamp=timestamp, last_id__gt=pk))
+        segments = segments.order_by('first_timestamp', 'first_id')
+
+    rows = list(rows)
+    bounds = segments.values_list('id', 'first_timestamp', 'first_id', 'last_timestamp', 'last_id')
+    for segment_id, first_timestamp, first_id, last_timestamp, last_id in bounds.iterator(chunk_size=20):
+        if len(rows) >= limit:
+            edge = key(rows[limit - 1])
+            if newest_first and edge > (last_timestamp, last_id):
+                break
+            if not newest_first and edge < (first_timestamp, first_id):
+                break
+
+        payload = HistorySegment.objects.filter(id=segment_id).values_list('payload', flat=True).get()
+        for record in decode_segment(payload):
+            row_key = (record['timestamp'], record['id'])
+            if before is not None and row_key >= tuple(before):
+                continue
+            if after is not None and row_key <= tuple(after):
+                continue
+            rows.append(to_instance(kind, record))
+        rows.sort(key=key, reverse=newest_first)
+        rows = rows[:limit]
+    return rows
+
+
+def iter_archived(project_id, kind):
+    # Every archived row of the project as a dict, oldest segment first
+    segments = HistorySegment.objects.filter(project_id=project_id, kind=kind).order_by('first_timestamp', 'first_id')
+    for payload in segments.values_list('payload', flat=True).iterator(chunk_size=20):
+        yield from decode_segment(payload)
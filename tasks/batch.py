@@ -0,0 +1,178 @@
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .activity import build_activity_log
+from .analytics import record_logs
+from .models import ActivityLog, Task
+from .ordering import ORDER_GAP, next_order
+from .reminders import reload_requested
+from .revisions import TASK, collect_changes, record_changes
+from .serializers import TaskSerializer
+
+OPERATIONS = ('create', 'update', 'delete')
+# Changes to these fields are recorded as an 'edited' activity log
+LOGGED_FIELDS = ('title', 'description')
+
+
+def apply_batch(project, user, operations):
+    """
+    Validates and applies a list of create/update/delete operations on a
+    project's tasks in one transaction. Rows are written with bulk_create /
+    bulk_update, owner links and activity logs with one bulk insert each.
+    Nothing is written if any operation is invalid.
+
+    Returns {'created': [...], 'updated': [...], 'deleted': [...]} with the
+    tasks that were created or updated and the ids that were deleted.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValidationError({'operations': 'operations must be a non-empty list.'})
+
+    referenced = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise ValidationError({'operations': {index: f"op must be one of {', '.join(OPERATIONS)}."}})
+        if operation['op'] != 'create':
+            if 'id' not in operation:
+                raise ValidationError({'operations': {index: 'id is required.'}})
+            if isinstance(operation['id'], bool) or not isinstance(operation['id'], int):
+                raise ValidationError({'operations': {index: 'id must be an integer.'}})
+            referenced.append(operation['id'])
+    if len(referenced) != len(set(referenced)):
+        raise ValidationError({'operations': 'A task can only appear in one operation per batch.'})
+
+    with transaction.atomic(), collect_changes():
+        existing = {
+            task.id: task
+            for task in Task.objects.select_for_update().filter(project=project, id__in=referenced).prefetch_related('owner')
+        }
+        missing = [task_id for task_id in referenced if task_id not in existing]
+        if missing:
+            raise ValidationError({'operations': f"Tasks {missing} are not in this project."})
+
+        creates, updates, deletes = validate_operations(project, operations, existing)
+
+        now = timezone.now()
+        logs = []
+        owner_links = []
+        Through = Task.owner.through
+        task_field = Task.owner.field.m2m_field_name()
+        user_field = Task.owner.field.m2m_reverse_field_name()
+
+        # Tasks created in or moved to a column without a rank are appended
+        # to it, in operation order
+        ranks = {}
+
+        def append_rank(status):
+            if status not in ranks:
+                ranks[status] = next_order(project.id, status) - ORDER_GAP
+            ranks[status] += ORDER_GAP
+            return ranks[status]
+
+        # Creates
+        new_tasks = []
+        new_owners = []
+        for data in creates:
+            owners = data.pop('owner', [])
+            if 'order' not in data:
+                data['order'] = append_rank(data.get('status'))
+            new_tasks.append(Task(project=project, **data))
+            new_owners.append(owners)
+        Task.objects.bulk_create(new_tasks)
+        for task, owners in zip(new_tasks, new_owners):
+            owner_links.extend(Through(**{f'{task_field}_id': task.id, f'{user_field}_id': owner.id}) for owner in owners)
+            logs.append(build_activity_log(user=user, project=project, action='created', task_title=task.title, to_status=task.status, task=task))
+
+        # Updates
+        updated_fields = {'updated_at'}
+        replaced_owners = []
+        for task, data in updates:
+            original_status = task.status
+            edited_fields = []
+            for field in LOGGED_FIELDS:
+                if field in data and data[field] != getattr(task, field):
+                    edited_fields.append({
+                        'field': field,
+                        'from_value': getattr(task, field) or 'None',
+                        'to_value': data[field] or 'None',
+                    })
+            if 'owner' in data:
+                old_owners = sorted(owner.username for owner in task.owner.all())
+                owners = data.pop('owner')
+                new_usernames = sorted(owner.username for owner in owners)
+                if old_owners != new_usernames:
+                    edited_fields.append({
+                        'field': 'owner',
+                        'from_value': ', '.join(old_owners) if old_owners else 'None',
+                        'to_value': ', '.join(new_usernames) if new_usernames else 'None',
+                    })
+                replaced_owners.append(task.id)
+                owner_links.extend(Through(**{f'{task_field}_id': task.id, f'{user_field}_id': owner.id}) for owner in owners)
+
+            if data.get('status', original_status) != original_status and 'order' not in data:
+                data['order'] = append_rank(data['status'])
+            for field, value in data.items():
+                setattr(task, field, value)
+                updated_fields.add(field)
+            task.updated_at = now
+
+            if task.status != original_status:
+                logs.append(build_activity_log(user=user, project=project, action='moved', task_title=task.title, from_status=original_status, to_status=task.status, task=task))
+            elif edited_fields:
+                logs.append(build_activity_log(user=user, project=project, action='edited', task_title=task.title, edited_fields=edited_fields, task=task))
+        if updates:
+            Task.objects.bulk_update([task for task, _ in updates], sorted(updated_fields))
+        if replaced_owners:
+            Through.objects.filter(**{f'{task_field}_id__in': replaced_owners}).delete()
+
+        # Deletes
+        for task in deletes:
+            logs.append(build_activity_log(user=user, project=project, action='deleted', task_title=task.title, from_status=task.status, task=task))
+        if deletes:
+            Task.objects.filter(id__in=[task.id for task in deletes]).delete()
+
+        Through.objects.bulk_create(owner_links, ignore_conflicts=True)
+        ActivityLog.objects.bulk_create(logs)
+        record_logs(logs)
+        # bulk writes skip post_save, deletes are recorded by the signals
+        record_changes(project.id, TASK, [task.id for task in new_tasks] + [task.id for task, _ in updates])
+        # Any write to a task with a deadline may change its reminders
+        if any(task.deadline for task in new_tasks) or any(task.deadline or 'deadline' in data for task, data in updates):
+            reload_requested()
+
+    changed_ids = [task.id for task in new_tasks] + [task.id for task, _ in updates]
+    changed = {task.id: task for task in Task.objects.filter(id__in=changed_ids).prefetch_related('owner')}
+    return {
+        'created': [changed[task.id] for task in new_tasks],
+        'updated': [changed[task.id] for task, _ in updates],
+        'deleted': [task.id for task in deletes],
+    }
+
+
+def validate_operations(project, operations, existing):
+    creates, updates, deletes = [], [], []
+    errors = {}
+    for index, operation in enumerate(operations):
+        if operation['op'] == 'delete':
+            deletes.append(existing[operation['id']])
+            continue
+
+        data = {**operation.get('data', {}), 'project': project.id}
+        if operation['op'] == 'create':
+            serializer = TaskSerializer(data=data)
+        else:
+            serializer = TaskSerializer(existing[operation['id']], data=data, partial=True)
+        if not serializer.is_valid():
+            errors[index] = serializer.errors
+            continue
+
+        validated = dict(serializer.validated_data)
+        validated.pop('project', None)
+        if operation['op'] == 'create':
+            creates.append(validated)
+        else:
+            updates.append((existing[operation['id']], validated))
+
+    if errors:
+        raise ValidationError({'operations': errors})
+    return creates, updates, deletes
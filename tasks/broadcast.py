@@ -0,0 +1,93 @@
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import metrics
+from .streams import current_seq, missed_frames, next_seq, remember_frame
+
+# Every group event travels as a pre-encoded JSON text frame. The sender
+# serializes once and consumers write the same immutable string to their
+# socket, so fan-out cost no longer grows with json.dumps per subscriber.
+FRAME_EVENT_TYPE = 'broadcast.frame'
+
+
+def task_group_name(project_id):
+    return f"task_group_{project_id}"
+
+
+def chat_group_name(project_id):
+    return f"chat_{project_id}"
+
+
+def layer_spans_processes():
+    # The in-memory layer only reaches consumers of this process, and only
+    # safely from the event loop they run on
+    return not isinstance(get_channel_layer(), InMemoryChannelLayer)
+
+
+def encode_frame(payload):
+    return json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+async def group_broadcast(group, payload):
+    await group_broadcast_many(group, [payload])
+
+
+async def group_broadcast_many(group, payloads):
+    # Sequenced and kept in the group's replay buffer, see tasks.streams.
+    # Several payloads go out in one group_send (see tasks.outbox), each
+    # still its own frame with its own seq
+    frames = []
+    for payload in payloads:
+        seq = await next_seq(group)
+        frame = encode_frame({'seq': seq, **payload})
+        await remember_frame(group, seq, frame)
+        frames.append(frame)
+
+    event = {
+        'type': FRAME_EVENT_TYPE,
+        # For the delivery latency metric
+        'sent_at': time.time(),
+    }
+    if len(frames) == 1:
+        event['frame'] = frames[0]
+    else:
+        event['frames'] = frames
+    channel_layer = get_channel_layer()
+    await channel_layer.group_send(group, event)
+
+
+def broadcast(group, payload):
+    try:
+        async_to_sync(group_broadcast)(group, payload)
+    except Exception:
+        metrics.ws_broadcast_errors.inc()
+        raise
+
+
+class BroadcastFrameMixin:
+    # Handler for FRAME_EVENT_TYPE events on AsyncWebsocketConsumer subclasses
+
+    async def broadcast_frame(self, event):
+        for frame in event.get('frames') or [event['frame']]:
+            await self.send(text_data=frame)
+        if 'sent_at' in event:
+            metrics.ws_delivery.observe(max(0.0, time.time() - event['sent_at']), consumer=type(self).__name__)
+
+    async def resume(self, last_seq):
+        # Replays the frames after last_seq, or asks the client to reload
+        # when part of the gap has already been evicted or last_seq is not
+        # a seq at all
+        try:
+            last_seq = int(last_seq)
+        except (TypeError, ValueError):
+            last_seq = -1
+        frames = await missed_frames(self.group_name, last_seq) if last_seq >= 0 else None
+        if frames is None:
+            await self.send(text_data=encode_frame({'resync': True, 'seq': await current_seq(self.group_name)}))
+            return
+        for frame in frames:
+            await self.send(text_data=frame)
@@ -0,0 +1,173 @@
+import asyncio
+import atexit
+import logging
+import threading
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DataError, Error, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND = 'write_behind'
+WRITE_THROUGH = 'write_through'
+
+DEFAULTS = {
+    # write_through persists each message before it is broadcast
+    'MODE': WRITE_BEHIND,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.25,
+    # Senders wait for a flush once this many messages are queued
+    'MAX_PENDING': 5000,
+    # While the database is down, messages past this many are dropped
+    'MAX_BUFFERED': 50000,
+}
+
+
+class ChatWriteBehindQueue:
+    """
+    Buffers chat messages and persists them with bulk_create once BATCH_SIZE
+    messages are queued or FLUSH_INTERVAL seconds have passed. Whatever is
+    still queued when the process exits is written by an atexit hook.
+
+    Messages have already been broadcast, so only rows that fail on their
+    own (IntegrityError, DataError) are dropped. Any other database error,
+    e.g. a lost connection, puts the batch back at the head of the queue
+    for the next flush. During a long outage the queue stops growing at
+    max_buffered messages and newer ones are dropped.
+    """
+
+    def __init__(self, mode=WRITE_BEHIND, batch_size=200, flush_interval=0.25, max_pending=5000, max_buffered=50000):
+        if mode not in (WRITE_BEHIND, WRITE_THROUGH):
+            raise ValueError(f"Unknown chat persistence mode: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup = None
+        self.flusher = None
+        atexit.register(self.flush_sync)
+
+    @classmethod
+    def from_settings(cls):
+        config = {**DEFAULTS, **getattr(settings, 'CHAT_PERSISTENCE', {})}
+        return cls(
+            mode=config['MODE'],
+            batch_size=config['BATCH_SIZE'],
+            flush_interval=config['FLUSH_INTERVAL'],
+            max_pending=config['MAX_PENDING'],
+            max_buffered=config['MAX_BUFFERED'],
+        )
+
+    async def save(self, project_id, user_id, message):
+        from .models import ChatMessage
+
+        chat_message = ChatMessage(project_id=project_id, user_id=user_id, message=message, timestamp=timezone.now())
+        if self.mode == WRITE_THROUGH:
+            await database_sync_to_async(chat_message.save)()
+            return
+
+        with self.lock:
+            full = len(self.pending) >= self.max_buffered
+            if full:
+                self.dropped += 1
+            else:
+                self.pending.append(chat_message)
+            backlog = len(self.pending)
+        if full:
+            logger.error('Chat buffer is full (%d messages), dropped a message for project %s', backlog, project_id)
+        self._ensure_flusher()
+        if backlog >= self.max_pending:
+            await self.flush()
+        elif backlog >= self.batch_size:
+            self.wakeup.set()
+
+    async def flush(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            if not await database_sync_to_async(self._write)(batch):
+                return
+
+    def flush_sync(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            close_old_connections()
+            if not self._write(batch):
+                logger.error('Exiting with %d chat messages that could not be saved', len(self.pending))
+                return
+
+    def _take_batch(self):
+        with self.lock:
+            batch = self.pending[:self.batch_size]
+            del self.pending[:self.batch_size]
+        return batch
+
+    def _requeue(self, batch):
+        with self.lock:
+            self.pending[:0] = batch
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self.flusher is None or self.flusher.done() or self.flusher.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.flusher = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to persist chat messages')
+
+    def _write(self, batch):
+        # True when the batch is done with, False when it was put back
+        from .models import ChatMessage
+
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create(batch)
+            return True
+        except (IntegrityError, DataError):
+            pass
+        except Error as e:
+            # Lost connections too (InterfaceError is not a DatabaseError)
+            logger.warning('Failed to persist chat messages, will retry: %s', e)
+            self._requeue(batch)
+            return False
+
+        # One bad row (e.g. a deleted project) must not take the batch down with it
+        for index, chat_message in enumerate(batch):
+            try:
+                with transaction.atomic():
+                    chat_message.save()
+            except (IntegrityError, DataError) as e:
+                logger.error('Dropped chat message for project %s: %s', chat_message.project_id, e)
+            except Error as e:
+                logger.warning('Failed to persist chat messages, will retry: %s', e)
+                self._requeue(batch[index:])
+                return False
+        return True
+
+
+_queue = None
+
+
+def get_chat_queue():
+    global _queue
+    if _queue is None:
+        _queue = ChatWriteBehindQueue.from_settings()
+    return _queue
@@ -0,0 +1,36 @@
+from channels import DEFAULT_CHANNEL_LAYER
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Warning, register
+
+from .readcache import get_config as read_cache_config
+from .streams import get_config as stream_config
+
+IN_MEMORY_LAYER = 'channels.layers.InMemoryChannelLayer'
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    # Group events fan out to every process, so each process would number
+    # them with its own counter and keep its own replay buffer; membership
+    # changes would only be seen by the process that made them
+    layer = getattr(settings, 'CHANNEL_LAYERS', {}).get(DEFAULT_CHANNEL_LAYER)
+    if layer is None or layer.get('BACKEND') == IN_MEMORY_LAYER:
+        return []
+    # READ_CACHE['SHARED'] = True declares a single web process
+    if read_cache_config()['SHARED']:
+        return []
+    uses = [
+        ("WS_STREAM['CACHE']", stream_config()['CACHE'], 'seqs collide and resuming clients miss events'),
+        ('MEMBERSHIP_CACHE', getattr(settings, 'MEMBERSHIP_CACHE', 'default'), 'membership checks query the database every time'),
+    ]
+    return [
+        Warning(
+            f"{name} ({alias!r}) is a per-process LocMemCache but the channel layer spans processes.",
+            hint=f'Point {name} at a shared cache (Redis, Memcached) or run a single process; otherwise {effect}.',
+            id='tasks.W001',
+        )
+        for name, alias, effect in uses
+        if isinstance(caches[alias], LocMemCache)
+    ]
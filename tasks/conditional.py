@@ -0,0 +1,114 @@
+import hashlib
+
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import readcache
+from .archive import KINDS
+from .models import HistorySegment, Project, Task
+
+# Conditional GET for the polled endpoints. Each one has a validator that
+# costs at most a couple of index lookups: the project revision (bumped by
+# every task and subtask change, see tasks.revisions), the read cache
+# version of the project (details and members, see tasks.readcache), or
+# max id / newest timestamp of the append-mostly history tables together
+# with the project revision, which history deletions also bump.
+# A matching If-None-Match or If-Modified-Since gets a 304 before anything
+# is serialized.
+
+
+def make_etag(request, *parts):
+    # The URL and Accept header are part of every tag: pages, filters and
+    # renderers are different representations
+    key = ':'.join(str(part) for part in (request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), *parts))
+    return '"%s"' % hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def annotate(response, etag=None, last_modified=None):
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Clients may keep the body but have to ask before reusing it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional(request, respond, etag=None, last_modified=None):
+    """
+    Returns 304 Not Modified when the request's validators match, otherwise
+    respond() with ETag / Last-Modified set on successful responses.
+    """
+    if request.method in ('GET', 'HEAD') and (etag is not None or last_modified is not None):
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        if not_modified is not None:
+            return annotate(not_modified, etag, last_modified)
+    response = respond()
+    if response.status_code == 200:
+        annotate(response, etag, last_modified)
+    return response
+
+
+# Validators
+
+def project_revision(project_id):
+    return Project.objects.filter(id=project_id).values_list('revision', flat=True).first()
+
+
+def task_project_revision(task_id):
+    return Task.objects.filter(id=task_id).values_list('project_id', 'project__revision').first()
+
+
+def revision_etag(request, project_id, *parts):
+    # Rather than max(Task.updated_at): subtask and owner changes leave
+    # updated_at alone but do bump the revision
+    revision = project_revision(project_id)
+    return make_etag(request, project_id, revision, *parts) if revision is not None else None
+
+
+def subtask_etag(request, task_id):
+    row = task_project_revision(task_id)
+    return make_etag(request, *row) if row is not None else None
+
+
+def project_etag(request, project_id, *parts):
+    # No query: the project's read cache version, when every process sees
+    # the same one (see readcache.is_shared). With READ_CACHE['SHARED']
+    # off, project details, members and the board carry no ETag and are
+    # always sent in full
+    if not readcache.is_shared():
+        return None
+    return make_etag(request, project_id, readcache.project_version(project_id), *parts)
+
+
+def history_validators(request, kind, project_id):
+    # (etag, last modified) of a project's activity logs or chat messages,
+    # archived segments included. New rows and segments raise a max id;
+    # deleted ones (users removed, segments expired) bump the revision, so
+    # no query has to count the project's history
+    model, _ = KINDS[kind]
+    hot = model.objects.filter(project_id=project_id).aggregate(last_id=Max('id'), last_modified=Max('timestamp'))
+    archived = HistorySegment.objects.filter(project_id=project_id, kind=kind).aggregate(last_id=Max('id'))
+    etag = make_etag(request, kind, project_id, project_revision(project_id), hot['last_id'], archived['last_id'])
+    return etag, hot['last_modified']
+
+
+class ConditionalViewSetMixin:
+    """
+    Conditional list and retrieve for viewsets. get_validators(request)
+    returns (etag, last_modified); either may be None.
+    """
+
+    def get_validators(self, request):
+        return None, None
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        return conditional(request, lambda: super(ConditionalViewSetMixin, self).list(request, *args, **kwargs), etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        return conditional(request, lambda: super(ConditionalViewSetMixin, self).retrieve(request, *args, **kwargs), etag, last_modified)
@@ -1,61 +1,86 @@
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from .models import *
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from .serializers import *
+from .broadcast import BroadcastFrameMixin, chat_group_name, group_broadcast, task_group_name
+from .chat_buffer import get_chat_queue
+from .membership import is_member
+from .reminders import ensure_in_process_worker
+from . import metrics
 
 User = get_user_model()
 
-class TaskConsumer(AsyncWebsocketConsumer):
+class ProjectMemberConsumer(AsyncWebsocketConsumer):
+    # Admits only members of the project in the URL, checked against the
+    # cached membership index instead of the database
+
     async def connect(self):
+        metrics.watch_event_loop()
         self.project_id = self.scope['url_route']['kwargs']['project_id']
-        self.group_name = f"task_group_{self.project_id}"
+        if not await database_sync_to_async(is_member)(self.project_id, self.scope['user']):
+            await self.close()
+            return
+        await self.join()
 
-        # Join room group
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
+    async def join(self):
         await self.accept()
 
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        self.counted_in = getattr(self, 'group_name', '')
+        metrics.ws_open_sockets.inc(consumer=type(self).__name__, group=self.counted_in)
+
     async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if hasattr(self, 'counted_in'):
+            metrics.ws_open_sockets.dec(consumer=type(self).__name__, group=self.counted_in)
+            del self.counted_in
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def websocket_receive(self, message):
+        metrics.ws_messages_received.inc(consumer=type(self).__name__)
+        await super().websocket_receive(message)
+
+    async def send(self, *args, **kwargs):
+        await super().send(*args, **kwargs)
+        metrics.ws_messages_sent.inc(consumer=type(self).__name__)
+
+    async def resume_from_query(self):
+        # ws/...?resume_from=<seq> replays missed events right after joining
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if 'resume_from' in query:
+            await self.resume(query['resume_from'][0])
+
+class TaskConsumer(BroadcastFrameMixin, ProjectMemberConsumer):
+    async def join(self):
+        self.group_name = task_group_name(self.project_id)
+
+        # Join room group
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.resume_from_query()
+        ensure_in_process_worker()
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
+        if 'resume_from' in text_data_json:
+            await self.resume(text_data_json['resume_from'])
+            return
         message = text_data_json['message']
         user = self.scope['user'].username if self.scope['user'].is_authenticated else 'Anonymous'
 
-        # Send message to room group
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                'type': 'task_message',
-                'message': message,
-                'user': user,
-            }
-        )
-
-    async def task_message(self, event):
-        message = event['message']
-        user = event['user']
-
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        # Send message to room group, encoded once for every member
+        await group_broadcast(self.group_name, {
             'message': message,
             'user': user,
-        }))
-        
-    async def subtask_message(self, event):
-        subtask = event['subtask']
-
-        await self.send(text_data=json.dumps({
-            'subtask': subtask,
-        }))
+        })
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.project_id = self.scope['url_route']['kwargs']['project_id']
-        self.group_name = f'chat_{self.project_id}'
+class ChatConsumer(BroadcastFrameMixin, ProjectMemberConsumer):
+    async def join(self):
+        self.group_name = chat_group_name(self.project_id)
 
         await self.channel_layer.group_add(
             self.group_name,
@@ -63,39 +88,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
-
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        await self.resume_from_query()
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if 'resume_from' in data:
+            await self.resume(data['resume_from'])
+            return
         message = data['message']
         user = self.scope['user']
 
-        await self.save_message(user, message)
+        # Queued for a batched write unless CHAT_PERSISTENCE asks for write-through
+        await get_chat_queue().save(self.project_id, user.id, message)
 
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'user': user.username,
-            }
-        )
-
-    async def chat_message(self, event):
-        message = event['message']
-        user = event['user']
-
-        await self.send(text_data=json.dumps({
-            'user': user,
+        await group_broadcast(self.group_name, {
+            'user': user.username,
             'message': message,
-        }))
-
-    @database_sync_to_async
-    def save_message(self, user, message):
-        project = Project.objects.get(id=self.project_id)
-        ChatMessage.objects.create(project=project, user=user, message=message)
\ No newline at end of file
+        })
@@ -0,0 +1,110 @@
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+
+from .models import SubTask, Task
+from .revisions import TASK, record_changes
+
+# Subtask counters on Task: subtask_total and subtask_completed are moved
+# by F() increments in the same UPDATE for every subtask create, toggle
+# and delete (see tasks.signals), so cards can show "3/7" without reading
+# the subtask table. Tasks with auto_percentage get their percentage from
+# the counters in that UPDATE too. Bulk writes that skip the signals, and
+# any drift, are fixed by repair_counts.
+
+
+def auto_percentage(completed, total):
+    # completed and total are expressions for the new counter values
+    return Case(
+        When(auto_percentage=True, then=Case(
+            When(GreaterThan(total, 0), then=completed * 100 / total),
+            default=Value(0),
+            output_field=IntegerField(),
+        )),
+        default=F('percentage'),
+        output_field=IntegerField(),
+    )
+
+
+def adjust(task_id, project_id, total=0, completed=0):
+    if not total and not completed:
+        return
+    new_total = F('subtask_total') + total
+    new_completed = F('subtask_completed') + completed
+    updated = Task.objects.filter(id=task_id).update(
+        subtask_total=new_total,
+        subtask_completed=new_completed,
+        percentage=auto_percentage(new_completed, new_total),
+    )
+    if updated:
+        record_changes(project_id, TASK, [task_id])
+
+
+def subtask_saved(sub_task, created):
+    # _counted is the row before the save, read under a lock by SubTask.save
+    counted = getattr(sub_task, '_counted', None)
+    project_id = sub_task.task.project_id
+    if created or counted is None:
+        adjust(sub_task.task_id, project_id, total=1, completed=int(sub_task.completed))
+    else:
+        task_id, completed = counted
+        if task_id != sub_task.task_id:
+            adjust(task_id, task_project_id(task_id), total=-1, completed=-int(completed))
+            adjust(sub_task.task_id, project_id, total=1, completed=int(sub_task.completed))
+        else:
+            adjust(task_id, project_id, completed=int(sub_task.completed) - int(completed))
+
+
+def subtask_deleting(sub_task):
+    # pre_delete, inside the delete's transaction: the row as the counters
+    # hold it, locked until it is gone
+    sub_task._counted = SubTask.objects.select_for_update().filter(pk=sub_task.pk).values_list('task_id', 'completed').first()
+
+
+def subtask_deleted(sub_task):
+    counted = getattr(sub_task, '_counted', None)
+    if counted is None:
+        # Already deleted by someone else, who moved the counters
+        return
+    task_id, completed = counted
+    adjust(task_id, task_project_id(task_id), total=-1, completed=-int(completed))
+
+
+def task_project_id(task_id):
+    return Task.objects.filter(id=task_id).values_list('project_id', flat=True).first()
+
+
+def repair_counts(project_id=None, batch_size=1000):
+    """
+    Recomputes the counters (and auto percentages) of every task whose
+    counters disagree with its subtasks. Returns the number of tasks fixed.
+    """
+    per_task = SubTask.objects.filter(task=OuterRef('pk')).order_by().values('task')
+    actual_total = Coalesce(Subquery(per_task.annotate(count=Count('id')).values('count')), 0)
+    actual_completed = Coalesce(Subquery(per_task.filter(completed=True).annotate(count=Count('id')).values('count')), 0)
+
+    tasks = Task.objects.all()
+    if project_id is not None:
+        tasks = tasks.filter(project_id=project_id)
+    # Read up front, the batches below change what the query matches
+    drifted = list(
+        tasks.annotate(actual_total=actual_total, actual_completed=actual_completed)
+        .filter(~Q(subtask_total=F('actual_total')) | ~Q(subtask_completed=F('actual_completed')))
+        .order_by('id')
+        .values_list('id', 'project_id')
+    )
+    for start in range(0, len(drifted), batch_size):
+        repair_batch(drifted[start:start + batch_size], actual_total, actual_completed)
+    return len(drifted)
+
+
+def repair_batch(rows, actual_total, actual_completed):
+    task_ids = [task_id for task_id, _ in rows]
+    tasks = Task.objects.filter(id__in=task_ids)
+    tasks.update(subtask_total=actual_total, subtask_completed=actual_completed)
+    tasks.update(percentage=auto_percentage(F('subtask_completed'), F('subtask_total')))
+    by_project = {}
+    for task_id, project_id in rows:
+        by_project.setdefault(project_id, []).append(task_id)
+    for project_id, ids in by_project.items():
+        record_changes(project_id, TASK, ids)
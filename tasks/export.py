@@ -0,0 +1,153 @@
+import csv
+import datetime
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .archive import ACTIVITY_LOG, CHAT_MESSAGE, iter_archived
+from .membership import PROJECT_FIELD, USER_FIELD, Membership
+from .models import ActivityLog, ChatMessage, SubTask, Task
+
+# Whole-project export as NDJSON (every section, one record per line) or
+# CSV (one section per file). Rows are read with .iterator(), which uses a
+# server-side cursor on PostgreSQL, and written out in chunks, so memory
+# stays flat however many log rows a project has. Archived history (see
+# tasks.archive) is exported after the hot rows of its section.
+CHUNK_SIZE = 2000
+FORMATS = ('ndjson', 'csv')
+
+TaskOwner = Task.owner.through
+OWNER_TASK_FIELD = Task.owner.field.m2m_field_name()
+OWNER_USER_FIELD = Task.owner.field.m2m_reverse_field_name()
+
+
+def project_sections(project_id):
+    # (section, queryset, [(column, lookup), ...])
+    return [
+        ('members', Membership.objects.filter(**{f'{PROJECT_FIELD}_id': project_id}), [
+            ('user_id', f'{USER_FIELD}_id'),
+            ('username', f'{USER_FIELD}__username'),
+            ('email', f'{USER_FIELD}__email'),
+        ]),
+        ('tasks', Task.objects.filter(project_id=project_id), [
+            ('id', 'id'), ('title', 'title'), ('description', 'description'), ('status', 'status'),
+            ('order', 'order'), ('percentage', 'percentage'), ('deadline', 'deadline'),
+            ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+        ]),
+        ('task_owners', TaskOwner.objects.filter(**{f'{OWNER_TASK_FIELD}__project_id': project_id}), [
+            ('task_id', f'{OWNER_TASK_FIELD}_id'), ('user_id', f'{OWNER_USER_FIELD}_id'),
+            ('username', f'{OWNER_USER_FIELD}__username'),
+        ]),
+        ('sub_tasks', SubTask.objects.filter(task__project_id=project_id), [
+            ('id', 'id'), ('task_id', 'task_id'), ('title', 'title'),
+            ('description', 'description'), ('completed', 'completed'),
+        ]),
+        ('activity_logs', ActivityLog.objects.filter(project_id=project_id), [
+            ('id', 'id'), ('user_id', 'user_id'), ('username', 'user__username'), ('action', 'action'),
+            ('task_title', 'task_title'), ('from_status', 'from_status'), ('to_status', 'to_status'),
+            ('edited_fields', 'edited_fields'), ('timestamp', 'timestamp'), ('task_id', 'task_id'),
+        ]),
+        ('chat_messages', ChatMessage.objects.filter(project_id=project_id), [
+            ('id', 'id'), ('user_id', 'user_id'), ('username', 'user__username'),
+            ('message', 'message'), ('timestamp', 'timestamp'),
+        ]),
+    ]
+
+
+SECTIONS = [section for section, _, _ in project_sections(0)]
+ARCHIVED_SECTIONS = {'activity_logs': ACTIVITY_LOG, 'chat_messages': CHAT_MESSAGE}
+
+
+def iter_rows(project_id, section, queryset, columns, chunk_size=CHUNK_SIZE):
+    lookups = [lookup for _, lookup in columns]
+    yield from queryset.order_by('id').values_list(*lookups).iterator(chunk_size=chunk_size)
+    if section in ARCHIVED_SECTIONS:
+        names = [name for name, _ in columns]
+        for record in iter_archived(project_id, ARCHIVED_SECTIONS[section]):
+            yield tuple(record.get(name) for name in names)
+
+
+class ExportJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds, exports keep them
+    # exact so history survives a round trip through tasks.importer
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_json(record):
+    return json.dumps(record, cls=ExportJSONEncoder, separators=(',', ':')) + '\n'
+
+
+def export_ndjson(project, chunk_size=CHUNK_SIZE):
+    """
+    Yields the project as NDJSON text chunks: a 'project' record first, then
+    every row of every section tagged with its section name.
+    """
+    yield encode_json({
+        'type': 'project', 'id': project.id, 'name': project.name, 'description': project.description,
+        'manager_id': project.manager_id, 'revision': project.revision,
+        'created_at': project.created_at, 'updated_at': project.updated_at,
+    })
+    for section, queryset, columns in project_sections(project.id):
+        names = [name for name, _ in columns]
+        lines = []
+        for row in iter_rows(project.id, section, queryset, columns, chunk_size):
+            lines.append(encode_json({'type': section, **dict(zip(names, row))}))
+            if len(lines) >= chunk_size:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+
+
+class Echo:
+    # csv.writer target that hands each written line back to the caller
+    def write(self, value):
+        return value
+
+
+def export_csv(project, section, chunk_size=CHUNK_SIZE):
+    """
+    Yields one section of the project as CSV text chunks, header first.
+    """
+    _, queryset, columns = project_sections(project.id)[SECTIONS.index(section)]
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, _ in columns])
+    lines = []
+    for row in iter_rows(project.id, section, queryset, columns, chunk_size):
+        lines.append(writer.writerow(row))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def export_project(project, format='ndjson', section=None, chunk_size=CHUNK_SIZE):
+    # Arguments are checked here, before anything has been streamed
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format}, expected one of {', '.join(FORMATS)}.")
+    if format == 'ndjson':
+        return export_ndjson(project, chunk_size)
+    if section not in SECTIONS:
+        raise ValueError(f"CSV exports one section at a time, section must be one of {', '.join(SECTIONS)}.")
+    return export_csv(project, section, chunk_size)
+
+
+async def stream_chunks(chunks):
+    # Under ASGI Django turns a sync iterator into a list before sending
+    # anything; this hands out one chunk at a time instead. Every step runs
+    # on the same sync thread, which owns the connection and its cursor
+    iterator = iter(chunks)
+    read = sync_to_async(next)
+    try:
+        while True:
+            chunk = await read(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(iterator.close)()
@@ -0,0 +1,401 @@
+import csv
+import io
+import json
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .analytics import rebuild_project
+from .broadcast import task_group_name
+from .counters import repair_counts
+from .export import OWNER_TASK_FIELD, OWNER_USER_FIELD, SECTIONS, TaskOwner
+from .membership import add_members
+from .models import ActivityLog, ChatMessage, Project, SubTask, Task
+from .ordering import ORDER_GAP, next_order
+from .outbox import enqueue
+from .reminders import reload_requested
+from .revisions import SUBTASK, TASK, record_changes
+
+# Bulk import of projects in the tasks.export format: NDJSON with every
+# section, or CSV with one section per file. Input is parsed as it is read
+# and written in batches: tasks and subtasks with bulk_create, the history
+# tables (the bulk of an old tracker's data) with COPY on PostgreSQL and a
+# plain executemany INSERT elsewhere. Ids in the input are the source
+# system's; tasks are matched up through the ids they were imported with
+# and users by username.
+BATCH_SIZE = 5000
+STATUSES = {value for value, _ in Task._meta.get_field('status').choices}
+
+
+# Typed fields, checked as records are read so that bad input is reported
+# with its line number
+DATETIME_FIELDS = ('deadline', 'created_at', 'updated_at', 'timestamp')
+INTEGER_FIELDS = ('order', 'percentage')
+
+
+# Readers yield (line number, record) pairs
+def read_ndjson(stream):
+    for line, text in enumerate(stream, 1):
+        if text.strip():
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                raise ValueError(f'Line {line}: {e}') from e
+            yield line, record
+
+
+def read_csv(stream, section):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, {'type': section, **row}
+
+
+def read_records(stream, format='ndjson', section=None):
+    if format == 'ndjson':
+        return read_ndjson(stream)
+    if format == 'csv':
+        if section not in SECTIONS:
+            raise ValueError(f"CSV imports one section at a time, section must be one of {', '.join(SECTIONS)}.")
+        return read_csv(stream, section)
+    raise ValueError(f"Unknown format {format}, expected ndjson or csv.")
+
+
+def to_int(value, default=0):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{value!r} is not an integer.')
+    return int(value)
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def to_datetime(value):
+    if value in (None, ''):
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError(f'{value!r} is not a datetime.')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def check_record(record):
+    if not isinstance(record, dict):
+        raise ValueError(f'Expected an object, got {type(record).__name__}.')
+    for field in DATETIME_FIELDS:
+        try:
+            to_datetime(record.get(field))
+        except ValueError as e:
+            raise ValueError(f'{field}: {e}') from e
+    for field in INTEGER_FIELDS:
+        try:
+            to_int(record.get(field))
+        except ValueError as e:
+            raise ValueError(f'{field}: {e}') from e
+    owners = record.get('owners')
+    if owners is not None and not isinstance(owners, str) and not (isinstance(owners, list) and all(isinstance(name, str) for name in owners)):
+        raise ValueError('owners: expected a list of usernames.')
+
+
+def copy_rows(model, columns, rows):
+    # COPY ... FROM STDIN in CSV form; None travels as \N so that empty
+    # strings stay empty strings
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    names = ', '.join(quote(model._meta.get_field(column).column) for column in columns)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(f"COPY {table} ({names}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def insert_rows(model, columns, rows):
+    # Plain executemany INSERT: no model instances, and auto_now_add fields
+    # keep the imported values
+    fields = [model._meta.get_field(column) for column in columns]
+    quote = connection.ops.quote_name
+    names = ', '.join(quote(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    params = [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)] for row in rows]
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({names}) VALUES ({placeholders})', params)
+
+
+class ProjectImporter:
+    """
+    Imports records into project, or into a new project created from the
+    input's 'project' record. Rows that refer to unknown users are attributed
+    to user when one is given and skipped otherwise.
+
+    Clients are not notified per row; one 'imported' event is broadcast to
+    the project's task group once the import has committed.
+    """
+
+    def __init__(self, project=None, user=None, batch_size=BATCH_SIZE, use_copy=None):
+        self.project = project
+        self.user = user
+        self.batch_size = batch_size
+        self.use_copy = connection.vendor == 'postgresql' if use_copy is None else use_copy
+        self.pending = {section: [] for section in SECTIONS}
+        self.pending_count = 0
+        # Cached lookups: username -> user id, source user id -> username,
+        # source task id -> task id
+        self.user_ids = {}
+        self.source_usernames = {}
+        self.task_ids = {}
+        self.existing_task_ids = None
+        self.ranks = {}
+        self.counts = Counter()
+        self.skipped = Counter()
+
+    def run(self, records):
+        started = time.perf_counter()
+        with transaction.atomic():
+            for line, record in records:
+                try:
+                    self.add(record)
+                except ValueError as e:
+                    raise ValueError(f'Line {line}: {e}') from e
+            self.flush()
+            if self.project is not None:
+                # Imported history bypasses the live rollup updates
+                rebuild_project(self.project.id)
+                if self.counts['sub_tasks']:
+                    repair_counts(self.project.id)
+                if self.counts['tasks']:
+                    reload_requested()
+                self.notify(self.project.id, dict(self.counts))
+
+        seconds = time.perf_counter() - started
+        rows = sum(self.counts.values())
+        return {
+            'project': self.project.id if self.project else None,
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds) if seconds else rows,
+            'imported': dict(self.counts),
+            'skipped': dict(self.skipped),
+        }
+
+    def notify(self, project_id, counts):
+        # Through the outbox, published once the import has committed
+        enqueue(project_id, task_group_name(project_id), {
+            'imported': counts,
+            'user': self.user.username if self.user else 'Import',
+        })
+
+    def add(self, record):
+        check_record(record)
+        section = record.get('type')
+        if not isinstance(section, str):
+            section = None
+        if section == 'project':
+            if self.project is None:
+                self.project = Project.objects.create(name=record.get('name') or 'Imported project', description=record.get('description') or '')
+            return
+        if section not in self.pending:
+            self.skipped[section or 'unknown'] += 1
+            return
+        if self.project is None:
+            raise ValueError('Nothing to import into: pass a project or start the input with a project record.')
+
+        if record.get('username') and record.get('user_id') not in (None, ''):
+            self.source_usernames[str(record['user_id'])] = record['username']
+
+        self.pending[section].append(record)
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Sections are written in SECTIONS order, so tasks get their ids
+        # before the owners and subtasks of the same batch are written
+        for section in SECTIONS:
+            rows = self.pending[section]
+            if rows:
+                self.pending[section] = []
+                getattr(self, f'write_{section}')(rows)
+        self.pending_count = 0
+
+    # Lookups
+
+    def username(self, record):
+        return record.get('username') or self.source_usernames.get(str(record.get('user_id')))
+
+    def resolve_users(self, usernames):
+        missing = {username for username in usernames if username and username not in self.user_ids}
+        if missing:
+            found = dict(get_user_model().objects.filter(username__in=missing).values_list('username', 'id'))
+            self.user_ids.update({username: found.get(username) for username in missing})
+
+    def user_id(self, username):
+        user_id = self.user_ids.get(username)
+        if user_id is None and self.user is not None:
+            return self.user.id
+        return user_id
+
+    def task_id(self, source_id):
+        task_id = self.task_ids.get(str(source_id))
+        if task_id is not None:
+            return task_id
+        # CSV imports may refer to tasks that are already in the project
+        if self.existing_task_ids is None:
+            self.existing_task_ids = set(Task.objects.filter(project=self.project).values_list('id', flat=True))
+        try:
+            return int(source_id) if int(source_id) in self.existing_task_ids else None
+        except (TypeError, ValueError):
+            return None
+
+    # Writers, one per section
+
+    def write_members(self, rows):
+        usernames = [self.username(row) for row in rows]
+        report = add_members(self.project, usernames=[username for username in usernames if username])
+        self.counts['members'] += len(report['added'])
+        if report['unknown'] or None in usernames:
+            self.skipped['members'] += len(report['unknown']) + usernames.count(None)
+
+    def write_tasks(self, rows):
+        tasks, sources, owners, timestamps = [], [], [], []
+        for row in rows:
+            status = row.get('status') or 'To-Do'
+            if status not in STATUSES:
+                self.skipped['tasks'] += 1
+                continue
+            order = row.get('order')
+            if order in (None, ''):
+                if status not in self.ranks:
+                    self.ranks[status] = next_order(self.project.id, status) - ORDER_GAP
+                self.ranks[status] += ORDER_GAP
+                order = self.ranks[status]
+            task = Task(
+                project=self.project,
+                title=row.get('title') or '',
+                description=row.get('description') or '',
+                status=status,
+                order=to_int(order),
+                percentage=to_int(row.get('percentage')),
+                deadline=to_datetime(row.get('deadline')),
+            )
+            tasks.append(task)
+            timestamps.append((to_datetime(row.get('created_at')), to_datetime(row.get('updated_at'))))
+            sources.append(row.get('id'))
+            # CSV rows can name owners directly: "alice;bob"
+            names = row.get('owners') or []
+            owners.append(names.split(';') if isinstance(names, str) else names)
+
+        Task.objects.bulk_create(tasks, batch_size=self.batch_size)
+        # auto_now fields are overwritten on insert, so imported ones are
+        # written afterwards
+        if any(created_at or updated_at for created_at, updated_at in timestamps):
+            for task, (created_at, updated_at) in zip(tasks, timestamps):
+                task.created_at = created_at or task.created_at
+                task.updated_at = updated_at or task.updated_at
+            Task.objects.bulk_update(tasks, ['created_at', 'updated_at'], batch_size=self.batch_size)
+        for task, source in zip(tasks, sources):
+            if source not in (None, ''):
+                self.task_ids[str(source)] = task.id
+
+        self.resolve_users(name.strip() for names in owners for name in names)
+        links = [
+            TaskOwner(**{f'{OWNER_TASK_FIELD}_id': task.id, f'{OWNER_USER_FIELD}_id': self.user_ids[name.strip()]})
+            for task, names in zip(tasks, owners)
+            for name in names
+            if name.strip() and self.user_ids.get(name.strip())
+        ]
+        TaskOwner.objects.bulk_create(links, batch_size=self.batch_size, ignore_conflicts=True)
+        # Bulk writes skip post_save, so the changes are recorded here
+        record_changes(self.project.id, TASK, [task.id for task in tasks])
+        self.counts['tasks'] += len(tasks)
+
+    def write_task_owners(self, rows):
+        self.resolve_users(self.username(row) for row in rows)
+        links = []
+        for row in rows:
+            task_id = self.task_id(row.get('task_id'))
+            user_id = self.user_ids.get(self.username(row))
+            if task_id is None or user_id is None:
+                self.skipped['task_owners'] += 1
+                continue
+            links.append(TaskOwner(**{f'{OWNER_TASK_FIELD}_id': task_id, f'{OWNER_USER_FIELD}_id': user_id}))
+        TaskOwner.objects.bulk_create(links, batch_size=self.batch_size, ignore_conflicts=True)
+        self.counts['task_owners'] += len(links)
+
+    def write_sub_tasks(self, rows):
+        sub_tasks = []
+        for row in rows:
+            task_id = self.task_id(row.get('task_id'))
+            if task_id is None:
+                self.skipped['sub_tasks'] += 1
+                continue
+            sub_tasks.append(SubTask(
+                task_id=task_id,
+                title=row.get('title') or '',
+                description=row.get('description') or None,
+                completed=to_bool(row.get('completed')),
+            ))
+        SubTask.objects.bulk_create(sub_tasks, batch_size=self.batch_size)
+        record_changes(self.project.id, SUBTASK, [sub_task.id for sub_task in sub_tasks])
+        self.counts['sub_tasks'] += len(sub_tasks)
+
+    def write_activity_logs(self, rows):
+        self.resolve_users(self.username(row) for row in rows)
+        columns = ['project', 'user', 'action', 'task_title', 'from_status', 'to_status', 'edited_fields', 'timestamp', 'task']
+        values = []
+        for row in rows:
+            user_id = self.user_id(self.username(row))
+            if user_id is None:
+                self.skipped['activity_logs'] += 1
+                continue
+            values.append((
+                self.project.id, user_id, row.get('action') or '', row.get('task_title') or '',
+                row.get('from_status') or None, row.get('to_status') or None, row.get('edited_fields') or None,
+                to_datetime(row.get('timestamp')) or timezone.now(),
+                self.task_id(row['task_id']) if row.get('task_id') not in (None, '') else None,
+            ))
+        self.write_rows(ActivityLog, columns, values)
+        self.counts['activity_logs'] += len(values)
+
+    def write_chat_messages(self, rows):
+        self.resolve_users(self.username(row) for row in rows)
+        columns = ['project', 'user', 'message', 'timestamp']
+        values = []
+        for row in rows:
+            user_id = self.user_id(self.username(row))
+            if user_id is None:
+                self.skipped['chat_messages'] += 1
+                continue
+            values.append((self.project.id, user_id, row.get('message') or '', to_datetime(row.get('timestamp')) or timezone.now()))
+        self.write_rows(ChatMessage, columns, values)
+        self.counts['chat_messages'] += len(values)
+
+    def write_rows(self, model, columns, values):
+        if not values:
+            return
+        if self.use_copy:
+            copy_rows(model, columns, values)
+        else:
+            insert_rows(model, columns, values)
+
+
+def import_project(stream, format='ndjson', section=None, project=None, user=None, batch_size=BATCH_SIZE, use_copy=None):
+    """
+    Imports an NDJSON or CSV text stream and returns a report with the rows
+    imported and skipped per section and the rows per second.
+    """
+    importer = ProjectImporter(project=project, user=user, batch_size=batch_size, use_copy=use_copy)
+    return importer.run(read_records(stream, format, section))
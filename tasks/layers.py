@@ -0,0 +1,372 @@
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from copy import deepcopy
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.utils import timezone
+
+from . import metrics
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+def _encode_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _decode_hook(value):
+    if len(value) == 1 and '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def serialize(envelope):
+    return json.dumps(envelope, default=_encode_default, separators=(',', ':'))
+
+
+def deserialize(payload):
+    return json.loads(payload, object_hook=_decode_hook)
+
+
+class PostgresChannelLayer(BaseChannelLayer):
+    """
+    Channel layer that fans messages out between processes with Postgres
+    LISTEN/NOTIFY. Group membership lives in ChannelGroupMembership and
+    payloads too big for a NOTIFY go through ChannelSpillMessage.
+
+    Every process LISTENs on one Postgres channel per non-local channel name
+    it receives on, so a group_send costs one membership query plus one
+    NOTIFY per process that has members in the group. Normal (non "!")
+    channels are broadcast to every process receiving on them.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        database='default',
+        prefix='asgi',
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        cleanup_interval=60,
+        **kwargs
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.database = database
+        self.prefix = prefix
+        self.group_expiry = group_expiry
+        self.cleanup_interval = cleanup_interval
+        self.client_prefix = uuid.uuid4().hex[:12]
+
+        # Channels this process receives on, keyed by their non-local name
+        self.owned = set()
+        self.queues = {}
+        self.waiters = {}
+        self.lock = threading.Lock()
+
+        self.listener = None
+        self.listener_loop = None
+        self.listening = set()
+        self.listen_lock = None
+        self.last_cleanup = 0
+        self.last_local_cleanup = time.time()
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+
+        expires = time.time() + self.expiry
+        non_local = self.non_local_name(channel)
+        if non_local in self.owned:
+            self._deliver(channel, deepcopy(message), expires)
+            return
+        await self._publish({non_local: [channel]}, message, expires)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        await self._listen(self.non_local_name(channel))
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                queue = self.queues.get(channel)
+                now = time.time()
+                while queue:
+                    expires, message = queue.popleft()
+                    if expires >= now:
+                        return message
+                self.queues.pop(channel, None)
+                waiter = loop.create_future()
+                self.waiters.setdefault(channel, []).append(waiter)
+            try:
+                await waiter
+            finally:
+                with self.lock:
+                    waiters = self.waiters.get(channel, [])
+                    if waiter in waiters:
+                        waiters.remove(waiter)
+                    if not waiters:
+                        self.waiters.pop(channel, None)
+
+    async def new_channel(self, prefix='specific.'):
+        name = f'{prefix}{self.client_prefix}!'
+        self.owned.add(name)
+        await self._listen(name)
+        return name + uuid.uuid4().hex[:16]
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._group_add(group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        await self._group_discard(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+
+        channels = await self._group_channels(group)
+        expires = time.time() + self.expiry
+        # One private copy is shared by every local member of the group
+        message = deepcopy(message)
+        targets = {}
+        for channel in channels:
+            non_local = self.non_local_name(channel)
+            if non_local in self.owned:
+                try:
+                    self._deliver(channel, message, expires)
+                except ChannelFull:
+                    metrics.channel_full.inc(source='group_send')
+            else:
+                targets.setdefault(non_local, []).append(channel)
+        if targets:
+            await self._publish(targets, message, expires)
+
+    # Flush extension
+
+    async def flush(self):
+        with self.lock:
+            self.queues = {}
+        await self._flush_tables()
+
+    async def close(self):
+        if self.listener is not None:
+            if self.listener_loop is not None and not self.listener_loop.is_closed():
+                self.listener_loop.remove_reader(self.listener.fileno())
+            self.listener.close()
+        self.listener = None
+        self.listener_loop = None
+        self.listening = set()
+
+    def queue_depths(self):
+        # {channel: queued messages}, for tasks.metrics
+        with self.lock:
+            return {channel: len(queue) for channel, queue in self.queues.items()}
+
+    # Local delivery
+
+    def _deliver(self, channel, message, expires):
+        with self.lock:
+            queue = self.queues.setdefault(channel, deque())
+            if len(queue) >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            queue.append((expires, message))
+            waiters = list(self.waiters.get(channel, []))
+        for waiter in waiters:
+            waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+
+    @staticmethod
+    def _wake(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def _handle_envelope(self, envelope):
+        now = time.time()
+        if envelope['e'] < now:
+            return
+        for suffix in envelope['c']:
+            try:
+                self._deliver(envelope['p'] + suffix, envelope['m'], envelope['e'])
+            except ChannelFull:
+                metrics.channel_full.inc(source='notify')
+        if now - self.last_local_cleanup > self.expiry:
+            self._clean_expired(now)
+
+    def _clean_expired(self, now):
+        # Drop queued messages for consumers that went away without receiving them
+        self.last_local_cleanup = now
+        with self.lock:
+            for channel, queue in list(self.queues.items()):
+                while queue and queue[0][0] < now:
+                    queue.popleft()
+                if not queue and channel not in self.waiters:
+                    del self.queues[channel]
+
+    # Postgres plumbing
+
+    def pg_channel(self, non_local_name):
+        digest = hashlib.sha1(non_local_name.encode('utf-8')).hexdigest()[:24]
+        return f'{self.prefix}_{digest}'
+
+    async def _listen(self, non_local_name):
+        pg_channel = self.pg_channel(non_local_name)
+        if pg_channel in self.listening and self.listener is not None:
+            return
+        if self.listen_lock is None:
+            self.listen_lock = asyncio.Lock()
+        async with self.listen_lock:
+            if self.listener is None:
+                await self._connect_listener()
+            if pg_channel not in self.listening:
+                await asyncio.get_running_loop().run_in_executor(None, self._execute_listen, pg_channel)
+                self.listening.add(pg_channel)
+
+    async def _connect_listener(self):
+        loop = asyncio.get_running_loop()
+        self.listener = await loop.run_in_executor(None, self._open_listener)
+        self.listener_loop = loop
+        loop.add_reader(self.listener.fileno(), self._on_notify)
+        # Re-subscribe after a reconnect
+        for pg_channel in self.listening:
+            await loop.run_in_executor(None, self._execute_listen, pg_channel)
+
+    def _open_listener(self):
+        import psycopg2
+
+        wrapper = connections[self.database]
+        if wrapper.vendor != 'postgresql':
+            raise ImproperlyConfigured('PostgresChannelLayer requires a PostgreSQL database.')
+        connection = psycopg2.connect(**wrapper.get_connection_params())
+        connection.autocommit = True
+        return connection
+
+    def _execute_listen(self, pg_channel):
+        with self.listener.cursor() as cursor:
+            cursor.execute(f'LISTEN "{pg_channel}"')
+
+    def _on_notify(self):
+        try:
+            self.listener.poll()
+        except Exception as e:
+            print(f"Channel layer listener lost its connection: {e}")
+            self.listener_loop.remove_reader(self.listener.fileno())
+            self.listener = None
+            self.listener_loop.create_task(self._reconnect())
+            return
+
+        while self.listener.notifies:
+            notify = self.listener.notifies.pop(0)
+            envelope = deserialize(notify.payload)
+            if 's' in envelope:
+                self.listener_loop.create_task(self._receive_spilled(envelope['s']))
+            else:
+                self._handle_envelope(envelope)
+
+    async def _reconnect(self):
+        while self.listener is None:
+            try:
+                await self._connect_listener()
+            except Exception:
+                await asyncio.sleep(1)
+
+    async def _receive_spilled(self, spill_id):
+        payload = await self._fetch_spilled(spill_id)
+        if payload is not None:
+            self._handle_envelope(deserialize(payload))
+
+    async def _publish(self, targets, message, expires):
+        notifications = []
+        for non_local, channels in targets.items():
+            # Channels of one target share their non-local prefix, so only ship the suffixes
+            suffixes = [channel[len(non_local):] for channel in channels]
+            payload = serialize({'p': non_local, 'c': suffixes, 'm': message, 'e': expires})
+            notifications.append((self.pg_channel(non_local), payload))
+        await self._notify(notifications, expires)
+
+    @database_sync_to_async
+    def _notify(self, notifications, expires):
+        from .models import ChannelSpillMessage
+
+        with connections[self.database].cursor() as cursor:
+            for pg_channel, payload in notifications:
+                if len(payload.encode('utf-8')) > NOTIFY_PAYLOAD_LIMIT:
+                    spilled = ChannelSpillMessage.objects.using(self.database).create(payload=payload)
+                    payload = serialize({'s': spilled.id, 'e': expires})
+                cursor.execute('SELECT pg_notify(%s, %s)', [pg_channel, payload])
+
+    @database_sync_to_async
+    def _fetch_spilled(self, spill_id):
+        from .models import ChannelSpillMessage
+
+        # Several processes may read the same row, so rows are only removed by cleanup
+        return ChannelSpillMessage.objects.using(self.database).filter(id=spill_id).values_list('payload', flat=True).first()
+
+    @database_sync_to_async
+    def _group_add(self, group, channel):
+        from .models import ChannelGroupMembership
+
+        ChannelGroupMembership.objects.using(self.database).bulk_create(
+            [ChannelGroupMembership(group=group, channel=channel, expires_at=timezone.now() + timedelta(seconds=self.group_expiry))],
+            update_conflicts=True,
+            unique_fields=['group', 'channel'],
+            update_fields=['expires_at'],
+        )
+
+    @database_sync_to_async
+    def _group_discard(self, group, channel):
+        from .models import ChannelGroupMembership
+
+        ChannelGroupMembership.objects.using(self.database).filter(group=group, channel=channel).delete()
+
+    @database_sync_to_async
+    def _group_channels(self, group):
+        from .models import ChannelGroupMembership
+
+        self._maybe_cleanup()
+        return list(
+            ChannelGroupMembership.objects.using(self.database)
+            .filter(group=group, expires_at__gt=timezone.now())
+            .values_list('channel', flat=True)
+        )
+
+    def _maybe_cleanup(self):
+        from .models import ChannelGroupMembership, ChannelSpillMessage
+
+        if time.time() - self.last_cleanup < self.cleanup_interval:
+            return
+        self.last_cleanup = time.time()
+        now = timezone.now()
+        ChannelGroupMembership.objects.using(self.database).filter(expires_at__lte=now).delete()
+        ChannelSpillMessage.objects.using(self.database).filter(created_at__lt=now - timedelta(seconds=self.expiry)).delete()
+
+    @database_sync_to_async
+    def _flush_tables(self):
+        from .models import ChannelGroupMembership, ChannelSpillMessage
+
+        ChannelGroupMembership.objects.using(self.database).all().delete()
+        ChannelSpillMessage.objects.using(self.database).all().delete()
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connections
+from django.middleware.csrf import CSRF_ALLOWED_CHARS
+from django.utils.crypto import get_random_string
+
+from .chat_buffer import get_chat_queue
+from .counters import repair_counts
+from .export import OWNER_TASK_FIELD, OWNER_USER_FIELD, TaskOwner
+from .models import Project, SubTask, Task
+from .ordering import ORDER_GAP
+
+# In-process load harness: the ASGI application from task_manager.asgi is
+# driven directly through channels' HTTP and WebSocket communicators, so
+# no server or network is involved and runs are comparable between
+# releases. REST workers replay a weighted mix of the tasks.urls endpoints
+# while, at the same time, one socket per project broadcasts tagged
+# messages to everyone on ws/projects/<id>/tasks/ and ws/chat/<id>/ and
+# every receiver records how long each one took to arrive.
+#
+# Everything runs against the configured channel layer and a test database
+# (the load_test command creates a throwaway one), in load test projects
+# and users that are deleted afterwards. run_load_test refuses to write
+# them into any other database.
+USERNAME_PREFIX = 'loadtest-'
+TIMEOUT = 30
+
+# name: (weight, method, path, body); paths and bodies are formatted with
+# the project, task and a counter
+REST_MIX = {
+    'board': (20, 'GET', 'projects/{project}/board/', None),
+    'tasks': (15, 'GET', 'projects/{project}/tasks/', None),
+    'project': (10, 'GET', 'projects/{project}/', None),
+    'members': (10, 'GET', 'projects/{project}/members/', None),
+    'changes': (10, 'GET', 'projects/{project}/changes/?since=0', None),
+    'activity_logs': (10, 'GET', 'projects/{project}/activity-logs/', None),
+    'update_task': (15, 'PATCH', 'projects/{project}/tasks/{task}/', {'description': 'Load test edit {counter}'}),
+    'create_subtask': (10, 'POST', 'tasks/{task}/sub-tasks/', {'task': '{task}', 'title': 'Load test step {counter}'}),
+}
+
+
+def percentiles(values):
+    # Nearest-rank percentiles in milliseconds
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))] * 1000
+
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values) * 1000, 3),
+        'p50': round(rank(50), 3),
+        'p95': round(rank(95), 3),
+        'p99': round(rank(99), 3),
+        'max': round(values[-1] * 1000, 3),
+    }
+
+
+def format_body(body, **values):
+    if isinstance(body, dict):
+        return {key: format_body(value, **values) for key, value in body.items()}
+    if isinstance(body, str):
+        return body.format(**values)
+    return body
+
+
+class Fixture:
+    """
+    Load test users, each with a logged in session, and projects they are
+    all members of, with tasks and subtasks.
+    """
+
+    def __init__(self, projects, tasks, users):
+        User = get_user_model()
+        suffix = get_random_string(6).lower()
+        self.users = [User.objects.create_user(username=f'{USERNAME_PREFIX}{suffix}-{index}') for index in range(users)]
+        self.projects = []
+        self.tasks = {}
+        for index in range(projects):
+            project = Project.objects.create(name=f'Load test {suffix} {index}', manager=self.users[0])
+            project.members.add(*self.users)
+            created = Task.objects.bulk_create([
+                Task(title=f'Task {number}', status=['To-Do', 'Doing', 'Done'][number % 3], project=project, order=(number + 1) * ORDER_GAP)
+                for number in range(tasks)
+            ])
+            TaskOwner.objects.bulk_create([
+                TaskOwner(**{f'{OWNER_TASK_FIELD}_id': task.id, f'{OWNER_USER_FIELD}_id': self.users[number % users].id})
+                for number, task in enumerate(created)
+            ])
+            SubTask.objects.bulk_create([SubTask(task=task, title=f'Step of {task.title}') for task in created])
+            repair_counts(project.id)
+            self.projects.append(project.id)
+            self.tasks[project.id] = [task.id for task in created]
+        self.session_keys = []
+        self.cookies = [self.login(user) for user in self.users]
+
+    def login(self, user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        self.session_keys.append(session.session_key)
+        csrf_token = get_random_string(32, CSRF_ALLOWED_CHARS)
+        return {
+            'cookie': f'{settings.SESSION_COOKIE_NAME}={session.session_key}; {settings.CSRF_COOKIE_NAME}={csrf_token}',
+            'csrf_token': csrf_token,
+        }
+
+    def delete(self):
+        Project.objects.filter(id__in=self.projects).delete()
+        SessionStore.get_model_class().objects.filter(session_key__in=self.session_keys).delete()
+        get_user_model().objects.filter(id__in=[user.id for user in self.users]).delete()
+
+
+class LoadTest:
+    def __init__(self, application, projects=2, tasks=50, users=5, requests=500, concurrency=10,
+                 sockets=10, messages=20, interval=0.01, seed=0):
+        self.application = application
+        self.config = {
+            'projects': projects, 'tasks': tasks, 'users': users, 'requests': requests,
+            'concurrency': concurrency, 'sockets': sockets, 'messages': messages,
+            'interval': interval, 'seed': seed,
+        }
+        self.random = random.Random(seed)
+        self.counter = 0
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.sent_at = {}
+        self.delays = defaultdict(list)
+        self.delivered = defaultdict(int)
+
+    async def run(self):
+        fixture = await database_sync_to_async(Fixture)(self.config['projects'], self.config['tasks'], self.config['users'])
+        try:
+            return await self.run_against(fixture)
+        finally:
+            await get_chat_queue().flush()
+            await database_sync_to_async(fixture.delete)()
+
+    async def run_against(self, fixture):
+        connected, connect_times = await self.connect_all(fixture)
+        readers = [asyncio.ensure_future(self.read(kind, communicator)) for kind, communicator in connected]
+        try:
+            started = time.perf_counter()
+            rest_seconds, ws_seconds = await asyncio.gather(self.rest(fixture), self.websocket(fixture, connected))
+            elapsed = time.perf_counter() - started
+        finally:
+            for reader in readers:
+                reader.cancel()
+            for _, communicator in connected:
+                await communicator.disconnect()
+        return self.report(fixture, rest_seconds, ws_seconds, elapsed, connect_times, len(connected))
+
+    # REST
+
+    async def rest(self, fixture):
+        names = list(REST_MIX)
+        weights = [REST_MIX[name][0] for name in names]
+        plan = self.random.choices(names, weights, k=self.config['requests'])
+        queue = asyncio.Queue()
+        for name in plan:
+            queue.put_nowait((name, self.random.choice(fixture.projects), self.random.randrange(len(fixture.cookies))))
+
+        started = time.perf_counter()
+        await asyncio.gather(*[self.rest_worker(queue, fixture) for _ in range(self.config['concurrency'])])
+        return time.perf_counter() - started
+
+    async def rest_worker(self, queue, fixture):
+        while not queue.empty():
+            name, project_id, user_index = queue.get_nowait()
+            _, method, path, body = REST_MIX[name]
+            self.counter += 1
+            values = {'project': project_id, 'task': self.random.choice(fixture.tasks[project_id]), 'counter': self.counter}
+            status, seconds = await self.request(method, '/api/' + path.format(**values), format_body(body, **values), fixture.cookies[user_index])
+            self.statuses[name][status] += 1
+            self.latencies[name].append(seconds)
+
+    async def request(self, method, path, body, cookie):
+        headers = [(b'host', b'localhost'), (b'cookie', cookie['cookie'].encode())]
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers += [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(data)).encode()),
+                (b'x-csrftoken', cookie['csrf_token'].encode()),
+            ]
+        path, _, query = path.partition('?')
+        communicator = HttpCommunicator(self.application, method, path, body=data, headers=headers)
+        communicator.scope['query_string'] = query.encode()
+        started = time.perf_counter()
+        response = await communicator.get_response(timeout=TIMEOUT)
+        return response['status'], time.perf_counter() - started
+
+    # WebSockets
+
+    async def connect_all(self, fixture):
+        connected, connect_times = [], []
+        for project_id in fixture.projects:
+            for kind, path in (('tasks', f'ws/projects/{project_id}/tasks/'), ('chat', f'ws/chat/{project_id}/')):
+                for index in range(self.config['sockets']):
+                    cookie = fixture.cookies[index % len(fixture.cookies)]
+                    communicator = WebsocketCommunicator(self.application, path, headers=[
+                        (b'host', b'localhost'), (b'cookie', cookie['cookie'].encode()),
+                    ])
+                    started = time.perf_counter()
+                    accepted, _ = await communicator.connect(timeout=TIMEOUT)
+                    connect_times.append(time.perf_counter() - started)
+                    if not accepted:
+                        raise RuntimeError(f'WebSocket connection to {path} was refused.')
+                    connected.append(((kind, project_id), communicator))
+        return connected, connect_times
+
+    async def read(self, key, communicator):
+        kind, _ = key
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=3600))
+            message = frame.get('message')
+            if kind == 'tasks' and isinstance(message, dict):
+                load_id = message.get('load_id')
+            elif kind == 'chat' and isinstance(message, str) and message.startswith('load:'):
+                load_id = message[len('load:'):]
+            else:
+                # Broadcasts caused by the REST traffic
+                continue
+            if load_id in self.sent_at:
+                self.delays[kind].append(time.perf_counter() - self.sent_at[load_id])
+                self.delivered[kind] += 1
+
+    async def websocket(self, fixture, connected):
+        senders = {}
+        for key, communicator in connected:
+            senders.setdefault(key, communicator)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[self.send_messages(key, communicator) for key, communicator in senders.items()])
+        expected = self.config['messages'] * self.config['sockets'] * len(fixture.projects)
+        deadline = time.perf_counter() + TIMEOUT
+        while time.perf_counter() < deadline and any(self.delivered[kind] < expected for kind in ('tasks', 'chat')):
+            await asyncio.sleep(0.01)
+        return time.perf_counter() - started
+
+    async def send_messages(self, key, communicator):
+        kind, project_id = key
+        for index in range(self.config['messages']):
+            load_id = f'{kind}-{project_id}-{index}'
+            self.sent_at[load_id] = time.perf_counter()
+            message = {'load_id': load_id, 'title': 'Load test'} if kind == 'tasks' else f'load:{load_id}'
+            await communicator.send_to(text_data=json.dumps({'message': message}))
+            await asyncio.sleep(self.config['interval'])
+
+    # Report
+
+    def report(self, fixture, rest_seconds, ws_seconds, elapsed, connect_times, sockets):
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        requests = len(all_latencies)
+        errors = sum(count for statuses in self.statuses.values() for status, count in statuses.items() if status >= 400)
+        expected = self.config['messages'] * self.config['sockets'] * len(fixture.projects)
+        return {
+            'config': self.config,
+            'seconds': round(elapsed, 3),
+            'rest': {
+                'requests': requests,
+                'errors': errors,
+                'seconds': round(rest_seconds, 3),
+                'throughput': round(requests / rest_seconds, 1) if rest_seconds else None,
+                'latency_ms': percentiles(all_latencies),
+                'endpoints': {
+                    name: {'statuses': dict(self.statuses[name]), 'latency_ms': percentiles(self.latencies[name])}
+                    for name in REST_MIX if name in self.statuses
+                },
+            },
+            'websocket': {
+                'sockets': sockets,
+                'connect_ms': percentiles(connect_times),
+                'seconds': round(ws_seconds, 3),
+                **{
+                    kind: {
+                        'messages': self.config['messages'] * len(fixture.projects),
+                        'expected_deliveries': expected,
+                        'deliveries': self.delivered[kind],
+                        'fanout_delay_ms': percentiles(self.delays[kind]),
+                    }
+                    for kind in ('tasks', 'chat')
+                },
+            },
+        }
+
+
+def uses_test_database(alias='default'):
+    connection = connections[alias]
+    return connection.settings_dict['NAME'] == connection.creation._get_test_db_name()
+
+
+def run_load_test(application=None, **options):
+    """
+    Runs the load test and returns the report. Called from sync code, so
+    that the views and consumers share this thread's database connection.
+    Raises RuntimeError unless the database is a test database.
+    """
+    if not uses_test_database():
+        raise RuntimeError('The load test creates and deletes users and projects; run it against a test database.')
+    if application is None:
+        from task_manager.asgi import application
+    return async_to_sync(LoadTest(application, **options).run)()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from tasks.archive import apply_retention, archive_history
+
+
+class Command(BaseCommand):
+    help = 'Move old activity logs and chat messages into compressed archive segments and apply retention.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hot-days', type=int, help='Keep rows newer than this many days hot (HISTORY_ARCHIVE HOT_DAYS).')
+        parser.add_argument('--retention-days', type=int, help='Delete archived rows older than this (HISTORY_ARCHIVE RETENTION_DAYS).')
+        parser.add_argument('--segment-size', type=int, help='Rows per archive segment.')
+        parser.add_argument('--project', type=int, help='Only archive this project.')
+
+    def handle(self, *args, **options):
+        moved = archive_history(hot_days=options['hot_days'], segment_size=options['segment_size'], project_id=options['project'])
+        for kind, count in moved.items():
+            self.stdout.write(f"Archived {count} {kind} rows.")
+        deleted = apply_retention(options['retention_days'])
+        if deleted:
+            self.stdout.write(f"Deleted {deleted} expired segments.")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from tasks.analytics import rebuild_project
+from tasks.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the analytics rollups (daily status counters and task status periods) from the activity logs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Only rebuild this project.')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id')
+        if options['project']:
+            projects = projects.filter(id=options['project'])
+
+        total = 0
+        for project_id in projects.values_list('id', flat=True).iterator():
+            total += rebuild_project(project_id)
+        self.stdout.write(f"Replayed {total} activity logs.")
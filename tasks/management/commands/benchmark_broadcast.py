@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from tasks.broadcast import FRAME_EVENT_TYPE, encode_frame
+from tasks.consumers import TaskConsumer
+
+
+def sample_payload():
+    return {
+        'message': {
+            'user': 'alice',
+            'id': 42,
+            'title': 'Migrate the billing service',
+            'description': 'Move every cron job to the new scheduler and drop the old queue. ' * 4,
+            'owner': [1, 2, 3],
+            'status': 'Doing',
+            'project_id': 7,
+            'action': 'edited',
+            'edited_fields': [{'field': 'title', 'from_value': 'Migrate billing', 'to_value': 'Migrate the billing service'}],
+        },
+        'user': 'alice',
+    }
+
+
+class PerSocketEncodingConsumer(TaskConsumer):
+    # The pre-broadcast behaviour: every member re-serializes the event
+
+    async def task_message(self, event):
+        await self.send(text_data=json.dumps({
+            'message': event['message'],
+            'user': event['user'],
+        }))
+
+
+class Command(BaseCommand):
+    help = 'Measure CPU time per group event for per-socket encoding versus encode-once frames.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,500,1000,2000', help='Comma separated group sizes.')
+        parser.add_argument('--events', type=int, default=50, help='Events sent per group size.')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        events = options['events']
+
+        self.stdout.write(f"{'sockets':>8} {'per-socket us/event':>20} {'encode-once us/event':>21} {'speedup':>8}")
+        for size in sizes:
+            legacy = asyncio.run(self.measure(PerSocketEncodingConsumer, size, events, encode_once=False))
+            frames = asyncio.run(self.measure(TaskConsumer, size, events, encode_once=True))
+            self.stdout.write(f"{size:>8} {legacy:>20.1f} {frames:>21.1f} {legacy / frames:>7.1f}x")
+
+    async def measure(self, consumer_class, size, events, encode_once):
+        layer = InMemoryChannelLayer(capacity=events + 1)
+        written = []
+        consumers = []
+        for _ in range(size):
+            consumer = consumer_class()
+            consumer.channel_layer = layer
+            consumer.channel_name = await layer.new_channel()
+            consumer.base_send = self.sink(written)
+            await layer.group_add('task_group_7', consumer.channel_name)
+            consumers.append(consumer)
+
+        # Only the sender's encoding and the per-socket dispatch are timed;
+        # the in-memory layer's own queue bookkeeping is left out
+        elapsed = 0
+        for _ in range(events):
+            started = time.process_time()
+            payload = sample_payload()
+            if encode_once:
+                event = {'type': FRAME_EVENT_TYPE, 'frame': encode_frame(payload)}
+            else:
+                event = {'type': 'task_message', **payload}
+            elapsed += time.process_time() - started
+
+            await layer.group_send('task_group_7', event)
+            received = [await layer.receive(consumer.channel_name) for consumer in consumers]
+
+            started = time.process_time()
+            for consumer, message in zip(consumers, received):
+                await consumer.dispatch(message)
+            elapsed += time.process_time() - started
+
+        assert len(written) == size * events
+        return elapsed / events * 1_000_000
+
+    @staticmethod
+    def sink(written):
+        async def send(message):
+            written.append(message)
+        return send
@@ -0,0 +1,49 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tasks.reminders import ReminderScheduler
+
+
+class Command(BaseCommand):
+    help = 'Measure reminder scheduler load, update and tick times for many in-memory deadlines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=1_000_000)
+        parser.add_argument('--updates', type=int, default=100_000, help='Deadline changes applied after loading.')
+        parser.add_argument('--ticks', type=int, default=200, help='One-second ticks to measure.')
+
+    def handle(self, *args, **options):
+        random.seed(1)
+        now = timezone.now()
+        horizon = 24 * 60 * 60
+        scheduler = ReminderScheduler(timedelta(hours=1))
+
+        started = time.perf_counter()
+        for task_id in range(options['tasks']):
+            deadline = now + timedelta(seconds=random.uniform(1, horizon))
+            scheduler.schedule(task_id, task_id % 1000, 'Task', deadline, 'To-Do', now)
+        self.stdout.write(f"Loaded {options['tasks']} deadlines in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        for _ in range(options['updates']):
+            deadline = now + timedelta(seconds=random.uniform(1, horizon))
+            scheduler.schedule(random.randrange(options['tasks']), 0, 'Task', deadline, 'Doing', now)
+        self.stdout.write(f"Applied {options['updates']} updates in {time.perf_counter() - started:.2f}s")
+
+        # Ticks over the busiest stretch: everything due in the first hour
+        # fires its due soon event straight away
+        timings, fired = [], 0
+        for second in range(options['ticks']):
+            started = time.perf_counter()
+            fired += len(scheduler.due(now + timedelta(seconds=second)))
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"{len(timings)} ticks, {fired} events: p50 {statistics.median(timings):.2f}ms, "
+            f"p99 {timings[int(len(timings) * 0.99) - 1]:.2f}ms, max {timings[-1]:.2f}ms"
+        )
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.export import CHUNK_SIZE, FORMATS, SECTIONS, export_project
+from tasks.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Stream a whole project as NDJSON, or one section of it as CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project', type=int)
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--section', choices=SECTIONS, help='Section to export as CSV.')
+        parser.add_argument('--output', help='File to write to instead of stdout.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            project = Project.objects.get(id=options['project'])
+            chunks = export_project(project, format=options['format'], section=options['section'], chunk_size=options['chunk_size'])
+        except Project.DoesNotExist:
+            raise CommandError(f"Project {options['project']} does not exist.")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            # Bypasses self.stdout, which would add a newline after every chunk
+            sys.stdout.writelines(chunks)
@@ -0,0 +1,51 @@
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.export import SECTIONS
+from tasks.importer import BATCH_SIZE, import_project
+from tasks.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Bulk import a project from NDJSON (as written by export_project) or one CSV section.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--section', choices=SECTIONS, help='Section a CSV file holds.')
+        parser.add_argument('--project', type=int, help='Import into this project instead of creating one.')
+        parser.add_argument('--user', help='Username that rows with unknown users are attributed to.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk_create even on PostgreSQL.')
+
+    def handle(self, *args, **options):
+        project = user = None
+        try:
+            if options['project']:
+                project = Project.objects.get(id=options['project'])
+            if options['user']:
+                user = get_user_model().objects.get(username=options['user'])
+        except (Project.DoesNotExist, get_user_model().DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8-sig', newline='')
+        try:
+            report = import_project(
+                stream,
+                format=options['format'],
+                section=options['section'],
+                project=project,
+                user=user,
+                batch_size=options['batch_size'],
+                use_copy=False if options['no_copy'] else None,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+
+from tasks.loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the ASGI application in-process with concurrent REST requests and WebSocket broadcasts, '
+        'and print throughput, latency percentiles and broadcast fan-out delay as JSON. '
+        'Runs in a throwaway test database, created and destroyed like the test runner does.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=2, help='Load test projects to create.')
+        parser.add_argument('--tasks', type=int, default=50, help='Tasks per project.')
+        parser.add_argument('--users', type=int, default=5, help='Users, all members of every project.')
+        parser.add_argument('--requests', type=int, default=500, help='REST requests in total.')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent REST clients.')
+        parser.add_argument('--sockets', type=int, default=10, help='Sockets per project on each of the task and chat paths.')
+        parser.add_argument('--messages', type=int, default=20, help='Broadcasts per project on each path.')
+        parser.add_argument('--interval', type=float, default=0.01, help='Seconds between broadcasts.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the request mix.')
+        parser.add_argument('--output', help='Also write the report to this file.')
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            report = run_load_test(**{
+                name: options[name]
+                for name in ('projects', 'tasks', 'users', 'requests', 'concurrency', 'sockets', 'messages', 'interval', 'seed')
+            })
+        finally:
+            teardown_databases(old_config, verbosity=0)
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(text + '\n')
+        self.stdout.write(text)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.models import Project
+from tasks.ordering import rebalance_project
+
+
+class Command(BaseCommand):
+    help = 'Renumber board columns whose ranks have run out of room between neighbours.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Only rebalance this project.')
+        parser.add_argument('--min-gap', type=int, default=8, help='Rebalance columns with a gap smaller than this.')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id')
+        if options['project']:
+            projects = projects.filter(id=options['project'])
+
+        total = 0
+        for project_id in projects.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                total += rebalance_project(project_id, min_gap=options['min_gap'])
+        self.stdout.write(f"Renumbered {total} tasks.")
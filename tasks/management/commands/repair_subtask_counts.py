@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tasks.counters import repair_counts
+from tasks.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Recompute the subtask counters (and auto percentages) of tasks whose counters drifted from their subtasks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Only repair this project.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tasks updated per UPDATE statement.')
+
+    def handle(self, *args, **options):
+        if options['project']:
+            fixed = repair_counts(options['project'], batch_size=options['batch_size'])
+        else:
+            fixed = sum(
+                repair_counts(project_id, batch_size=options['batch_size'])
+                for project_id in Project.objects.order_by('id').values_list('id', flat=True).iterator()
+            )
+        self.stdout.write(f"Repaired the subtask counters of {fixed} tasks.")
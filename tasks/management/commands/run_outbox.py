@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tasks.outbox import drain, get_config, requeue_dead
+
+
+class Command(BaseCommand):
+    help = 'Publish pending outbox events to the channel layer, every POLL_INTERVAL seconds or once with --once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit.')
+        parser.add_argument('--requeue-dead', action='store_true', help='Retry dead-lettered events first.')
+
+    def handle(self, *args, **options):
+        poll_interval = get_config()['POLL_INTERVAL']
+        if options['requeue_dead']:
+            self.stdout.write(f"Requeued {requeue_dead()} dead-lettered events.")
+        try:
+            while True:
+                published = drain()
+                if published:
+                    self.stdout.write(f"Published {published} events.")
+                if options['once']:
+                    return
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,22 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.reminders import ReminderWorker, runs_in_process
+
+
+class Command(BaseCommand):
+    help = 'Run the deadline reminder worker, which sends due soon and overdue events to project task groups.'
+
+    def handle(self, *args, **options):
+        if runs_in_process():
+            raise CommandError(
+                'The channel layer does not reach other processes, so no deadline change would arrive here; '
+                'the web process runs the reminder worker itself (REMINDERS["IN_PROCESS"]).'
+            )
+        worker = ReminderWorker()
+        self.stdout.write(f"Watching deadlines up to {worker.horizon} ahead on channel {worker.config['CHANNEL']}.")
+        try:
+            asyncio.run(worker.run(stdout=self.stdout))
+        except KeyboardInterrupt:
+            pass
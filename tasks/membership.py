@@ -0,0 +1,185 @@
+import csv
+import io
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from . import readcache
+from .models import Project
+
+# Per-project member ids and per-user project ids, cached so permission
+# checks and socket admission are a set lookup instead of a query. Entries
+# are dropped whenever Project.members changes (see tasks.signals), which
+# only reaches other processes through a shared cache: a per-process one is
+# bypassed unless READ_CACHE['SHARED'] declares a single process (see
+# tasks.readcache.is_shared, check tasks.W001).
+MEMBERSHIP_TIMEOUT = 60 * 60
+# Usernames / ids resolved per IN query by add_members
+LOOKUP_BATCH_SIZE = 5000
+
+
+def get_cache():
+    return caches[getattr(settings, 'MEMBERSHIP_CACHE', 'default')]
+
+
+def is_shared():
+    shared = readcache.get_config()['SHARED']
+    if shared is None:
+        return not isinstance(get_cache(), LocMemCache)
+    return shared
+
+
+def project_key(project_id):
+    return f'membership:project:{project_id}'
+
+
+def user_key(user_id):
+    return f'membership:user:{user_id}'
+
+
+Membership = Project.members.through
+PROJECT_FIELD = Project.members.field.m2m_field_name()
+USER_FIELD = Project.members.field.m2m_reverse_field_name()
+
+
+def cached_ids(key, load):
+    if not is_shared():
+        return load()
+    cache = get_cache()
+    ids = cache.get(key)
+    if ids is None:
+        ids = load()
+        cache.set(key, ids, MEMBERSHIP_TIMEOUT)
+    return ids
+
+
+def project_member_ids(project_id):
+    return cached_ids(
+        project_key(project_id),
+        lambda: frozenset(Membership.objects.filter(**{f'{PROJECT_FIELD}_id': project_id}).values_list(f'{USER_FIELD}_id', flat=True)),
+    )
+
+
+def user_project_ids(user_id):
+    return cached_ids(
+        user_key(user_id),
+        lambda: frozenset(Membership.objects.filter(**{f'{USER_FIELD}_id': user_id}).values_list(f'{PROJECT_FIELD}_id', flat=True)),
+    )
+
+
+def is_member(project_id, user):
+    if not user.is_authenticated:
+        return False
+    if not is_shared():
+        return Membership.objects.filter(**{f'{PROJECT_FIELD}_id': int(project_id), f'{USER_FIELD}_id': user.id}).exists()
+    return int(project_id) in user_project_ids(user.id)
+
+
+def is_manager_or_member(project, user):
+    # Anonymous users never match, not even a project without a manager
+    if not user.is_authenticated:
+        return False
+    return user.id == project.manager_id or is_member(project.id, user)
+
+
+def invalidate(project_ids=(), user_ids=()):
+    keys = [project_key(project_id) for project_id in project_ids] + [user_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache = get_cache()
+    cache.delete_many(keys)
+    # Drop them again once the change is visible, in case a reader refilled
+    # the cache from the old rows before commit
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def add_members(project, usernames=(), user_ids=()):
+    """
+    Adds users to a project by username and/or id with one lookup query per
+    LOOKUP_BATCH_SIZE entries and one bulk insert into the membership table.
+    Unknown entries are reported instead of aborting the whole request.
+
+    Returns {'added': [...], 'already_member': [...], 'unknown': [...]} with
+    the entries as they were given. Raises ValueError for entries that are
+    not usernames or integer ids (lists, objects, 'abc' as an id).
+    """
+    User = get_user_model()
+    for username in usernames:
+        if isinstance(username, bool) or not isinstance(username, (str, int)):
+            raise ValueError(f"usernames must be strings, got {username!r}.")
+    for user_id in user_ids:
+        if isinstance(user_id, bool) or not isinstance(user_id, (str, int)) or not str(user_id).strip().isdigit():
+            raise ValueError(f"user_ids must be integers, got {user_id!r}.")
+    usernames = list(dict.fromkeys(str(username).strip() for username in usernames if str(username).strip()))
+    user_ids = list(dict.fromkeys(user_ids))
+
+    by_username = {}
+    for start in range(0, len(usernames), LOOKUP_BATCH_SIZE):
+        batch = usernames[start:start + LOOKUP_BATCH_SIZE]
+        by_username.update(User.objects.filter(username__in=batch).values_list('username', 'id'))
+    numeric_ids = {user_id: int(user_id) for user_id in user_ids}
+    known_ids = set()
+    batch_ids = list(numeric_ids.values())
+    for start in range(0, len(batch_ids), LOOKUP_BATCH_SIZE):
+        batch = batch_ids[start:start + LOOKUP_BATCH_SIZE]
+        known_ids.update(User.objects.filter(id__in=batch).values_list('id', flat=True))
+
+    resolved = [(username, by_username.get(username)) for username in usernames]
+    resolved += [(user_id, numeric_ids[user_id] if numeric_ids[user_id] in known_ids else None) for user_id in user_ids]
+
+    report = {'added': [], 'already_member': [], 'unknown': []}
+    with transaction.atomic():
+        existing = set(Membership.objects.filter(**{f'{PROJECT_FIELD}_id': project.id}).values_list(f'{USER_FIELD}_id', flat=True))
+        new_ids = []
+        for entry, user_id in resolved:
+            if user_id is None:
+                report['unknown'].append(entry)
+            elif user_id in existing:
+                report['already_member'].append(entry)
+            else:
+                existing.add(user_id)
+                new_ids.append(user_id)
+                report['added'].append(entry)
+
+        # Bulk inserts skip m2m_changed, so the cache is invalidated here
+        Membership.objects.bulk_create(
+            [Membership(**{f'{PROJECT_FIELD}_id': project.id, f'{USER_FIELD}_id': user_id}) for user_id in new_ids],
+            batch_size=LOOKUP_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        if new_ids:
+            invalidate(project_ids=[project.id], user_ids=new_ids)
+            readcache.project_changed(project.id)
+    return report
+
+
+def read_members_csv(file):
+    """
+    Usernames and ids from an uploaded CSV file. A header row naming a
+    'username' and/or 'id' column picks those columns, otherwise the first
+    column holds usernames.
+    """
+    reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    usernames, user_ids = [], []
+    header = next(reader, None)
+    if header is None:
+        return usernames, user_ids
+
+    columns = [name.strip().lower() for name in header]
+    if 'username' in columns or 'id' in columns:
+        username_column = columns.index('username') if 'username' in columns else None
+        id_column = columns.index('id') if 'id' in columns else None
+        rows = reader
+    else:
+        username_column, id_column = 0, None
+        rows = [header, *reader]
+
+    for row in rows:
+        if username_column is not None and username_column < len(row) and row[username_column].strip():
+            usernames.append(row[username_column].strip())
+        elif id_column is not None and id_column < len(row) and row[id_column].strip():
+            user_ids.append(row[id_column].strip())
+    return usernames, user_ids
@@ -0,0 +1,278 @@
+import asyncio
+import threading
+import time
+import weakref
+
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.layers import channel_layers
+from django.conf import settings
+
+# Process-local metrics in the Prometheus text format, served at /metrics
+# (see task_manager.views). Each daphne process keeps its own numbers, so
+# scrape every process. Updates take a lock and touch a few dict entries,
+# cheap enough to leave on in production.
+DEFAULTS = {
+    # Add a Server-Timing header to every response
+    'SERVER_TIMING': True,
+    # Log requests that run the same SQL this many times (N+1 queries)
+    'DUPLICATE_THRESHOLD': 10,
+    # When set, /metrics requires "Authorization: Bearer <TOKEN>"
+    'TOKEN': None,
+}
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+LOOP_LAG_INTERVAL = 0.5
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def samples(self):
+        # (suffix, label values, extra labels, value)
+        with self.lock:
+            return [('', key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(self.labels, key, extra)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        # function() -> {label values tuple: value}, read at scrape time
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) - amount
+            if not self.values[key]:
+                # Labels such as groups come and go, drop the ones at zero
+                del self.values[key]
+
+    def samples(self):
+        if self.function is not None:
+            return [('', key, (), value) for key, value in self.function().items()]
+        return super().samples()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket, then sum and count
+                counts = self.values[key] = [0] * len(self.buckets) + [0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        samples = []
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', key, (('le', format_value(float(bound))),), cumulative))
+            samples.append(('_sum', key, (), counts[-2]))
+            samples.append(('_count', key, (), counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# HTTP requests, by URL name (see tasks.middleware)
+http_requests = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests handled.', ['view', 'method', 'status'],
+))
+http_duration = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ['view'],
+))
+http_queries = REGISTRY.register(Histogram(
+    'http_request_queries', 'SQL queries run per HTTP request.', ['view'], buckets=COUNT_BUCKETS,
+))
+http_db_duration = REGISTRY.register(Histogram(
+    'http_request_db_seconds', 'Time spent in SQL per HTTP request.', ['view'],
+))
+http_duplicate_queries = REGISTRY.register(Histogram(
+    'http_request_duplicate_queries', 'Queries per HTTP request that repeat SQL already run in the request.', ['view'], buckets=COUNT_BUCKETS,
+))
+
+read_cache_requests = REGISTRY.register(Counter(
+    'read_cache_requests_total', 'Read-through cache lookups (see tasks.readcache).', ['name', 'result'],
+))
+
+# WebSockets (see tasks.consumers and tasks.broadcast)
+ws_open_sockets = REGISTRY.register(Gauge(
+    'ws_open_sockets', 'Open WebSockets per group.', ['consumer', 'group'],
+))
+ws_messages_received = REGISTRY.register(Counter(
+    'ws_messages_received_total', 'WebSocket messages received from clients.', ['consumer'],
+))
+ws_messages_sent = REGISTRY.register(Counter(
+    'ws_messages_sent_total', 'WebSocket messages written to clients.', ['consumer'],
+))
+ws_delivery = REGISTRY.register(Histogram(
+    'ws_delivery_seconds', 'Time from group_send to the socket write.', ['consumer'], buckets=FAST_BUCKETS,
+))
+ws_broadcast_errors = REGISTRY.register(Counter(
+    'ws_broadcast_errors_total', 'Broadcasts that failed to reach the channel layer.',
+))
+
+# Outbox (see tasks.outbox)
+outbox_published = REGISTRY.register(Counter(
+    'outbox_events_published_total', 'Outbox events published to the channel layer.',
+))
+outbox_lag = REGISTRY.register(Histogram(
+    'outbox_lag_seconds', 'Time from writing an outbox event to publishing it.',
+))
+outbox_failures = REGISTRY.register(Counter(
+    'outbox_publish_failures_total', 'Outbox events that failed to publish and were scheduled for a retry or dead-lettered.',
+))
+outbox_dead_letters = REGISTRY.register(Counter(
+    'outbox_dead_letters_total', 'Outbox events given up on after MAX_ATTEMPTS failed publishes.',
+))
+
+
+
+# Channel layer
+
+def channel_queue_depths():
+    # {channel: queued messages} of this process's default channel layer
+    if DEFAULT_CHANNEL_LAYER not in getattr(settings, 'CHANNEL_LAYERS', {}):
+        return {}
+    layer = channel_layers[DEFAULT_CHANNEL_LAYER]
+    if hasattr(layer, 'queue_depths'):
+        return layer.queue_depths()
+    # InMemoryChannelLayer
+    return {channel: queue.qsize() for channel, queue in list(getattr(layer, 'channels', {}).items())}
+
+
+def queue_depth_samples():
+    depths = channel_queue_depths().values()
+    return {
+        ('channels',): len(depths),
+        ('total',): sum(depths),
+        ('max',): max(depths, default=0),
+    }
+
+
+channel_queue_depth = REGISTRY.register(Gauge(
+    'channel_layer_queue_depth', 'Local channel queues: how many there are, messages queued in total and in the fullest one.',
+    ['stat'], function=queue_depth_samples,
+))
+channel_full = REGISTRY.register(Counter(
+    'channel_layer_full_total', 'Messages dropped because the receiving channel was full.', ['source'],
+))
+
+
+# Event loop
+
+loop_lag = REGISTRY.register(Histogram(
+    'event_loop_lag_seconds', f'How late the event loop ran a timer due every {LOOP_LAG_INTERVAL} seconds.', buckets=FAST_BUCKETS,
+))
+watched_loops = weakref.WeakSet()
+lag_timers = set()
+
+
+async def measure_loop_lag():
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag.observe(max(0.0, time.perf_counter() - started - LOOP_LAG_INTERVAL))
+
+
+def watch_event_loop():
+    # Starts the lag timer on the running loop, once per loop
+    loop = asyncio.get_running_loop()
+    if loop not in watched_loops:
+        watched_loops.add(loop)
+        timer = loop.create_task(measure_loop_lag())
+        lag_timers.add(timer)
+        timer.add_done_callback(lag_timers.discard)
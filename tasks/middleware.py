@@ -0,0 +1,73 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    # Database execute wrapper counting and timing every query; queries
+    # are told apart by their SQL, so the same statement with different
+    # parameters counts as a duplicate
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+
+class QueryMetricsMiddleware:
+    """
+    Records each request's latency, query count, SQL time and duplicate
+    queries per URL name (see tasks.metrics) and reports them to the
+    client in a Server-Timing header. Queries run while a streaming
+    response is consumed happen after this and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.http_requests.inc(view=view, method=request.method, status=response.status_code)
+        metrics.http_duration.observe(seconds, view=view)
+        metrics.http_queries.observe(recorder.count, view=view)
+        metrics.http_db_duration.observe(recorder.seconds, view=view)
+        metrics.http_duplicate_queries.observe(recorder.duplicates(), view=view)
+
+        config = metrics.get_config()
+        sql, repeats = recorder.statements.most_common(1)[0] if recorder.statements else ('', 0)
+        if config['DUPLICATE_THRESHOLD'] and repeats >= config['DUPLICATE_THRESHOLD']:
+            logger.warning('%s ran the same query %d times: %s', view, repeats, sql)
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = (
+                f'db;dur={recorder.seconds * 1000:.1f};desc="{recorder.count} queries, {recorder.duplicates()} duplicates", '
+                f'app;dur={(seconds - recorder.seconds) * 1000:.1f}, '
+                f'total;dur={seconds * 1000:.1f}'
+            )
+        return response
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0022_remove_task_owner_task_owner"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChannelSpillMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("payload", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ChannelGroupMembership",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("group", models.CharField(max_length=100)),
+                ("channel", models.CharField(max_length=100)),
+                ("expires_at", models.DateTimeField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["expires_at"], name="tasks_chann_expires_089825_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="channelgroupmembership",
+            constraint=models.UniqueConstraint(
+                fields=("group", "channel"), name="unique_channel_group_membership"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0024_chatmessage_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="activitylog",
+            index=models.Index(
+                fields=["project", "timestamp", "id"], name="activitylog_project_keyset"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["project", "timestamp", "id"], name="chatmessage_project_keyset"
+            ),
+        ),
+    ]
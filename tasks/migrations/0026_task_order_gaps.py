@@ -0,0 +1,44 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+ORDER_GAP = 1024
+
+
+def spread_task_orders(apps, schema_editor):
+    # Renumber every column ORDER_GAP apart, keeping the current order
+    Task = apps.get_model("tasks", "Task")
+    changed = []
+    position = {}
+    for task in Task.objects.only("id", "project_id", "status", "order").order_by(
+        "project_id", "status", "order", "id"
+    ):
+        key = (task.project_id, task.status)
+        position[key] = position.get(key, 0) + 1
+        task.order = position[key] * ORDER_GAP
+        changed.append(task)
+        if len(changed) >= 1000:
+            Task.objects.bulk_update(changed, ["order"])
+            changed = []
+    Task.objects.bulk_update(changed, ["order"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0025_history_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="task",
+            options={"ordering": ["order", "id"]},
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["project", "status", "order"], name="task_column_order"
+            ),
+        ),
+        migrations.RunPython(spread_task_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0026_task_order_gaps"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="revision",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="ProjectChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("task", "Task"), ("subtask", "SubTask")],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("revision", models.BigIntegerField()),
+                ("deleted", models.BooleanField(default=False)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="changes",
+                        to="tasks.project",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["project", "revision"], name="projectchange_revision"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="projectchange",
+            constraint=models.UniqueConstraint(
+                fields=("project", "kind", "object_id"), name="unique_project_change"
+            ),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+import tasks.search
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0027_project_revisions"),
+    ]
+
+    operations = [
+        # tsvector columns + GIN indexes on PostgreSQL, FTS5 tables on SQLite
+        migrations.RunPython(tasks.search.install, tasks.search.uninstall),
+    ]
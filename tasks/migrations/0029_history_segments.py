@@ -0,0 +1,81 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import tasks.archive
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0028_search_indexes"),
+    ]
+
+    operations = [
+        # Range partitioned by first_timestamp on PostgreSQL, a plain table
+        # elsewhere
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="HistorySegment",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "kind",
+                            models.CharField(
+                                choices=[
+                                    ("activity_log", "ActivityLog"),
+                                    ("chat_message", "ChatMessage"),
+                                ],
+                                max_length=20,
+                            ),
+                        ),
+                        ("first_timestamp", models.DateTimeField()),
+                        ("first_id", models.BigIntegerField()),
+                        ("last_timestamp", models.DateTimeField()),
+                        ("last_id", models.BigIntegerField()),
+                        ("row_count", models.IntegerField()),
+                        ("payload", models.BinaryField()),
+                        (
+                            "project",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="history_segments",
+                                to="tasks.project",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "indexes": [
+                            models.Index(
+                                fields=["project", "kind", "last_timestamp", "last_id"],
+                                name="historysegment_last",
+                            ),
+                            models.Index(
+                                fields=[
+                                    "project",
+                                    "kind",
+                                    "first_timestamp",
+                                    "first_id",
+                                ],
+                                name="historysegment_first",
+                            ),
+                        ],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(
+            tasks.archive.create_segment_table,
+            tasks.archive.drop_segment_table,
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0029_history_segments"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activitylog",
+            name="task",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="tasks.task",
+            ),
+        ),
+        migrations.CreateModel(
+            name="ProjectStatusDay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("status", models.CharField(max_length=50)),
+                ("entered", models.IntegerField(default=0)),
+                ("exited", models.IntegerField(default=0)),
+                ("cycle_count", models.IntegerField(default=0)),
+                ("cycle_seconds", models.FloatField(default=0)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="status_days",
+                        to="tasks.project",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TaskStatusPeriod",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("status", models.CharField(max_length=50)),
+                ("started_at", models.DateTimeField()),
+                ("ended_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="status_periods",
+                        to="tasks.project",
+                    ),
+                ),
+                (
+                    "task",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="status_periods",
+                        to="tasks.task",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["task", "started_at"], name="statusperiod_task"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="projectstatusday",
+            constraint=models.UniqueConstraint(
+                fields=("project", "day", "status"), name="unique_project_status_day"
+            ),
+        ),
+    ]
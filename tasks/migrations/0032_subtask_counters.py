@@ -0,0 +1,56 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+import tasks.search
+
+
+def count_subtasks(apps, schema_editor):
+    Task = apps.get_model("tasks", "Task")
+    SubTask = apps.get_model("tasks", "SubTask")
+    per_task = SubTask.objects.filter(task=OuterRef("pk")).order_by().values("task")
+    Task.objects.update(
+        subtask_total=Coalesce(
+            Subquery(per_task.annotate(count=Count("id")).values("count")), 0
+        ),
+        subtask_completed=Coalesce(
+            Subquery(
+                per_task.filter(completed=True)
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tasks", "0031_task_deadline_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="auto_percentage",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="subtask_completed",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="subtask_total",
+            field=models.IntegerField(default=0),
+        ),
+        # The table rebuilds above drop SQLite's search triggers
+        migrations.RunPython(
+            tasks.search.reinstall_sqlite_triggers, migrations.RunPython.noop
+        ),
+        migrations.RunPython(count_subtasks, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 class Project(models.Model):
     name = models.CharField(max_length=255)
@@ -12,6 +14,8 @@ class Project(models.Model):
         blank=True  # Allow empty values in forms
     )
     members = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='projects')
+    # Bumped on every task/subtask change, see tasks.revisions
+    revision = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -30,9 +34,18 @@ class Task(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     project = models.ForeignKey(Project, related_name='tasks', on_delete=models.CASCADE)
+    # Maintained by tasks.counters, percentage too when auto_percentage is set
+    subtask_total = models.IntegerField(default=0)
+    subtask_completed = models.IntegerField(default=0)
+    auto_percentage = models.BooleanField(default=False)
 
     class Meta:
-        ordering = ['order']  # Default ordering by the order field
+        ordering = ['order', 'id']  # Default ordering by the order field, see tasks.ordering for the gaps
+        indexes = [
+            models.Index(fields=['project', 'status', 'order'], name='task_column_order'),
+            # Range scans of upcoming deadlines, see tasks.reminders
+            models.Index(fields=['deadline'], name='task_deadline', condition=models.Q(deadline__isnull=False)),
+        ]
     
     def __str__(self):
         return self.title
@@ -43,6 +56,16 @@ class SubTask(models.Model):
     description = models.TextField(blank=True, null=True)
     completed = models.BooleanField(default=False)
 
+    def save(self, *args, **kwargs):
+        # The row as the task's counters hold it, locked until the post_save
+        # handler has moved them (see tasks.counters), so every save counts
+        # its own change once however stale this instance is
+        with transaction.atomic():
+            self._counted = None
+            if self.pk is not None:
+                self._counted = SubTask.objects.select_for_update().filter(pk=self.pk).values_list('task_id', 'completed').first()
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
 
@@ -55,6 +78,14 @@ class ActivityLog(models.Model):
     edited_fields = models.CharField(max_length=255, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     project = models.ForeignKey(Project, related_name='activity_logs', on_delete=models.CASCADE) 
+    # Kept after the task is deleted, for the analytics rollups
+    task = models.ForeignKey(Task, related_name='+', null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a project's history
+            models.Index(fields=['project', 'timestamp', 'id'], name='activitylog_project_keyset'),
+        ]
 
     def __str__(self):
         return f'{self.user.username if self.user else "Unknown User"} {self.action} "{self.task_title}" at {self.timestamp}'
@@ -63,7 +94,143 @@ class ChatMessage(models.Model):
     project = models.ForeignKey(Project, related_name='chat_messages', on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is accepted, which can be before a buffered write
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'timestamp', 'id'], name='chatmessage_project_keyset'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username}: {self.message} ({self.timestamp})'
+
+
+class ProjectChange(models.Model):
+    # Latest change per task/subtask, including deletes (tombstones), so a
+    # client can ask for everything after the revision it last saw
+    project = models.ForeignKey(Project, related_name='changes', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=[('task', 'Task'), ('subtask', 'SubTask')])
+    object_id = models.BigIntegerField()
+    revision = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'kind', 'object_id'], name='unique_project_change'),
+        ]
+        indexes = [
+            models.Index(fields=['project', 'revision'], name='projectchange_revision'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id} at revision {self.revision}'
+
+
+class HistorySegment(models.Model):
+    # A compressed batch of archived ActivityLog or ChatMessage rows, see
+    # tasks.archive. Range partitioned by first_timestamp on PostgreSQL.
+    project = models.ForeignKey(Project, related_name='history_segments', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=[('activity_log', 'ActivityLog'), ('chat_message', 'ChatMessage')])
+    first_timestamp = models.DateTimeField()
+    first_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    row_count = models.IntegerField()
+    payload = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'kind', 'last_timestamp', 'last_id'], name='historysegment_last'),
+            models.Index(fields=['project', 'kind', 'first_timestamp', 'first_id'], name='historysegment_first'),
+        ]
+
+    def __str__(self):
+        return f'{self.row_count} archived {self.kind} rows of project {self.project_id}'
+
+
+# Analytics rollups, maintained by tasks.analytics
+
+class ProjectStatusDay(models.Model):
+    # Tasks that entered and left a status on a day, and the cycle times of
+    # the tasks that reached Done
+    project = models.ForeignKey(Project, related_name='status_days', on_delete=models.CASCADE)
+    day = models.DateField()
+    status = models.CharField(max_length=50)
+    entered = models.IntegerField(default=0)
+    exited = models.IntegerField(default=0)
+    cycle_count = models.IntegerField(default=0)
+    cycle_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'day', 'status'], name='unique_project_status_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.status} on {self.day}: +{self.entered} -{self.exited}'
+
+class TaskStatusPeriod(models.Model):
+    # How long a task spent in a status; ended_at is null while it is there
+    project = models.ForeignKey(Project, related_name='status_periods', on_delete=models.CASCADE)
+    task = models.ForeignKey(Task, related_name='status_periods', on_delete=models.DO_NOTHING, db_constraint=False)
+    status = models.CharField(max_length=50)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['task', 'started_at'], name='statusperiod_task'),
+        ]
+
+    def __str__(self):
+        return f'Task {self.task_id} in {self.status} from {self.started_at}'
+
+
+# Backing tables for tasks.layers.PostgresChannelLayer
+
+class ChannelGroupMembership(models.Model):
+    group = models.CharField(max_length=100)
+    channel = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'channel'], name='unique_channel_group_membership'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.channel} in {self.group}'
+
+class ChannelSpillMessage(models.Model):
+    # Payloads too large for a NOTIFY are parked here and referenced by id
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'Spilled message {self.id} ({self.created_at})'
+
+
+class OutboxEvent(models.Model):
+    # A group event written in the transaction of the change it announces
+    # and published by tasks.outbox once that has committed. No foreign key,
+    # so the events of a deleted project still go out
+    project_id = models.BigIntegerField()
+    group = models.CharField(max_length=100)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    # Failed publishes are retried from then on, and given up at dead_at
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    dead_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project_id', 'id'], name='outboxevent_project'),
+        ]
 
     def __str__(self):
-        return f'{self.user.username}: {self.message} ({self.timestamp})'
\ No newline at end of file
+        return f'Outbox event {self.id} for {self.group}'
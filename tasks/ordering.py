@@ -0,0 +1,145 @@
+from django.db.models import Max, Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Task
+from .reminders import reload_requested
+from .revisions import TASK, record_changes
+
+# Tasks in a column are ranked ORDER_GAP apart, so a card can usually be
+# dropped between two neighbours by taking the midpoint of their ranks.
+# Only when two neighbours are adjacent integers is the column renumbered.
+ORDER_GAP = 1024
+
+
+def rank_between(lower, upper):
+    lower = 0 if lower is None else lower
+    upper = lower + 2 * ORDER_GAP if upper is None else upper
+    rank = (lower + upper) // 2
+    if lower < rank < upper:
+        return rank
+    return None
+
+
+def next_order(project_id, status):
+    # Rank that appends a task at the bottom of its column
+    last = Task.objects.filter(project_id=project_id, status=status).aggregate(last=Max('order'))['last']
+    return (last or 0) + ORDER_GAP
+
+
+def spread(column):
+    # Renumber a column in place, returning the tasks whose rank changed
+    changed = []
+    for index, task in enumerate(column, start=1):
+        if task.order != index * ORDER_GAP:
+            task.order = index * ORDER_GAP
+            changed.append(task)
+    return changed
+
+
+def apply_moves(project, moves):
+    """
+    Applies a list of {'id', 'status', 'before_id' | 'after_id'} moves to the
+    project's board. Must run inside a transaction: the affected columns are
+    locked, every move is resolved in memory and the result is written with
+    one bulk_update. Returns the changed tasks and (task, from, to) tuples
+    for the tasks that changed column.
+    """
+    statuses = dict(Task._meta.get_field('status').choices)
+    ids = []
+    targets = set()
+    for move in moves:
+        if not isinstance(move, dict) or 'id' not in move:
+            raise ValidationError({'moves': 'Every move needs an id.'})
+        if 'status' in move and move['status'] not in statuses:
+            raise ValidationError({'moves': f"Unknown status {move['status']}."})
+        ids.append(move['id'])
+        if 'status' in move:
+            targets.add(move['status'])
+
+    tasks = list(
+        Task.objects.select_for_update()
+        .filter(project=project)
+        .filter(Q(id__in=ids) | Q(status__in=targets))
+        .order_by('order', 'id')
+    )
+    by_id = {task.id: task for task in tasks}
+    missing = [task_id for task_id in ids if task_id not in by_id]
+    if missing:
+        raise ValidationError({'moves': f"Tasks {missing} are not in this project."})
+
+    # Columns holding a moved task but no drop target still need loading
+    source_statuses = {by_id[task_id].status for task_id in ids} - targets
+    if source_statuses:
+        for task in Task.objects.select_for_update().filter(project=project, status__in=source_statuses).exclude(id__in=ids).order_by('order', 'id'):
+            by_id[task.id] = task
+            tasks.append(task)
+        tasks.sort(key=lambda task: (task.order, task.id))
+
+    columns = {}
+    for task in tasks:
+        columns.setdefault(task.status, []).append(task)
+
+    changed = {}
+    status_changes = []
+    for move in moves:
+        task = by_id[move['id']]
+        columns[task.status].remove(task)
+        target = move.get('status', task.status)
+        column = columns.setdefault(target, [])
+        column.insert(resolve_position(column, move, by_id), task)
+
+        if task.status != target:
+            status_changes.append((task, task.status, target))
+            task.status = target
+        changed[task.id] = task
+
+        position = column.index(task)
+        lower = column[position - 1].order if position > 0 else None
+        upper = column[position + 1].order if position + 1 < len(column) else None
+        rank = rank_between(lower, upper)
+        if rank is None:
+            for renumbered in spread(column):
+                changed[renumbered.id] = renumbered
+        else:
+            task.order = rank
+
+    now = timezone.now()
+    for task in changed.values():
+        task.updated_at = now
+    Task.objects.bulk_update(list(changed.values()), ['order', 'status', 'updated_at'])
+    record_changes(project.id, TASK, list(changed))
+    # bulk_update skips the signals; a task moved out of Done needs its
+    # reminders again
+    if any(task.deadline for task, _, _ in status_changes):
+        reload_requested()
+    return list(changed.values()), status_changes
+
+
+def resolve_position(column, move, by_id):
+    for key, offset in (('before_id', 0), ('after_id', 1)):
+        neighbour_id = move.get(key)
+        if neighbour_id is None:
+            continue
+        neighbour = by_id.get(neighbour_id)
+        if neighbour is None or neighbour not in column:
+            raise ValidationError({'moves': f"{key} {neighbour_id} is not in the target column."})
+        return column.index(neighbour) + offset
+    return len(column)
+
+
+def rebalance_project(project_id, min_gap=8):
+    # Renumbers every column of a project whose tightest gap fell below min_gap.
+    # Must run inside a transaction, the project's tasks stay locked until commit.
+    columns = {}
+    for task in Task.objects.select_for_update().filter(project_id=project_id).only('id', 'status', 'order').order_by('order', 'id'):
+        columns.setdefault(task.status, []).append(task)
+
+    changed = []
+    for column in columns.values():
+        gaps = [after.order - before.order for before, after in zip(column, column[1:])]
+        if (column and column[0].order < min_gap) or (gaps and min(gaps) < min_gap):
+            changed.extend(spread(column))
+    Task.objects.bulk_update(changed, ['order'], batch_size=500)
+    record_changes(project_id, TASK, [task.id for task in changed])
+    return len(changed)
@@ -0,0 +1,239 @@
+import threading
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .broadcast import group_broadcast_many, layer_spans_processes
+from .models import OutboxEvent
+
+# Transactional outbox for the group events that announce database changes.
+# enqueue() writes the event in the transaction of the change, so an event
+# exists exactly when its change committed and the request never waits on
+# the channel layer. Once that transaction commits a dispatcher drains the
+# table in batches: the events of a project go out in id order, one
+# group_send per run of events for the same group (see
+# tasks.broadcast.group_broadcast_many). A batch is claimed in a short
+# transaction that leases its events for CLAIM_TIMEOUT seconds, published
+# with no transaction or row locks held and then deleted. A crash or a
+# failed publish leaves them in place to be sent again, so delivery is at
+# least once and frames carry event_id for clients to drop repeats.
+#
+# A failed event is retried alone, after RETRY_DELAY seconds doubling up
+# to MAX_RETRY_DELAY, and the later events of its project wait for it.
+# After MAX_ATTEMPTS it is dead-lettered: kept with dead_at set (see
+# run_outbox --requeue-dead) and no longer holding up its project.
+#
+# MODE 'thread' drains in a background thread of each process, woken by
+# commits and sweeping every POLL_INTERVAL seconds once started; 'inline'
+# drains in the committing thread; 'worker' leaves it to run_outbox, which
+# also picks up what a stopped process left behind. The in-memory channel
+# layer can only be published to from the server's event loop, so with it
+# 'thread' drains inline instead.
+THREAD = 'thread'
+INLINE = 'inline'
+WORKER = 'worker'
+
+DEFAULTS = {
+    'MODE': THREAD,
+    'BATCH_SIZE': 200,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 10,
+    'RETRY_DELAY': 1.0,
+    'MAX_RETRY_DELAY': 5 * 60,
+    'CLAIM_TIMEOUT': 60,
+}
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'OUTBOX', {})}
+    if config['MODE'] == THREAD and not layer_spans_processes():
+        config['MODE'] = INLINE
+    return config
+
+
+def enqueue(project_id, group, payload):
+    event = OutboxEvent.objects.create(project_id=project_id, group=group, payload=payload)
+    transaction.on_commit(committed)
+    return event
+
+
+def committed():
+    mode = get_config()['MODE']
+    if mode == INLINE:
+        drain()
+    elif mode == THREAD:
+        get_dispatcher().wake()
+    elif mode != WORKER:
+        raise ValueError(f"Unknown outbox mode: {mode}")
+
+
+# Dispatch
+
+# One dispatcher at a time in this process; the leases taken in claim()
+# keep dispatchers in different processes apart
+dispatch_lock = threading.Lock()
+
+
+def drain(batch_size=None):
+    """
+    Publishes pending events until the outbox is empty or what is left
+    cannot go out now. Returns the number of events published.
+    """
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    published = 0
+    while True:
+        sent, claimed = dispatch_batch(batch_size, config)
+        published += sent
+        if not sent or claimed < batch_size:
+            return published
+
+
+def dispatch_batch(batch_size, config=None):
+    # (events published, events claimed)
+    config = config or get_config()
+    now = timezone.now()
+    with dispatch_lock:
+        by_project, claimed = claim(batch_size, now, config)
+        if not by_project:
+            return 0, claimed
+
+        sent, failed = async_to_sync(publish)(by_project)
+        done = {event.id for event in sent + failed}
+        waiting = [event.id for events in by_project.values() for event in events if event.id not in done]
+        with transaction.atomic():
+            OutboxEvent.objects.filter(id__in=[event.id for event in sent]).delete()
+            for event in failed:
+                retry_later(event, now, config)
+            # Events held back behind a failure give their lease up
+            OutboxEvent.objects.filter(id__in=waiting).update(next_attempt_at=now)
+
+    for event in sent:
+        metrics.outbox_lag.observe(max(0.0, (now - event.created_at).total_seconds()))
+    metrics.outbox_published.inc(len(sent))
+    return len(sent), claimed
+
+
+def claim(batch_size, now, config):
+    # ({project_id: events to publish}, events looked at); the events are
+    # leased so that other dispatchers leave them alone while they go out
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(dead_at__isnull=True, next_attempt_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return {}, 0
+        by_project = {}
+        for event in events:
+            by_project.setdefault(event.project_id, []).append(event)
+
+        # A project whose older events are leased by another dispatcher or
+        # waiting for a retry waits for them, or its events could overtake
+        # each other
+        older = Q()
+        for project_id, project_events in by_project.items():
+            older |= Q(project_id=project_id, id__lt=project_events[0].id)
+        for project_id in OutboxEvent.objects.filter(older, dead_at__isnull=True).values_list('project_id', flat=True).distinct():
+            del by_project[project_id]
+
+        leased = [event.id for project_events in by_project.values() for event in project_events]
+        OutboxEvent.objects.filter(id__in=leased).update(next_attempt_at=now + timedelta(seconds=config['CLAIM_TIMEOUT']))
+    return by_project, len(events)
+
+
+def retry_later(event, now, config):
+    event.attempts += 1
+    metrics.outbox_failures.inc()
+    if event.attempts >= config['MAX_ATTEMPTS']:
+        event.dead_at = now
+        metrics.outbox_dead_letters.inc()
+        print(f"Dead-lettered outbox event {event.id} of project {event.project_id} after {event.attempts} attempts")
+    else:
+        delay = min(config['RETRY_DELAY'] * 2 ** (event.attempts - 1), config['MAX_RETRY_DELAY'])
+        event.next_attempt_at = now + timedelta(seconds=delay)
+    event.save(update_fields=['attempts', 'dead_at', 'next_attempt_at'])
+
+
+def runs(events):
+    # Consecutive events for the same group share a group_send; events that
+    # failed before go alone, so one bad event cannot sink its neighbours
+    current = []
+    for event in events:
+        if current and (event.attempts or current[0].attempts or event.group != current[0].group):
+            yield current
+            current = []
+        current.append(event)
+    if current:
+        yield current
+
+
+async def publish(by_project):
+    # (events sent, events that failed); a project stops at its first
+    # failure and the rest of its events stay for later, in order
+    sent, failed = [], []
+    for project_id, events in by_project.items():
+        for run in runs(events):
+            try:
+                await group_broadcast_many(run[0].group, [{'event_id': event.id, **event.payload} for event in run])
+            except Exception as e:
+                metrics.ws_broadcast_errors.inc()
+                failed.extend(run)
+                print(f"Failed to publish outbox events of project {project_id}: {e}")
+                break
+            sent.extend(run)
+    return sent, failed
+
+
+def requeue_dead():
+    # Puts dead-lettered events back in line, e.g. once the cause is fixed
+    return OutboxEvent.objects.filter(dead_at__isnull=False).update(dead_at=None, attempts=0, next_attempt_at=timezone.now())
+
+
+class OutboxDispatcher:
+    """
+    Daemon thread that drains the outbox when woken and every poll_interval
+    seconds, which retries failed publishes and collects events committed
+    by processes that stopped before sending them.
+    """
+
+    def __init__(self, poll_interval=DEFAULTS['POLL_INTERVAL']):
+        self.poll_interval = poll_interval
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def wake(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='outbox-dispatcher', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            close_old_connections()
+            try:
+                drain()
+            except Exception as e:
+                print(f"Failed to drain the outbox: {e}")
+            finally:
+                close_old_connections()
+
+
+_dispatcher = None
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboxDispatcher(get_config()['POLL_INTERVAL'])
+    return _dispatcher
@@ -0,0 +1,126 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .archive import ACTIVITY_LOG, CHAT_MESSAGE, merge_page
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination on (timestamp, id), backed by the composite
+    (project, timestamp, id) indexes. A page is always a bounded index range
+    scan, so the cost does not depend on how many rows the project has.
+
+    ?before=<cursor> loads older rows, ?after=<cursor> loads newer rows and
+    no cursor returns the most recent page.
+
+    With archive_kind set, pages reach into that kind's archived segments
+    (see tasks.archive) once the hot rows run out.
+    """
+
+    page_size = 50
+    max_page_size = 200
+    # Order of the rows inside a page: logs read newest first, chat oldest first
+    newest_first = True
+    before_query_param = 'before'
+    after_query_param = 'after'
+    limit_query_param = 'limit'
+    archive_kind = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        before = self.decode_cursor(request.query_params.get(self.before_query_param))
+        after = self.decode_cursor(request.query_params.get(self.after_query_param))
+
+        if after is not None:
+            timestamp, pk = after
+            queryset = queryset.filter(timestamp__gte=timestamp).filter(Q(timestamp__gt=timestamp) | Q(id__gt=pk))
+            rows = list(queryset.order_by('timestamp', 'id')[:self.limit + 1])
+            rows = self.merge_archived(view, rows, after=after)
+            self.has_newer = len(rows) > self.limit
+            self.has_older = True
+            rows = rows[:self.limit]
+            rows.reverse()
+        else:
+            if before is not None:
+                timestamp, pk = before
+                queryset = queryset.filter(timestamp__lte=timestamp).filter(Q(timestamp__lt=timestamp) | Q(id__lt=pk))
+            rows = list(queryset.order_by('-timestamp', '-id')[:self.limit + 1])
+            rows = self.merge_archived(view, rows, before=before)
+            self.has_older = len(rows) > self.limit
+            self.has_newer = before is not None
+            rows = rows[:self.limit]
+
+        # rows are newest first at this point
+        self.newest = rows[0] if rows else None
+        self.oldest = rows[-1] if rows else None
+        if not self.newest_first:
+            rows.reverse()
+        return rows
+
+    def merge_archived(self, view, rows, before=None, after=None):
+        project_id = getattr(view, 'kwargs', {}).get('project_id')
+        if self.archive_kind is None or project_id is None:
+            return rows
+        return merge_page(project_id, self.archive_kind, rows, self.limit + 1, before=before, after=after)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'older': self.get_link(self.before_query_param, self.oldest) if self.has_older else None,
+            'newer': self.get_link(self.after_query_param, self.newest) if self.has_newer else None,
+            'results': data,
+        })
+
+    def get_link(self, param, row):
+        if row is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.before_query_param)
+        url = remove_query_param(url, self.after_query_param)
+        return replace_query_param(url, param, self.encode_cursor(row))
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(limit, self.max_page_size))
+
+    @staticmethod
+    def encode_cursor(row):
+        raw = f'{row.timestamp.isoformat()}|{row.id}'
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            timestamp, pk = raw.rsplit('|', 1)
+            return datetime.fromisoformat(timestamp), int(pk)
+        except (ValueError, UnicodeError):
+            raise NotFound('Invalid cursor')
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.before_query_param, 'required': False, 'in': 'query', 'schema': {'type': 'string'}},
+            {'name': self.after_query_param, 'required': False, 'in': 'query', 'schema': {'type': 'string'}},
+            {'name': self.limit_query_param, 'required': False, 'in': 'query', 'schema': {'type': 'integer'}},
+        ]
+
+
+class ActivityLogPagination(KeysetPagination):
+    newest_first = True
+    archive_kind = ACTIVITY_LOG
+
+
+class ChatMessagePagination(KeysetPagination):
+    newest_first = False
+    archive_kind = CHAT_MESSAGE
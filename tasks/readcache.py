@@ -0,0 +1,185 @@
+import hashlib
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from . import metrics
+from .models import Project
+
+# Read-through cache for lookups the SPA polls: project details, member
+# lists and users (by id for authentication, see accounts.backends, and by
+# username). Every project and user has a version key; entries remember
+# the versions they were read at and are only served while those are
+# current, so invalidating is one increment however many entries depend on
+# it (see tasks.signals). Entries expire after TIMEOUT and the cache evicts
+# least recently used ones on its own.
+#
+# Versions are only bumped in the cache of the process that made the
+# change. LocMemCache is per process, so with several processes the others
+# serve old entries for up to TIMEOUT. Anything that must not be stale
+# (the authenticated user, 304s on version based ETags) is only taken from
+# here when the cache is shared (Redis, Memcached, database): SHARED None
+# assumes every backend but LocMemCache is, True / False override that,
+# e.g. True for a single process.
+# User fields kept in the cache for request.user and the user lookups; the
+# rest, the password hash included, stays in the database and is loaded on
+# access like any deferred field
+USER_FIELDS = ['id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser', 'date_joined']
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'TIMEOUT': 5 * 60,
+    'SHARED': None,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'READ_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE']]
+
+
+def is_shared():
+    shared = get_config()['SHARED']
+    if shared is None:
+        return not isinstance(get_cache(), LocMemCache)
+    return shared
+
+
+def project_version_key(project_id):
+    return f'read:version:project:{project_id}'
+
+
+def user_version_key(user_id):
+    return f'read:version:user:{user_id}'
+
+
+def current_versions(cache, keys):
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        # Random starting points, so an evicted version key never comes back
+        # at a value old entries were stored with
+        cache.add(key, random.getrandbits(62), None)
+    if missing:
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def project_version(project_id):
+    return current_versions(get_cache(), [project_version_key(project_id)])[0]
+
+
+def bump(keys):
+    cache = get_cache()
+
+    def increment():
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Nothing cached against it yet
+                pass
+
+    increment()
+    # Again once the change is visible, in case a reader cached the old rows
+    # in between
+    transaction.on_commit(increment)
+
+
+def project_changed(*project_ids):
+    bump([project_version_key(project_id) for project_id in project_ids])
+
+
+def user_changed(user_id, project_ids=()):
+    # Member lists show usernames and emails, so the user's projects too
+    bump([user_version_key(user_id)] + [project_version_key(project_id) for project_id in project_ids])
+
+
+def read_through(name, key, version_keys, load):
+    cache = get_cache()
+    versions = current_versions(cache, version_keys)
+    entry = cache.get(key)
+    if entry is not None and entry['versions'] == versions:
+        metrics.read_cache_requests.inc(name=name, result='hit')
+        return entry['value']
+    metrics.read_cache_requests.inc(name=name, result='miss')
+    # Versions were read before the rows, a change in between makes this
+    # entry stale right away instead of serving old rows as new
+    value = load()
+    cache.set(key, {'versions': versions, 'value': value}, get_config()['TIMEOUT'])
+    return value
+
+
+# Lookups
+
+def project_detail(project_id):
+    # {'name', 'manager'}, or None for a missing project
+    def load():
+        return Project.objects.filter(id=project_id).values('name', 'manager').first()
+
+    return read_through('project_detail', f'read:project:{project_id}', [project_version_key(project_id)], load)
+
+
+def project_members(project_id):
+    # [{'username', 'email', 'id'}, ...], or None for a missing project
+    def load():
+        project = Project.objects.filter(id=project_id).first()
+        if project is None:
+            return None
+        return [{'username': member.username, 'email': member.email, 'id': member.id} for member in project.members.all()]
+
+    return read_through('project_members', f'read:members:{project_id}', [project_version_key(project_id)], load)
+
+
+def get_user(user_id):
+    # The user with USER_FIELDS loaded, or None
+    User = get_user_model()
+
+    # from_db takes the values in model field order
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in USER_FIELDS]
+
+    def load():
+        user = User._default_manager.filter(pk=user_id).only(*names, 'password').first()
+        if user is None:
+            return None
+        return {
+            'fields': [getattr(user, name) for name in names],
+            'session_auth_hash': user.get_session_auth_hash(),
+        }
+
+    entry = read_through('user', f'read:user:{user_id}', [user_version_key(user_id)], load)
+    if entry is None:
+        return None
+    user = User.from_db(User._default_manager.db, names, entry['fields'])
+    # Sessions are verified against this, without loading the password
+    session_auth_hash = entry['session_auth_hash']
+    user.get_session_auth_hash = lambda: session_auth_hash
+    return user
+
+
+def get_user_by_username(username):
+    # Usernames map to ids, checked against the user read through get_user,
+    # so a rename makes the old name miss. Hashed: the name comes from the
+    # URL and may not be a valid cache key as it is
+    cache = get_cache()
+    key = f"read:username:{hashlib.md5(username.encode(), usedforsecurity=False).hexdigest()}"
+    user_id = cache.get(key)
+    if user_id is not None:
+        user = get_user(user_id)
+        if user is not None and user.username == username:
+            return user
+
+    User = get_user_model()
+    user_id = User._default_manager.filter(username=username).values_list('pk', flat=True).first()
+    if user_id is None:
+        return None
+    cache.set(key, user_id, get_config()['TIMEOUT'])
+    user = get_user(user_id)
+    return user if user is not None and user.username == username else None
@@ -0,0 +1,287 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .broadcast import group_broadcast, layer_spans_processes, task_group_name
+from .models import Task
+
+# "Due soon" and "overdue" events for task deadlines, pushed to the
+# project's task group by the run_reminders worker.
+#
+# The worker keeps the deadlines of the next HORIZON seconds in a heap,
+# loaded through the task_deadline index one slice at a time as the horizon
+# moves forward, so the task table is never polled. Saves of tasks with a
+# deadline send it to the worker's channel (see tasks.signals) and bulk
+# writes ask it to reload its window. Due tasks are re-read before their
+# event goes out, which catches cleared deadlines and finished tasks.
+#
+# The in-memory channel layer never reaches another process, so with it the
+# worker runs inside the web process instead, started on its event loop by
+# the first task socket (IN_PROCESS None picks this by layer).
+logger = logging.getLogger(__name__)
+
+DUE_SOON = 'due_soon'
+OVERDUE = 'overdue'
+DONE = 'Done'
+
+DEFAULTS = {
+    'CHANNEL': 'task-reminders',
+    # Seconds before the deadline that the due soon event fires
+    'DUE_SOON': 60 * 60,
+    'HORIZON': 24 * 60 * 60,
+    'RELOAD_INTERVAL': 60 * 60,
+    'IN_PROCESS': None,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REMINDERS', {})}
+
+
+def runs_in_process():
+    in_process = get_config()['IN_PROCESS']
+    if in_process is None:
+        return not layer_spans_processes()
+    return in_process
+
+
+class ReminderScheduler:
+    """
+    Deadline heap with lazy deletion. Each task has at most one live entry:
+    its due soon event, then its overdue event once due soon has fired. A
+    new schedule for a task bumps its version, which turns any entry still
+    in the heap into a no-op. Popping the due entries is O(log n) each, so
+    a tick costs the same with a thousand tasks as with a million.
+    """
+
+    def __init__(self, due_soon=timedelta(seconds=DEFAULTS['DUE_SOON'])):
+        self.due_soon = due_soon
+        self.heap = []
+        # task id -> (version, project id, title, deadline)
+        self.tasks = {}
+        self.versions = itertools.count()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def schedule(self, task_id, project_id, title, deadline, status, now):
+        if deadline is None or status == DONE or deadline <= now:
+            self.remove(task_id)
+            return
+        if task_id in self.tasks and self.tasks[task_id][3] == deadline:
+            # Already scheduled, e.g. by a reload
+            return
+        version = next(self.versions)
+        self.tasks[task_id] = (version, project_id, title, deadline)
+        heapq.heappush(self.heap, (max(deadline - self.due_soon, now), version, task_id, DUE_SOON))
+        if len(self.heap) > 2 * len(self.tasks) + 1024:
+            # Mostly superseded entries, drop them
+            self.heap = [entry for entry in self.heap if self.is_live(entry)]
+            heapq.heapify(self.heap)
+
+    def remove(self, task_id):
+        self.tasks.pop(task_id, None)
+
+    def next_fire_at(self):
+        while self.heap and not self.is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def is_live(self, entry):
+        current = self.tasks.get(entry[2])
+        return current is not None and current[0] == entry[1]
+
+    def due(self, now):
+        # Events whose time has come, in firing order
+        events = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if not self.is_live(entry):
+                continue
+            fire_at, version, task_id, kind = entry
+            _, project_id, title, deadline = self.tasks[task_id]
+            events.append({'kind': kind, 'task_id': task_id, 'project_id': project_id, 'title': title, 'deadline': deadline})
+            if kind == DUE_SOON:
+                heapq.heappush(self.heap, (deadline, version, task_id, OVERDUE))
+            else:
+                del self.tasks[task_id]
+        return events
+
+
+# Producers
+
+def send_to_worker(message):
+    try:
+        async_to_sync(get_channel_layer().send)(get_config()['CHANNEL'], message)
+    except ChannelFull:
+        # Worker is down or behind; it reloads its window on start
+        metrics.channel_full.inc(source='reminders')
+    except Exception as e:
+        print(f"Failed to send reminder update: {e}")
+
+
+def task_changed(task):
+    # Only tasks with a deadline, see the module comment for the others
+    if task.deadline is None:
+        return
+    message = {
+        'type': 'reminders.update',
+        'task_id': task.id,
+        'project_id': task.project_id,
+        'title': task.title,
+        'deadline': task.deadline.isoformat(),
+        'status': task.status,
+    }
+    transaction.on_commit(lambda: send_to_worker(message))
+
+
+def reload_requested():
+    # For bulk writes, which skip the signals
+    transaction.on_commit(lambda: send_to_worker({'type': 'reminders.reload'}))
+
+
+# Worker
+
+class ReminderWorker:
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.scheduler = ReminderScheduler(timedelta(seconds=self.config['DUE_SOON']))
+        self.horizon = timedelta(seconds=self.config['HORIZON'])
+        self.loaded_from = self.loaded_until = None
+        self.wakeup = asyncio.Event()
+
+    @database_sync_to_async
+    def fetch(self, start, end):
+        # Range scan on the task_deadline index
+        return list(
+            Task.objects.filter(deadline__gt=start, deadline__lte=end)
+            .exclude(status=DONE)
+            .values_list('id', 'project_id', 'title', 'deadline', 'status')
+            .iterator(chunk_size=5000)
+        )
+
+    async def load(self, start, end):
+        now = timezone.now()
+        rows = await self.fetch(start, end)
+        for task_id, project_id, title, deadline, status in rows:
+            self.scheduler.schedule(task_id, project_id, title, deadline, status, now)
+        return len(rows)
+
+    async def extend(self):
+        # Loads the slice between the old and the new end of the horizon
+        now = timezone.now()
+        if self.loaded_until is None:
+            self.loaded_from, self.loaded_until = now, now + self.horizon
+            return await self.load(self.loaded_from, self.loaded_until)
+        end = now + self.horizon
+        loaded = await self.load(self.loaded_until, end)
+        self.loaded_until = end
+        return loaded
+
+    async def reload(self):
+        return await self.load(timezone.now(), self.loaded_until)
+
+    def apply(self, message):
+        if message.get('type') == 'reminders.reload':
+            return True
+        deadline = message.get('deadline')
+        deadline = datetime.fromisoformat(deadline) if deadline else None
+        if deadline is not None and deadline > self.loaded_until:
+            # Picked up by a later extend()
+            self.scheduler.remove(message['task_id'])
+            return False
+        self.scheduler.schedule(
+            message['task_id'], message.get('project_id'), message.get('title'), deadline, message.get('status'), timezone.now(),
+        )
+        return False
+
+    async def listen(self):
+        layer = get_channel_layer()
+        while True:
+            message = await layer.receive(self.config['CHANNEL'])
+            if self.apply(message):
+                await self.reload()
+            self.wakeup.set()
+
+    @database_sync_to_async
+    def current(self, task_ids):
+        return {row[0]: row[1:] for row in Task.objects.filter(id__in=task_ids).values_list('id', 'project_id', 'title', 'deadline', 'status')}
+
+    async def fire(self, now):
+        events = self.scheduler.due(now)
+        if not events:
+            return []
+        current = await self.current([event['task_id'] for event in events])
+        sent = []
+        for event in events:
+            if event['task_id'] not in current:
+                continue
+            project_id, title, deadline, status = current[event['task_id']]
+            if status == DONE:
+                continue
+            if deadline != event['deadline']:
+                # Changed without a message reaching us
+                self.scheduler.schedule(event['task_id'], project_id, title, deadline, status, now)
+                continue
+            event.update(project_id=project_id, title=title)
+            await group_broadcast(task_group_name(project_id), {'reminder': event})
+            sent.append(event)
+        return sent
+
+    async def run(self, stdout=None):
+        await self.extend()
+        listener = asyncio.ensure_future(self.listen())
+        next_extend = timezone.now() + timedelta(seconds=self.config['RELOAD_INTERVAL'])
+        try:
+            while True:
+                now = timezone.now()
+                if now >= next_extend:
+                    await self.extend()
+                    next_extend = now + timedelta(seconds=self.config['RELOAD_INTERVAL'])
+                events = await self.fire(now)
+                if stdout and events:
+                    stdout.write(f"Sent {len(events)} reminders, {len(self.scheduler)} scheduled.")
+
+                next_fire = self.scheduler.next_fire_at()
+                wait_until = min(next_extend, next_fire) if next_fire else next_extend
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), max(0, (wait_until - timezone.now()).total_seconds()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            listener.cancel()
+
+
+_worker = None
+
+
+def ensure_in_process_worker():
+    # Called from the event loop of a web process, see the module comment
+    global _worker
+    if not runs_in_process():
+        return
+    loop = asyncio.get_running_loop()
+    if _worker is None or _worker.done() or _worker.get_loop() is not loop:
+        _worker = loop.create_task(run_in_process())
+
+
+async def run_in_process():
+    try:
+        await ReminderWorker().run()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # The next task socket starts it again
+        logger.exception('Reminder worker stopped')
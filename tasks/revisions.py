@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Project, ProjectChange
+
+TASK = 'task'
+SUBTASK = 'subtask'
+
+# Changes recorded inside collect_changes() are written in one go on exit
+_collected = ContextVar('collected_project_changes', default=None)
+
+
+def bump_revision(project_id):
+    # The UPDATE keeps the project row locked until the surrounding
+    # transaction commits, so revisions become visible in commit order
+    Project.objects.filter(id=project_id).update(revision=F('revision') + 1)
+    return Project.objects.filter(id=project_id).values_list('revision', flat=True).get()
+
+
+def bump_revisions(project_ids):
+    # For deleted history rows, which have no ProjectChange of their own but
+    # must still change the validators of tasks.conditional
+    Project.objects.filter(id__in=project_ids).update(revision=F('revision') + 1)
+
+
+def record_changes(project_id, kind, object_ids, deleted=False):
+    collected = _collected.get()
+    if collected is not None:
+        collected.setdefault(project_id, {}).update({(kind, object_id): deleted for object_id in object_ids})
+        return
+    write_changes(project_id, {(kind, object_id): deleted for object_id in object_ids})
+
+
+def write_changes(project_id, changes):
+    if not changes:
+        return
+    with transaction.atomic():
+        revision = bump_revision(project_id)
+        ProjectChange.objects.bulk_create(
+            [
+                ProjectChange(project_id=project_id, kind=kind, object_id=object_id, revision=revision, deleted=deleted)
+                for (kind, object_id), deleted in changes.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['project', 'kind', 'object_id'],
+            update_fields=['revision', 'deleted'],
+        )
+
+
+@contextmanager
+def collect_changes():
+    """
+    Coalesces every change recorded in the block into one revision bump and
+    one bulk upsert per project, for batch and bulk write paths.
+    """
+    if _collected.get() is not None:
+        yield
+        return
+    token = _collected.set({})
+    try:
+        yield
+        collected = _collected.get()
+    finally:
+        _collected.reset(token)
+    for project_id, changes in collected.items():
+        write_changes(project_id, changes)
@@ -0,0 +1,222 @@
+import re
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+
+from .models import ChatMessage, SubTask, Task
+
+# Full-text search over tasks, subtasks and chat messages.
+#
+# PostgreSQL: a generated, weighted tsvector column per table (kept current
+# by Postgres on every write) with a GIN index, ranked with ts_rank_cd.
+# SQLite: external-content FTS5 tables kept in sync by triggers, ranked with
+# bm25, for local development and tests.
+# Other databases: unindexed icontains matching, unranked (see
+# search_fallback), so the endpoint keeps working while slower.
+SEARCHABLE = [
+    ('tasks_task', ['title', 'description']),
+    ('tasks_subtask', ['title', 'description']),
+    ('tasks_chatmessage', ['message']),
+]
+
+
+def postgres_vector(columns):
+    weights = 'ABCD'
+    return ' || '.join(
+        f"setweight(to_tsvector('english', coalesce({column}, '')), '{weights[index]}')"
+        for index, column in enumerate(columns)
+    )
+
+
+def install_postgres(schema_editor):
+    # btree_gin lets the project filter and the text match share one GIN
+    # index; without the extension a plain GIN index is used
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+        composite = True
+    except DatabaseError:
+        composite = False
+
+    for table, columns in SEARCHABLE:
+        schema_editor.execute(
+            f'ALTER TABLE {table} ADD COLUMN search_vector tsvector '
+            f'GENERATED ALWAYS AS ({postgres_vector(columns)}) STORED'
+        )
+        if composite and table != 'tasks_subtask':
+            schema_editor.execute(f'CREATE INDEX {table}_search ON {table} USING GIN (project_id, search_vector)')
+        else:
+            schema_editor.execute(f'CREATE INDEX {table}_search ON {table} USING GIN (search_vector)')
+
+
+def install_sqlite_triggers(schema_editor, table, columns):
+    # SQLite drops a table's triggers whenever a migration rebuilds it, so
+    # migrations that alter these tables have to call this again
+    names = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    for trigger in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{trigger}')
+    schema_editor.execute(
+        f'CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN '
+        f'INSERT INTO {table}_fts(rowid, {names}) VALUES (new.id, {new_values}); END'
+    )
+    schema_editor.execute(
+        f'CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN '
+        f"INSERT INTO {table}_fts({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values}); END"
+    )
+    schema_editor.execute(
+        f'CREATE TRIGGER {table}_fts_update AFTER UPDATE ON {table} BEGIN '
+        f"INSERT INTO {table}_fts({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values}); "
+        f'INSERT INTO {table}_fts(rowid, {names}) VALUES (new.id, {new_values}); END'
+    )
+
+
+def install_sqlite(schema_editor):
+    for table, columns in SEARCHABLE:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {table}_fts USING fts5({', '.join(columns)}, "
+            f"content='{table}', content_rowid='id', tokenize='porter unicode61')"
+        )
+        install_sqlite_triggers(schema_editor, table, columns)
+        schema_editor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def reinstall_sqlite_triggers(apps, schema_editor):
+    # RunPython helper for migrations that rebuild a searchable table
+    if schema_editor.connection.vendor == 'sqlite':
+        for table, columns in SEARCHABLE:
+            install_sqlite_triggers(schema_editor, table, columns)
+
+
+def install(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        install_postgres(schema_editor)
+    elif schema_editor.connection.vendor == 'sqlite':
+        install_sqlite(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    for table, columns in SEARCHABLE:
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_search')
+            schema_editor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+        elif schema_editor.connection.vendor == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{trigger}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+# Queries
+
+POSTGRES_SEARCH = """
+    WITH q AS (SELECT websearch_to_tsquery('english', %(query)s) AS query)
+    SELECT hits.kind, hits.id, hits.task_id, hits.title, hits.timestamp, hits.rank,
+           ts_headline('english', hits.body, q.query, 'MaxFragments=1, MaxWords=20, MinWords=5') AS snippet
+    FROM (
+        SELECT 'task' AS kind, t.id, t.id AS task_id, t.title, t.description AS body,
+               t.updated_at AS timestamp, ts_rank_cd(t.search_vector, q.query) AS rank
+        FROM tasks_task t, q
+        WHERE t.project_id = %(project_id)s AND t.search_vector @@ q.query
+        UNION ALL
+        SELECT 'subtask', s.id, s.task_id, s.title, coalesce(s.description, s.title),
+               NULL, ts_rank_cd(s.search_vector, q.query)
+        FROM tasks_subtask s JOIN tasks_task t ON t.id = s.task_id, q
+        WHERE t.project_id = %(project_id)s AND s.search_vector @@ q.query
+        UNION ALL
+        SELECT 'chat', c.id, NULL, NULL, c.message,
+               c.timestamp, ts_rank_cd(c.search_vector, q.query)
+        FROM tasks_chatmessage c, q
+        WHERE c.project_id = %(project_id)s AND c.search_vector @@ q.query
+        ORDER BY rank DESC, id DESC
+        LIMIT %(limit)s OFFSET %(offset)s
+    ) hits, q
+    ORDER BY hits.rank DESC, hits.id DESC
+"""
+
+SQLITE_SEARCH = """
+    SELECT kind, id, task_id, title, timestamp, rank, snippet FROM (
+        SELECT 'task' AS kind, t.id AS id, t.id AS task_id, t.title AS title, t.updated_at AS timestamp,
+               -bm25(tasks_task_fts, 2.0, 1.0) AS rank,
+               snippet(tasks_task_fts, -1, '<b>', '</b>', '...', 20) AS snippet
+        FROM tasks_task_fts JOIN tasks_task t ON t.id = tasks_task_fts.rowid
+        WHERE tasks_task_fts MATCH %(query)s AND t.project_id = %(project_id)s
+        UNION ALL
+        SELECT 'subtask', s.id, s.task_id, s.title, NULL,
+               -bm25(tasks_subtask_fts, 2.0, 1.0),
+               snippet(tasks_subtask_fts, -1, '<b>', '</b>', '...', 20)
+        FROM tasks_subtask_fts JOIN tasks_subtask s ON s.id = tasks_subtask_fts.rowid
+        JOIN tasks_task t ON t.id = s.task_id
+        WHERE tasks_subtask_fts MATCH %(query)s AND t.project_id = %(project_id)s
+        UNION ALL
+        SELECT 'chat', c.id, NULL, NULL, c.timestamp,
+               -bm25(tasks_chatmessage_fts),
+               snippet(tasks_chatmessage_fts, -1, '<b>', '</b>', '...', 20)
+        FROM tasks_chatmessage_fts JOIN tasks_chatmessage c ON c.id = tasks_chatmessage_fts.rowid
+        WHERE tasks_chatmessage_fts MATCH %(query)s AND c.project_id = %(project_id)s
+    )
+    ORDER BY rank DESC, id DESC
+    LIMIT %(limit)s OFFSET %(offset)s
+"""
+
+COLUMNS = ['kind', 'id', 'task_id', 'title', 'timestamp', 'rank', 'snippet']
+
+
+def fts5_query(text):
+    # Every word must match; the last one as a prefix so typing ahead works
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_project(project_id, text, limit=20, offset=0):
+    """
+    Ranked hits for text across the project's tasks, subtasks and chat, as
+    dicts with kind ('task' | 'subtask' | 'chat'), id, task_id, title,
+    timestamp, rank and a highlighted snippet.
+    """
+    params = {'project_id': project_id, 'limit': limit, 'offset': offset}
+    if connection.vendor == 'postgresql':
+        sql = POSTGRES_SEARCH
+        params['query'] = text
+    elif connection.vendor == 'sqlite':
+        sql = SQLITE_SEARCH
+        params['query'] = fts5_query(text)
+        if params['query'] is None:
+            return []
+    else:
+        return search_fallback(project_id, text, limit, offset)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def search_fallback(project_id, text, limit=20, offset=0):
+    # Every word must appear in one of the searched columns; hits are
+    # unranked and come newest first
+    words = re.findall(r'\w+', text)
+    if not words:
+        return []
+
+    def matching(queryset, columns):
+        for word in words:
+            queryset = queryset.filter(Q(*[Q(**{f'{column}__icontains': word}) for column in columns], _connector=Q.OR))
+        return queryset.order_by('-id')[:offset + limit]
+
+    # (kind, id, task_id, title, timestamp, body)
+    hits = [
+        ('task', task.id, task.id, task.title, task.updated_at, task.description)
+        for task in matching(Task.objects.filter(project_id=project_id), ['title', 'description'])
+    ] + [
+        ('subtask', sub_task.id, sub_task.task_id, sub_task.title, None, sub_task.description or sub_task.title)
+        for sub_task in matching(SubTask.objects.filter(task__project_id=project_id), ['title', 'description'])
+    ] + [
+        ('chat', message.id, None, None, message.timestamp, message.message)
+        for message in matching(ChatMessage.objects.filter(project_id=project_id), ['message'])
+    ]
+    hits.sort(key=lambda hit: hit[1], reverse=True)
+    return [dict(zip(COLUMNS, (*hit[:5], 0.0, hit[5][:120]))) for hit in hits[offset:offset + limit]]
@@ -14,6 +14,7 @@ class TaskSerializer(serializers.ModelSerializer):
     class Meta:
         model = Task
         fields = '__all__'
+        read_only_fields = ['subtask_total', 'subtask_completed']
 
 class SubTaskSerializer(serializers.ModelSerializer):
     class Meta:
@@ -32,4 +33,16 @@ class ChatMessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ChatMessage
-        fields = ['user', 'message', 'timestamp']
\ No newline at end of file
+        fields = ['user', 'message', 'timestamp']
+
+class BoardTaskSerializer(TaskSerializer):
+    # Reads from the prefetched owner cache, no per-task queries; cards show
+    # the subtask counters
+    owner_usernames = serializers.SerializerMethodField()
+
+    def get_owner_usernames(self, task):
+        return [owner.username for owner in task.owner.all()]
+
+class BoardTaskWithSubTasksSerializer(BoardTaskSerializer):
+    # For ?sub_tasks=1, reads from the prefetched sub_tasks cache
+    sub_tasks = SubTaskSerializer(many=True, read_only=True)
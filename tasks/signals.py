@@ -0,0 +1,102 @@
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from django.conf import settings
+
+from . import counters, membership, readcache, reminders
+from .models import ActivityLog, ChatMessage, Project, SubTask, Task
+from .revisions import SUBTASK, TASK, bump_revisions, record_changes
+
+
+@receiver(m2m_changed, sender=Project.members.through)
+def project_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if reverse:
+        # user.projects.add(...) and friends: instance is the user
+        project_ids = pk_set if pk_set is not None else membership.user_project_ids(instance.pk)
+        membership.invalidate(project_ids=project_ids, user_ids=[instance.pk])
+        readcache.project_changed(*project_ids)
+    else:
+        user_ids = pk_set if pk_set is not None else membership.project_member_ids(instance.pk)
+        membership.invalidate(project_ids=[instance.pk], user_ids=user_ids)
+        readcache.project_changed(instance.pk)
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, raw=False, **kwargs):
+    # New rows too, their ids may have been used before (restored dumps,
+    # rolled back transactions)
+    if not raw:
+        readcache.project_changed(instance.pk)
+
+
+@receiver(pre_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    membership.invalidate(project_ids=[instance.pk], user_ids=membership.project_member_ids(instance.pk))
+    readcache.project_changed(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    # Logins only touch last_login, which no cached lookup shows
+    if raw or update_fields == frozenset(['last_login']):
+        return
+    if created:
+        readcache.user_changed(instance.pk)
+    else:
+        readcache.user_changed(instance.pk, membership.user_project_ids(instance.pk))
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    readcache.user_changed(instance.pk, membership.user_project_ids(instance.pk))
+    # Their activity logs and chat messages go with them
+    bump_revisions(
+        set(ActivityLog.objects.filter(user=instance).order_by().values_list('project_id', flat=True).distinct())
+        | set(ChatMessage.objects.filter(user=instance).order_by().values_list('project_id', flat=True).distinct())
+    )
+
+
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record_changes(instance.project_id, TASK, [instance.id])
+        reminders.task_changed(instance)
+
+
+def cascaded_from(origin, *models):
+    # origin is the instance or queryset whose delete() started the cascade
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, models)
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, origin=None, **kwargs):
+    # Nothing to record for the tasks of a deleted project
+    if origin is None or not cascaded_from(origin, Project):
+        record_changes(instance.project_id, TASK, [instance.id], deleted=True)
+
+
+@receiver(post_save, sender=SubTask)
+def subtask_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        record_changes(instance.task.project_id, SUBTASK, [instance.id])
+        counters.subtask_saved(instance, created)
+
+
+@receiver(pre_delete, sender=SubTask)
+def subtask_deleting(sender, instance, origin=None, **kwargs):
+    if origin is None or not cascaded_from(origin, Project, Task):
+        counters.subtask_deleting(instance)
+
+
+@receiver(post_delete, sender=SubTask)
+def subtask_deleted(sender, instance, origin=None, **kwargs):
+    # The task's own change covers the subtasks deleted along with it
+    if origin is not None and cascaded_from(origin, Project, Task):
+        return
+    record_changes(instance.task.project_id, SUBTASK, [instance.id], deleted=True)
+    counters.subtask_deleted(instance)
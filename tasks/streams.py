@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# Every group event gets the next sequence number of its group and its
+# encoded frame is kept in a bounded ring buffer in the cache, evicted by
+# age (RETENTION seconds) and by size (BUFFER_SIZE events). A reconnecting
+# socket can then replay what it missed instead of reloading the board.
+# Seqs are only meaningful if every process counts in the same cache: with
+# a channel layer that spans processes CACHE must be shared (Redis,
+# Memcached), see tasks.checks.
+DEFAULTS = {
+    'CACHE': 'default',
+    'BUFFER_SIZE': 500,
+    'RETENTION': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WS_STREAM', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE']]
+
+
+def seq_key(group):
+    return f'stream:{group}:seq'
+
+
+def frame_key(group, seq):
+    return f'stream:{group}:{seq}'
+
+
+async def next_seq(group):
+    cache = get_cache()
+    await cache.aadd(seq_key(group), 0, None)
+    return await cache.aincr(seq_key(group))
+
+
+async def current_seq(group):
+    return await get_cache().aget(seq_key(group), 0)
+
+
+async def remember_frame(group, seq, frame):
+    config = get_config()
+    cache = get_cache()
+    await cache.aset(frame_key(group, seq), frame, config['RETENTION'])
+    if seq > config['BUFFER_SIZE']:
+        await cache.adelete(frame_key(group, seq - config['BUFFER_SIZE']))
+
+
+async def missed_frames(group, last_seq):
+    """
+    Frames after last_seq in order, or None when some of them have already
+    been evicted and the client has to do a full resync.
+    """
+    head = await current_seq(group)
+    if last_seq == head:
+        return []
+    if last_seq > head or head - last_seq > get_config()['BUFFER_SIZE']:
+        return None
+
+    keys = [frame_key(group, seq) for seq in range(last_seq + 1, head + 1)]
+    found = await get_cache().aget_many(keys)
+    if len(found) != len(keys):
+        return None
+    return [found[key] for key in keys]
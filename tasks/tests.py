@@ -1,3 +1,1150 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import warnings
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import InterfaceError, OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .analytics import rebuild_project
+from .chat_buffer import ChatWriteBehindQueue
+from .checks import check_shared_caches
+from .archive import archive_history
+from .reminders import ReminderScheduler, runs_in_process
+from .search import search_fallback
+from .broadcast import group_broadcast, task_group_name
+from .consumers import TaskConsumer
+from .counters import repair_counts
+from .export import export_project
+from .layers import PostgresChannelLayer
+from .loadtest import run_load_test
+from . import metrics
+from .models import ActivityLog, ChannelGroupMembership, ChannelSpillMessage, ChatMessage, HistorySegment, OutboxEvent, Project, ProjectChange, ProjectStatusDay, SubTask, Task, TaskStatusPeriod
+from .membership import is_member, user_project_ids
+from .ordering import ORDER_GAP
+from . import outbox
+from .outbox import drain, requeue_dead
+from .streams import missed_frames
+
+User = get_user_model()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgresChannelLayer needs a PostgreSQL database')
+class PostgresChannelLayerTests(TransactionTestCase):
+    # Two layer instances stand in for two daphne processes
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_group_send_reaches_other_process(self):
+        async def scenario():
+            first, second = PostgresChannelLayer(), PostgresChannelLayer()
+            try:
+                channel = await first.new_channel()
+                await first.group_add('project_1', channel)
+                await second.group_send('project_1', {'type': 'task.message', 'text': 'hello'})
+                return await asyncio.wait_for(first.receive(channel), 5)
+            finally:
+                await first.close()
+                await second.close()
+
+        self.assertEqual(self.run_async(scenario()), {'type': 'task.message', 'text': 'hello'})
+
+    def test_large_payload_is_spilled(self):
+        async def scenario():
+            first, second = PostgresChannelLayer(), PostgresChannelLayer()
+            try:
+                channel = await first.new_channel()
+                await second.send(channel, {'type': 'task.message', 'text': 'x' * 20000})
+                return await asyncio.wait_for(first.receive(channel), 5)
+            finally:
+                await first.close()
+                await second.close()
+
+        self.assertEqual(len(self.run_async(scenario())['text']), 20000)
+        self.assertEqual(ChannelSpillMessage.objects.count(), 1)
+
+    def test_group_discard_and_expiry(self):
+        async def scenario():
+            layer = PostgresChannelLayer(group_expiry=0)
+            try:
+                channel = await layer.new_channel()
+                await layer.group_add('project_1', channel)
+                await layer.group_send('project_1', {'type': 'task.message'})
+                return channel in layer.queues
+            finally:
+                await layer.close()
+
+        self.assertFalse(self.run_async(scenario()))
+        self.assertEqual(ChannelGroupMembership.objects.count(), 1)
+
+    def test_capacity_is_enforced_locally(self):
+        async def scenario():
+            layer = PostgresChannelLayer(capacity=2)
+            try:
+                channel = await layer.new_channel()
+                await layer.group_add('project_1', channel)
+                for _ in range(5):
+                    await layer.group_send('project_1', {'type': 'task.message'})
+                return len(layer.queues[channel])
+            finally:
+                await layer.close()
+
+        self.assertEqual(self.run_async(scenario()), 2)
+
+
+class ChatWriteBehindTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='talker', password='secret')
+        self.project = Project.objects.create(name='Chatty')
+        self.queue = ChatWriteBehindQueue(batch_size=2, flush_interval=60)
+        # Nothing left for the exit hook, the test database is gone by then
+        self.addCleanup(self.queue.pending.clear)
+
+    def save(self, *messages):
+        async def scenario():
+            for message in messages:
+                await self.queue.save(self.project.id, self.user.id, message)
+            self.queue.flusher.cancel()
+        async_to_sync(scenario)()
+
+    def saved(self):
+        return list(ChatMessage.objects.filter(project=self.project).order_by('id').values_list('message', flat=True))
+
+    def test_messages_are_written_in_batches(self):
+        self.save('one')
+        self.assertEqual((self.saved(), len(self.queue.pending)), ([], 1))
+        self.save('two', 'three')
+        with self.assertNumQueries(6):
+            # Two bulk inserts, each in a savepoint here
+            async_to_sync(self.queue.flush)()
+        self.assertEqual(self.saved(), ['one', 'two', 'three'])
+
+        # and the exit hook writes what is left
+        self.save('last')
+        self.queue.flush_sync()
+        self.assertEqual(self.saved()[-1], 'last')
+
+    def test_outage_keeps_messages_and_bad_rows_are_dropped(self):
+        self.save('kept', 'also kept')
+        for error in (OperationalError('server closed the connection'), InterfaceError('connection already closed')):
+            with mock.patch('django.db.models.query.QuerySet.bulk_create', side_effect=error):
+                async_to_sync(self.queue.flush)()
+            self.assertEqual(len(self.queue.pending), 2)
+
+        self.save('orphan')
+        self.queue.pending[-1].user_id = None
+        self.queue.flush_sync()
+        self.assertEqual(self.saved(), ['kept', 'also kept'])
+        self.assertEqual(self.queue.pending, [])
+
+    def test_buffer_is_capped_during_an_outage(self):
+        self.queue.max_buffered = 3
+        with mock.patch('django.db.models.query.QuerySet.bulk_create', side_effect=OperationalError('server closed the connection')):
+            self.save('one', 'two', 'three', 'four')
+        self.assertEqual([message.message for message in self.queue.pending], ['one', 'two', 'three'])
+        self.assertEqual(self.queue.dropped, 1)
+
+class ProjectBoardTests(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(username='manager', password='secret')
+        self.member = User.objects.create_user(username='member', password='secret')
+        self.project = Project.objects.create(name='Board', manager=self.manager)
+        self.project.members.add(self.manager, self.member)
+
+    def add_tasks(self, count):
+        for index in range(count):
+            task = Task.objects.create(title=f'Task {index}', status=['To-Do', 'Doing', 'Done'][index % 3], project=self.project, order=index)
+            task.owner.add(self.manager, self.member)
+            SubTask.objects.create(task=task, title=f'Step {index}')
+
+    def get_board(self, query=''):
+        return self.client.get(f'/api/projects/{self.project.id}/board/{query}')
+
+    def test_board_groups_tasks_by_status(self):
+        self.add_tasks(4)
+        response = self.get_board()
+
+        self.assertEqual(response.status_code, 200)
+        columns = response.json()['columns']
+        self.assertEqual([task['title'] for task in columns['To-Do']], ['Task 0', 'Task 3'])
+        self.assertEqual(sorted(columns['Doing'][0]['owner_usernames']), ['manager', 'member'])
+        self.assertEqual((columns['Done'][0]['subtask_completed'], columns['Done'][0]['subtask_total']), (0, 1))
+        self.assertNotIn('sub_tasks', columns['Done'][0])
+        self.assertEqual(len(response.json()['members']), 2)
+
+        columns = self.get_board('?sub_tasks=1').json()['columns']
+        self.assertEqual(columns['Done'][0]['sub_tasks'][0]['title'], 'Step 2')
+
+    def test_query_count_does_not_grow_with_tasks(self):
+        # the revision lookup for the ETag included
+        self.add_tasks(1)
+        with self.assertNumQueries(5):
+            self.get_board()
+
+        self.add_tasks(30)
+        with self.assertNumQueries(5):
+            self.get_board()
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Measured')
+        for index in range(3):
+            Task.objects.create(title=f'Task {index}', status='To-Do', project=self.project)
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get(f'/api/projects/{self.project.id}/board/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="5 queries, 0 duplicates", app;dur=[\d.]+, total;dur=[\d.]+$')
+
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('http_requests_total{view="project-board",method="GET",status="200"}', text)
+        self.assertIn('http_request_queries_bucket{view="project-board",le="5"}', text)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+
+    @override_settings(REQUEST_METRICS={'TOKEN': 'secret'})
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class WebSocketMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='watcher', password='secret')
+        self.project = Project.objects.create(name='Watched', manager=self.user)
+        self.project.members.add(self.user)
+
+    def test_sockets_messages_and_delivery_are_counted(self):
+        group = task_group_name(self.project.id)
+        sent = metrics.ws_messages_sent.values.get(('TaskConsumer',), 0)
+        delivered = metrics.ws_delivery.values.get(('TaskConsumer',), [0])[-1]
+
+        async def scenario():
+            communicator = WebsocketCommunicator(TaskConsumer.as_asgi(), f'/ws/projects/{self.project.id}/tasks/')
+            communicator.scope['user'] = self.user
+            communicator.scope['url_route'] = {'kwargs': {'project_id': str(self.project.id)}}
+            connected, _ = await communicator.connect()
+            open_sockets = metrics.ws_open_sockets.values.get(('TaskConsumer', group))
+            await group_broadcast(group, {'message': 'hello'})
+            await communicator.receive_from()
+            await communicator.disconnect()
+            return connected, open_sockets
+
+        connected, open_sockets = async_to_sync(scenario)()
+
+        self.assertTrue(connected)
+        self.assertEqual(open_sockets, 1)
+        self.assertNotIn(('TaskConsumer', group), metrics.ws_open_sockets.values)
+        self.assertEqual(metrics.ws_messages_sent.values[('TaskConsumer',)], sent + 1)
+        self.assertEqual(metrics.ws_delivery.values[('TaskConsumer',)][-1], delivered + 1)
+        text = metrics.REGISTRY.render()
+        self.assertIn('channel_layer_queue_depth{stat="max"}', text)
+        self.assertIn('# TYPE event_loop_lag_seconds histogram', text)
+
+
+@override_settings(READ_CACHE={'SHARED': True})
+class ReadCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(username='lead', password='secret', email='lead@example.com')
+        self.member = User.objects.create_user(username='dev', password='secret')
+        self.project = Project.objects.create(name='Cached', manager=self.manager)
+        self.project.members.add(self.manager)
+
+    def members(self):
+        return sorted(member['username'] for member in self.client.get(f'/api/projects/{self.project.id}/members/').json())
+
+    def test_members_and_details_are_served_from_cache_until_changed(self):
+        self.assertEqual(self.members(), ['lead'])
+        self.client.get(f'/api/projects/{self.project.id}/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.members(), ['lead'])
+            self.client.get(f'/api/projects/{self.project.id}/')
+
+        self.project.members.add(self.member)
+        self.assertEqual(self.members(), ['dev', 'lead'])
+
+        self.member.username = 'developer'
+        self.member.save()
+        self.assertEqual(self.members(), ['developer', 'lead'])
+
+        self.project.name = 'Renamed'
+        self.project.save()
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/').json()['name'], 'Renamed')
+        self.assertEqual(self.client.get('/api/projects/999/members/').status_code, 404)
+
+    def test_users_by_session_and_username(self):
+        self.client.force_login(self.member)
+        self.client.get('/accounts/current_user/')
+        with self.assertNumQueries(1):
+            # Only the session
+            self.assertEqual(self.client.get('/accounts/current_user/').json()['username'], 'dev')
+
+        self.assertEqual(self.client.get('/accounts/get_user_by_username/dev/').json()['id'], self.member.id)
+        self.member.username = 'developer'
+        self.member.save()
+        self.assertEqual(self.client.get('/accounts/get_user_by_username/dev/').status_code, 404)
+        self.assertEqual(self.client.get('/accounts/get_user_by_username/developer/').json()['id'], self.member.id)
+
+    def test_cached_users_leave_the_password_out(self):
+        self.client.force_login(self.member)
+        self.client.get('/accounts/current_user/')
+        entry = cache.get(f'read:user:{self.member.id}')
+        self.assertNotIn(self.member.password, repr(entry))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/accounts/current_user/').json()['username'], 'dev')
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertEqual(self.client.get(f"/accounts/get_user_by_username/{'a b' * 100}/").status_code, 404)
+
+    def test_per_process_cache_does_not_authenticate(self):
+        self.client.force_login(self.member)
+        self.client.get('/accounts/current_user/')
+        # A password change handled by another process, which only bumps
+        # the version in its own LocMemCache
+        User.objects.filter(id=self.member.id).update(password='changed')
+        with override_settings(READ_CACHE={'SHARED': None}):
+            self.assertEqual(self.client.get('/accounts/current_user/').status_code, 401)
+            self.assertNotIn('ETag', self.client.get(f'/api/projects/{self.project.id}/members/'))
+
+
+class TaskReorderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mover', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Board', manager=self.user)
+        self.todo = [Task.objects.create(title=f'Todo {index}', status='To-Do', project=self.project, order=(index + 1) * ORDER_GAP) for index in range(3)]
+        self.doing = Task.objects.create(title='Doing 0', status='Doing', project=self.project, order=ORDER_GAP)
+
+    def reorder(self, moves):
+        return self.client.post(f'/api/projects/{self.project.id}/tasks/reorder/', {'moves': moves}, content_type='application/json')
+
+    def column(self, status):
+        return list(Task.objects.filter(project=self.project, status=status).values_list('title', flat=True))
+
+    def test_moves_are_applied_in_one_request(self):
+        response = self.reorder([
+            {'id': self.todo[2].id, 'before_id': self.todo[0].id},
+            {'id': self.todo[1].id, 'status': 'Doing', 'after_id': self.doing.id},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.column('To-Do'), ['Todo 2', 'Todo 0'])
+        self.assertEqual(self.column('Doing'), ['Doing 0', 'Todo 1'])
+        self.assertEqual(list(ActivityLog.objects.values_list('action', 'to_status')), [('moved', 'Doing')])
+
+    def test_column_is_renumbered_when_the_gap_runs_out(self):
+        Task.objects.filter(id=self.todo[1].id).update(order=ORDER_GAP + 1)
+
+        self.reorder([{'id': self.todo[2].id, 'after_id': self.todo[0].id}])
+
+        self.assertEqual(self.column('To-Do'), ['Todo 0', 'Todo 2', 'Todo 1'])
+        self.assertEqual(list(Task.objects.filter(status='To-Do').values_list('order', flat=True)), [ORDER_GAP, 2 * ORDER_GAP, 3 * ORDER_GAP])
+
+    def test_status_change_appends_to_the_new_column(self):
+        url = f'/api/projects/{self.project.id}/tasks/{self.todo[0].id}/'
+        self.client.patch(url, {'status': 'Doing'}, content_type='application/json')
+        self.assertEqual(self.column('Doing'), ['Doing 0', 'Todo 0'])
+        self.assertEqual(Task.objects.get(id=self.todo[0].id).order, 2 * ORDER_GAP)
+
+        self.client.patch(url, {'status': 'To-Do', 'order': 1}, content_type='application/json')
+        self.assertEqual(self.column('To-Do'), ['Todo 0', 'Todo 1', 'Todo 2'])
+
+
+class TaskBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='importer', password='secret')
+        self.other = User.objects.create_user(username='other', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Batch', manager=self.user)
+        self.kept = Task.objects.create(title='Kept', status='To-Do', project=self.project, order=ORDER_GAP)
+        self.dropped = Task.objects.create(title='Dropped', status='To-Do', project=self.project, order=2 * ORDER_GAP)
+
+    def batch(self, operations):
+        return self.client.post(f'/api/projects/{self.project.id}/tasks/batch/', {'operations': operations}, content_type='application/json')
+
+    def test_operations_are_applied_together(self):
+        response = self.batch([
+            {'op': 'create', 'data': {'title': 'New', 'status': 'Doing', 'owner': [self.other.id]}},
+            {'op': 'update', 'id': self.kept.id, 'data': {'status': 'Done'}},
+            {'op': 'delete', 'id': self.dropped.id},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'][0]['owner'], [self.other.id])
+        self.assertEqual(Task.objects.get(id=self.kept.id).status, 'Done')
+        self.assertFalse(Task.objects.filter(id=self.dropped.id).exists())
+        self.assertEqual(sorted(ActivityLog.objects.values_list('action', flat=True)), ['created', 'deleted', 'moved'])
+
+    def test_ids_must_be_integers(self):
+        for task_id in ([1], {'id': 1}, '1', True):
+            response = self.batch([{'op': 'delete', 'id': task_id}])
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'operations': {'0': 'id must be an integer.'}})
+
+    def test_moved_tasks_are_appended_to_their_new_column(self):
+        self.batch([
+            {'op': 'create', 'data': {'title': 'New', 'status': 'Doing'}},
+            {'op': 'update', 'id': self.dropped.id, 'data': {'status': 'Doing'}},
+            {'op': 'update', 'id': self.kept.id, 'data': {'status': 'Doing'}},
+        ])
+        self.assertEqual(list(Task.objects.filter(status='Doing').values_list('title', 'order')),
+                         [('New', ORDER_GAP), ('Dropped', 2 * ORDER_GAP), ('Kept', 3 * ORDER_GAP)])
+
+    def test_invalid_operation_rolls_back_the_batch(self):
+        response = self.batch([
+            {'op': 'delete', 'id': self.dropped.id},
+            {'op': 'create', 'data': {'title': 'No status'}},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Task.objects.filter(id=self.dropped.id).exists())
+        self.assertFalse(ActivityLog.objects.exists())
+
+
+class SubTaskCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='counter', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Counters', manager=self.user)
+        self.task = Task.objects.create(title='Parent', status='Doing', project=self.project, auto_percentage=True)
+
+    def counters(self):
+        return Task.objects.filter(id=self.task.id).values_list('subtask_completed', 'subtask_total', 'percentage').get()
+
+    def test_counters_follow_create_toggle_and_delete(self):
+        url = f'/api/tasks/{self.task.id}/sub-tasks/'
+        ids = [self.client.post(url, {'task': self.task.id, 'title': f'Step {index}'}).json()['id'] for index in range(3)]
+        self.assertEqual(self.counters(), (0, 3, 0))
+
+        self.client.patch(f'{url}{ids[0]}/', {'completed': True}, content_type='application/json')
+        self.client.patch(f'{url}{ids[0]}/', {'title': 'Renamed'}, content_type='application/json')
+        self.assertEqual(self.counters(), (1, 3, 33))
+
+        self.client.delete(f'{url}{ids[1]}/')
+        self.assertEqual(self.counters(), (1, 2, 50))
+        SubTask.objects.get(id=ids[2]).delete()
+        self.assertEqual(self.counters(), (1, 1, 100))
+
+    def test_stale_instances_count_each_change_once(self):
+        SubTask.objects.create(task=self.task, title='Step')
+        first, second = SubTask.objects.get(), SubTask.objects.get()
+        first.completed = True
+        first.save()
+        second.completed = True
+        second.save()
+        self.assertEqual(self.counters(), (1, 1, 100))
+
+        first.completed = False
+        first.save()
+        second.delete()
+        self.assertEqual(self.counters(), (0, 0, 0))
+
+    def test_repair_fixes_drift(self):
+        SubTask.objects.bulk_create([SubTask(task=self.task, title='Bulk', completed=index % 2 == 0) for index in range(4)])
+        self.assertEqual(self.counters(), (0, 0, 0))
+
+        self.assertEqual(repair_counts(self.project.id), 1)
+        self.assertEqual(self.counters(), (2, 4, 50))
+        self.assertEqual(repair_counts(self.project.id), 0)
+
+
+@override_settings(READ_CACHE={'SHARED': True})
+class MembershipIndexTests(TestCase):
+    def setUp(self):
+        # Ids are reused between tests, so stale entries must not leak in
+        cache.clear()
+        self.user = User.objects.create_user(username='joiner', password='secret')
+        self.project = Project.objects.create(name='Members')
+
+    def test_index_follows_member_changes(self):
+        self.assertFalse(is_member(self.project.id, self.user))
+
+        self.project.members.add(self.user)
+        self.assertTrue(is_member(self.project.id, self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_member(self.project.id, self.user))
+        self.assertEqual(user_project_ids(self.user.id), {self.project.id})
+
+        self.project.members.remove(self.user)
+        self.assertFalse(is_member(self.project.id, self.user))
+
+        self.user.projects.add(self.project)
+        self.assertTrue(is_member(self.project.id, self.user))
+
+    def test_per_process_cache_is_bypassed(self):
+        with override_settings(READ_CACHE={'SHARED': None}):
+            self.assertFalse(is_member(self.project.id, self.user))
+            # Another process adding the member, unseen by this one's signals
+            Project.members.through.objects.create(project=self.project, customuser=self.user)
+            self.assertTrue(is_member(self.project.id, self.user))
+            self.assertEqual(user_project_ids(self.user.id), {self.project.id})
+
+
+class BulkInviteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(username='lead', password='secret')
+        self.client.force_login(self.manager)
+        self.project = Project.objects.create(name='Onboarding', manager=self.manager)
+        self.project.members.add(self.manager)
+        self.users = [User.objects.create_user(username=f'hire{index}', password='secret') for index in range(3)]
+
+    def invite(self, data, **kwargs):
+        return self.client.post(f'/api/projects/{self.project.id}/invite/', data, **kwargs)
+
+    def test_entries_are_reported_instead_of_aborting(self):
+        self.assertFalse(is_member(self.project.id, self.users[0]))
+        response = self.invite({
+            'usernames': ['hire0', 'nobody', 'lead'],
+            'user_ids': [self.users[1].id, 999999],
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual(report['added'], ['hire0', self.users[1].id])
+        self.assertEqual(report['already_member'], ['lead'])
+        self.assertEqual(report['unknown'], ['nobody', 999999])
+        self.assertTrue(is_member(self.project.id, self.users[0]))
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile('members.csv', b'username,id\nhire0,\n,%d\nghost,\n' % self.users[2].id)
+        report = self.invite({'file': upload}).json()
+        self.assertEqual(report['added'], ['hire0', str(self.users[2].id)])
+        self.assertEqual(report['unknown'], ['ghost'])
+        self.assertEqual(set(self.project.members.values_list('username', flat=True)), {'lead', 'hire0', 'hire2'})
+
+    def test_malformed_entries_are_rejected(self):
+        for data in ({'user_ids': [[1, 2]]}, {'usernames': [{'name': 'hire0'}]}, {'user_ids': ['abc']}, {'user_ids': 5}):
+            self.assertEqual(self.invite(data, content_type='application/json').status_code, 400)
+        self.assertFalse(is_member(self.project.id, self.users[0]))
+
+    def test_listed_manager_is_reported(self):
+        response = self.client.post('/api/create_project/', {
+            'name': 'Listed', 'description': '', 'manager_id': self.manager.id, 'members': [self.manager.id, self.users[0].id],
+        }, content_type='application/json')
+        self.assertEqual(response.json()['members']['added'], [self.manager.id, self.users[0].id])
+
+        response = self.client.post('/api/create_project/', {
+            'name': 'Unlisted', 'description': '', 'manager_id': self.manager.id, 'members': [self.users[0].id],
+        }, content_type='application/json')
+        self.assertEqual(response.json()['members']['added'], [self.users[0].id])
+        self.assertTrue(is_member(response.json()['project']['id'], self.manager))
+
+    def test_anonymous_users_are_refused(self):
+        self.client.logout()
+        self.project.manager = None
+        self.project.save()
+        self.assertEqual(self.invite({'usernames': ['hire0']}, content_type='application/json').status_code, 403)
+        self.assertFalse(is_member(self.project.id, self.users[0]))
+
+
+class ProjectExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Export', manager=self.user)
+        self.project.members.add(self.user)
+        task = Task.objects.create(title='Ship, then "export"', status='Done', project=self.project)
+        task.owner.add(self.user)
+        SubTask.objects.create(task=task, title='Step')
+        ActivityLog.objects.create(user=self.user, project=self.project, action='created', task_title=task.title)
+        ChatMessage.objects.create(user=self.user, project=self.project, message='hi')
+
+    def test_ndjson_streams_every_section(self):
+        response = self.client.get(f'/api/projects/{self.project.id}/export/')
+        self.assertTrue(response.streaming)
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(
+            [record['type'] for record in records],
+            ['project', 'members', 'tasks', 'task_owners', 'sub_tasks', 'activity_logs', 'chat_messages'],
+        )
+        self.assertEqual(records[2]['title'], 'Ship, then "export"')
+
+    def test_asgi_streams_chunk_by_chunk(self):
+        self.async_client.cookies = self.client.cookies
+
+        async def scenario():
+            response = await self.async_client.get(f'/api/projects/{self.project.id}/export/')
+            return response.is_async, [chunk async for chunk in response.streaming_content]
+
+        is_async, chunks = async_to_sync(scenario)()
+        self.assertTrue(is_async)
+        self.assertEqual(json.loads(b''.join(chunks).decode().splitlines()[0])['type'], 'project')
+
+    def test_csv_exports_one_section(self):
+        response = self.client.get(f'/api/projects/{self.project.id}/export/', {'output': 'csv', 'section': 'tasks'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('id,title,description,status'))
+        self.assertIn('"Ship, then ""export"""', lines[1])
+
+        response = self.client.get(f'/api/projects/{self.project.id}/export/', {'output': 'csv'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_anonymous_users_are_refused(self):
+        self.client.logout()
+        Project.objects.filter(id=self.project.id).update(manager=None)
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/export/').status_code, 403)
+
+
+class ProjectImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='migrator', password='secret')
+        self.owner = User.objects.create_user(username='owner', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Target', manager=self.user)
+
+    def upload(self, content, **params):
+        url = f'/api/projects/{self.project.id}/import/'
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, {'file': SimpleUploadedFile('data', content.encode())})
+
+    def test_export_round_trips_through_import(self):
+        source = Project.objects.create(name='Source')
+        source.members.add(self.owner)
+        task = Task.objects.create(title='Old', status='Doing', project=source)
+        task.owner.add(self.owner)
+        SubTask.objects.create(task=task, title='Part', completed=True)
+        ActivityLog.objects.create(user=self.owner, project=source, action='created', task_title='Old')
+        ChatMessage.objects.create(user=self.owner, project=source, message='legacy')
+        exported = ''.join(export_project(source))
+
+        report = self.upload(exported).json()
+        self.assertEqual(report['imported'], {
+            'members': 1, 'tasks': 1, 'task_owners': 1, 'sub_tasks': 1, 'activity_logs': 1, 'chat_messages': 1,
+        })
+        imported = Task.objects.get(project=self.project)
+        self.assertEqual(list(imported.owner.all()), [self.owner])
+        self.assertTrue(imported.sub_tasks.get().completed)
+        log = ActivityLog.objects.get(project=self.project)
+        self.assertEqual(log.timestamp, ActivityLog.objects.get(project=source).timestamp)
+
+    def test_csv_tasks_with_owner_names(self):
+        content = 'title,status,owners\nOne,To-Do,owner;ghost\nTwo,Nope,\n'
+        report = self.upload(content, input='csv', section='tasks').json()
+        self.assertEqual(report['imported'], {'tasks': 1})
+        self.assertEqual(report['skipped'], {'tasks': 1})
+        self.assertEqual(list(Task.objects.get(title='One').owner.all()), [self.owner])
+
+    def test_malformed_records_are_reported_with_their_line(self):
+        valid = '{"type": "tasks", "title": "Fine"}\n\n'
+        for line in ('[1]', '"x"', '3', '{"type": ["tasks"]', '{"type": "tasks", "deadline": 5}',
+                     '{"type": "tasks", "created_at": "yesterday"}', '{"type": "tasks", "order": [1]}'):
+            response = self.upload(valid + line + '\n')
+            self.assertEqual(response.status_code, 400, line)
+            self.assertTrue(response.json()['error'].startswith('Line 3: '), line)
+        self.assertEqual(self.upload('title,deadline\nOne,soon\n', input='csv', section='tasks').json(),
+                         {'error': "Line 2: deadline: 'soon' is not a datetime."})
+        self.assertFalse(Task.objects.filter(project=self.project).exists())
+
+    def test_anonymous_users_are_refused(self):
+        self.client.logout()
+        Project.objects.filter(id=self.project.id).update(manager=None)
+        self.assertEqual(self.upload('title,status\nOne,To-Do\n', input='csv', section='tasks').status_code, 403)
+        self.assertFalse(Task.objects.filter(project=self.project).exists())
+
+
+@override_settings(READ_CACHE={'SHARED': True})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='poller', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Polled')
+        self.task = Task.objects.create(title='Task', status='To-Do', project=self.project)
+        ActivityLog.objects.create(user=self.user, project=self.project, action='created', task_title='Task')
+
+    def test_unchanged_resources_get_304(self):
+        url = f'/api/projects/{self.project.id}/tasks/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(2):
+            # session and project revision
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(f'{url}{self.task.id}/')['ETag'], etag)
+
+        self.client.patch(f'{url}{self.task.id}/', {'status': 'Doing'}, content_type='application/json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        board = self.client.get(f'/api/projects/{self.project.id}/board/')
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/board/', HTTP_IF_NONE_MATCH=board['ETag']).status_code, 304)
+        self.project.members.add(self.user)
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/board/', HTTP_IF_NONE_MATCH=board['ETag']).status_code, 200)
+
+    def test_history_validators(self):
+        url = f'/api/projects/{self.project.id}/activity-logs/'
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        with self.assertNumQueries(4):
+            # session, project revision, newest row, newest segment
+            self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        ActivityLog.objects.create(user=self.user, project=self.project, action='updated', task_title='Task')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        # Deleting a user deletes older rows without raising the max id
+        ghost = User.objects.create_user(username='ghost', password='secret')
+        log = ActivityLog.objects.create(user=ghost, project=self.project, action='created', task_title='Ghost')
+        ActivityLog.objects.filter(id=log.id).update(id=0)
+        response = self.client.get(url)
+        ghost.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_project_resources_have_no_etag_without_a_shared_cache(self):
+        with override_settings(READ_CACHE={'SHARED': None}):
+            for path in ('', 'members/', 'board/'):
+                response = self.client.get(f'/api/projects/{self.project.id}/{path}')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('ETag', response)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='pager', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Pages')
+        self.url = f'/api/projects/{self.project.id}/chat-messages/'
+        # Messages 2-4 share a timestamp, so only the id orders them
+        start = timezone.now() - timedelta(hours=1)
+        for index, minutes in enumerate([0, 1, 2, 2, 2, 5, 6]):
+            ChatMessage.objects.create(project=self.project, user=self.user, message=f'Message {index}', timestamp=start + timedelta(minutes=minutes))
+
+    def messages(self, page):
+        return [message['message'] for message in page['results']]
+
+    def test_first_page_is_the_most_recent(self):
+        page = self.client.get(self.url, {'limit': 3}).json()
+        self.assertEqual(set(page), {'older', 'newer', 'results'})
+        self.assertEqual(self.messages(page), ['Message 4', 'Message 5', 'Message 6'])
+        self.assertIsNotNone(page['older'])
+        self.assertIsNone(page['newer'])
+
+    def test_older_and_newer_pages(self):
+        first = self.client.get(self.url, {'limit': 3}).json()
+        second = self.client.get(first['older']).json()
+        self.assertEqual(self.messages(second), ['Message 1', 'Message 2', 'Message 3'])
+        last = self.client.get(second['older']).json()
+        self.assertEqual(self.messages(last), ['Message 0'])
+        self.assertIsNone(last['older'])
+
+        back = self.client.get(last['newer']).json()
+        self.assertEqual(self.messages(back), ['Message 1', 'Message 2', 'Message 3'])
+        self.assertIsNotNone(back['newer'])
+        self.assertEqual(self.messages(self.client.get(back['newer']).json()), ['Message 4', 'Message 5', 'Message 6'])
+
+    def test_rows_with_equal_timestamps_are_neither_skipped_nor_repeated(self):
+        seen, url, params = [], self.url, {'limit': 1}
+        while url:
+            page = self.client.get(url, params).json()
+            seen = self.messages(page) + seen
+            url, params = page['older'], {}
+        self.assertEqual(seen, [f'Message {index}' for index in range(7)])
+
+        # activity logs read newest first, with the same tie-break on id
+        now = timezone.now()
+        for index in range(3):
+            log = ActivityLog.objects.create(user=self.user, project=self.project, action='created', task_title=f'Task {index}')
+            ActivityLog.objects.filter(id=log.id).update(timestamp=now)
+        url = f'/api/projects/{self.project.id}/activity-logs/'
+        first = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual([log['task_title'] for log in first['results']], ['Task 2', 'Task 1'])
+        self.assertEqual([log['task_title'] for log in self.client.get(first['older']).json()['results']], ['Task 0'])
+
+    def test_invalid_cursors_are_rejected(self):
+        bad_id = base64.urlsafe_b64encode(b'2024-01-01T00:00:00+00:00|first').decode()
+        for cursor in ['not-base64!', 'bm90IGEgY3Vyc29y', bad_id]:
+            for param in ['before', 'after']:
+                with self.subTest(cursor=cursor, param=param):
+                    self.assertEqual(self.client.get(self.url, {param: cursor}).status_code, 404)
+
+
+class HistoryArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='historian', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='History')
+        now = timezone.now()
+        for day in range(10):
+            log = ActivityLog.objects.create(user=self.user, project=self.project, action='created', task_title=f'Task {day}')
+            ActivityLog.objects.filter(id=log.id).update(timestamp=now - timedelta(days=day * 30))
+
+    def titles(self, **params):
+        titles, url = [], f'/api/projects/{self.project.id}/activity-logs/'
+        while url:
+            page = self.client.get(url, params).json()
+            titles += [log['task_title'] for log in page['results']]
+            url, params = page['older'], {}
+        return titles
+
+    def test_pages_reach_into_the_archive(self):
+        expected = [f'Task {day}' for day in range(10)]
+        self.assertEqual(self.titles(limit=3), expected)
+
+        moved = archive_history(hot_days=100, segment_size=2)
+        self.assertEqual(moved['activity_log'], 6)
+        self.assertEqual(ActivityLog.objects.filter(project=self.project).count(), 4)
+        self.assertEqual(HistorySegment.objects.filter(project=self.project).count(), 3)
+
+        self.assertEqual(self.titles(limit=3), expected)
+        exported = [json.loads(line) for line in ''.join(export_project(self.project)).splitlines()]
+        self.assertEqual(len([record for record in exported if record['type'] == 'activity_logs']), 10)
+
+        # and forwards from the oldest row
+        oldest = self.client.get(f'/api/projects/{self.project.id}/activity-logs/', {'limit': 1, 'before': self.cursor_of(8)}).json()
+        self.assertEqual([log['task_title'] for log in oldest['results']], ['Task 9'])
+        newer = self.client.get(oldest['newer'].replace('limit=1', 'limit=4')).json()
+        self.assertEqual([log['task_title'] for log in newer['results']], ['Task 5', 'Task 6', 'Task 7', 'Task 8'])
+
+    def cursor_of(self, day):
+        page = self.client.get(f'/api/projects/{self.project.id}/activity-logs/', {'limit': day + 1}).json()
+        return parse_qs(urlparse(page['older']).query)['before'][0]
+
+
+class ProjectAnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyst', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Flow', manager=self.user)
+        self.url = f'/api/projects/{self.project.id}/tasks/'
+
+    def analytics(self):
+        return self.client.get(f'/api/projects/{self.project.id}/analytics/', {'days': 2}).json()
+
+    def test_rollups_follow_task_changes(self):
+        first = self.client.post(self.url, {'title': 'One', 'status': 'To-Do', 'project': self.project.id}).json()
+        second = self.client.post(self.url, {'title': 'Two', 'status': 'Doing', 'project': self.project.id}).json()
+        self.client.patch(f"{self.url}{first['id']}/", {'status': 'Doing'}, content_type='application/json')
+        self.client.patch(f"{self.url}{second['id']}/", {'status': 'Done'}, content_type='application/json')
+        self.client.delete(f"{self.url}{first['id']}/")
+
+        # session, project and two rollup reads, however many logs; the
+        # user comes from the read cache
+        with self.assertNumQueries(4):
+            data = self.analytics()
+        self.assertEqual(data['cumulative_flow'], {'To-Do': [0, 0], 'Doing': [0, 0], 'Done': [0, 1]})
+        self.assertEqual(data['throughput'], [0, 1])
+        self.assertIsNotNone(data['average_cycle_time'])
+
+        durations = self.client.get(f"{self.url}{second['id']}/status-durations/").json()
+        self.assertEqual([period['status'] for period in durations['periods']], ['Doing', 'Done'])
+
+        # A rebuild from the logs gives the same rollups
+        before = list(ProjectStatusDay.objects.values_list('day', 'status', 'entered', 'exited', 'cycle_count').order_by('status'))
+        rebuild_project(self.project.id)
+        after = list(ProjectStatusDay.objects.values_list('day', 'status', 'entered', 'exited', 'cycle_count').order_by('status'))
+        self.assertEqual(before, after)
+
+    def test_rebuild_handles_logs_without_status(self):
+        # Logs written before rollups existed: no task link, no status on created
+        task = Task.objects.create(title='Legacy', status='Done', project=self.project)
+        ActivityLog.objects.create(user=self.user, project=self.project, action='created', task_title='Legacy')
+        ActivityLog.objects.create(user=self.user, project=self.project, action='moved', task_title='Legacy', from_status='Doing', to_status='Done')
+
+        self.assertEqual(rebuild_project(self.project.id), 2)
+        data = self.analytics()
+        self.assertEqual(data['cumulative_flow']['Doing'], [0, 0])
+        self.assertEqual(data['cumulative_flow']['Done'], [0, 1])
+        self.assertEqual(TaskStatusPeriod.objects.filter(task=task).count(), 2)
+
+
+class ProjectChangesTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Sync')
+        self.task = Task.objects.create(title='First', status='To-Do', project=self.project)
+        self.sub_task = SubTask.objects.create(task=self.task, title='Step')
+
+    def changes(self, since):
+        return self.client.get(f'/api/projects/{self.project.id}/changes/', {'since': since}).json()
+
+    def test_only_changes_after_the_revision_are_returned(self):
+        snapshot = self.changes(0)
+        self.assertEqual([task['title'] for task in snapshot['tasks']], ['First'])
+        self.assertEqual(len(snapshot['sub_tasks']), 1)
+
+        second = Task.objects.create(title='Second', status='Doing', project=self.project)
+        deleted_id = self.sub_task.id
+        self.sub_task.delete()
+
+        delta = self.changes(snapshot['revision'])
+        # The first task's subtask counters changed with the delete
+        self.assertEqual(sorted(task['id'] for task in delta['tasks']), [self.task.id, second.id])
+        self.assertEqual(delta['deleted'], {'tasks': [], 'sub_tasks': [deleted_id]})
+        self.assertEqual(self.changes(delta['revision'])['tasks'], [])
+
+    def test_cascades_record_only_the_deleted_task(self):
+        SubTask.objects.bulk_create([SubTask(task=self.task, title=f'Bulk {index}') for index in range(5)])
+        revision = self.changes(0)['revision']
+        task_id = self.task.id
+        with self.assertNumQueries(9):
+            self.task.delete()
+        delta = self.changes(revision)
+        self.assertEqual(delta['revision'], revision + 1)
+        self.assertEqual(delta['deleted'], {'tasks': [task_id], 'sub_tasks': []})
+
+        Task.objects.create(title='Second', status='Doing', project=self.project)
+        self.project.delete()
+        connection.check_constraints()
+        self.assertFalse(ProjectChange.objects.exists())
+
+
+@override_settings(OUTBOX={'MODE': 'inline'})
+class OutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='notifier', password='secret')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Notified')
+        self.url = f'/api/projects/{self.project.id}/tasks/'
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(task_group_name(self.project.id), self.channel)
+
+    def receive(self):
+        event = async_to_sync(self.layer.receive)(self.channel)
+        return [json.loads(frame) for frame in event.get('frames') or [event['frame']]]
+
+    def test_events_go_out_after_commit_in_order(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            task = self.client.post(self.url, {'title': 'First', 'status': 'To-Do', 'project': self.project.id}).json()
+            self.client.patch(f"{self.url}{task['id']}/", {'status': 'Doing'}, content_type='application/json')
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+        with self.assertRaises(Exception), transaction.atomic():
+            self.client.post(self.url, {'title': 'Rolled back', 'status': 'To-Do', 'project': self.project.id})
+            raise Exception
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+
+        for callback in callbacks:
+            callback()
+        # One group_send for both events of the project
+        frames = self.receive()
+        self.assertEqual([frame['message']['action'] for frame in frames], ['created', 'moved'])
+        self.assertLess(frames[0]['event_id'], frames[1]['event_id'])
+        self.assertEqual(frames[1]['seq'], frames[0]['seq'] + 1)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_failed_publish_is_retried(self):
+        with mock.patch('tasks.outbox.group_broadcast_many', side_effect=RuntimeError('layer down')):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url, {'title': 'Retried', 'status': 'To-Do', 'project': self.project.id})
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        # Backing off
+        self.assertEqual(drain(), 0)
+
+        OutboxEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(drain(), 1)
+        self.assertEqual(self.receive()[0]['message']['title'], 'Retried')
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_events_are_leased_before_publishing(self):
+        with self.captureOnCommitCallbacks():
+            self.client.post(self.url, {'title': 'Leased', 'status': 'To-Do', 'project': self.project.id})
+        original = outbox.group_broadcast_many
+        seen = []
+
+        async def broadcast(group, payloads):
+            # The claim is done: a second dispatcher would find nothing due
+            seen.append(await sync_to_async(outbox.claim)(10, timezone.now(), outbox.get_config()))
+            await original(group, payloads)
+
+        with mock.patch('tasks.outbox.group_broadcast_many', broadcast):
+            self.assertEqual(drain(), 1)
+        self.assertEqual(seen, [({}, 0)])
+
+    @override_settings(OUTBOX={'MODE': 'thread'})
+    def test_thread_mode_drains_inline_with_the_in_memory_layer(self):
+        self.assertEqual(outbox.get_config()['MODE'], outbox.INLINE)
+
+    @override_settings(OUTBOX={'MODE': 'worker', 'MAX_ATTEMPTS': 2, 'RETRY_DELAY': 0})
+    def test_poison_event_is_dead_lettered(self):
+        original = outbox.group_broadcast_many
+
+        async def broadcast(group, payloads):
+            if any(payload['message']['title'] == 'Poison' for payload in payloads):
+                raise ValueError('message too large')
+            await original(group, payloads)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for title in ('Poison', 'Fine'):
+                self.client.post(self.url, {'title': title, 'status': 'To-Do', 'project': self.project.id})
+        dead_letters = metrics.outbox_dead_letters.values.get((), 0)
+        with mock.patch('tasks.outbox.group_broadcast_many', broadcast):
+            # Coalesced, then the poison alone while Fine waits behind it
+            self.assertEqual(drain(), 0)
+            self.assertEqual(drain(), 0)
+            self.assertEqual(drain(), 1)
+
+        self.assertEqual(self.receive()[0]['message']['title'], 'Fine')
+        self.assertEqual(metrics.outbox_dead_letters.values[()], dead_letters + 1)
+        self.assertEqual(requeue_dead(), 1)
+        self.assertEqual(drain(), 1)
+
+
+class StreamResumeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_missed_frames_are_replayed_in_order(self):
+        async def scenario():
+            for index in range(3):
+                await group_broadcast('task_group_1', {'message': index})
+            return await missed_frames('task_group_1', 1)
+
+        frames = self.run_async(scenario())
+        self.assertEqual([json.loads(frame) for frame in frames], [{'seq': 2, 'message': 1}, {'seq': 3, 'message': 2}])
+
+    @override_settings(WS_STREAM={'BUFFER_SIZE': 2})
+    def test_evicted_gap_asks_for_resync(self):
+        async def scenario():
+            for index in range(4):
+                await group_broadcast('task_group_1', {'message': index})
+            return await missed_frames('task_group_1', 1), await missed_frames('task_group_1', 2)
+
+        evicted, kept = self.run_async(scenario())
+        self.assertIsNone(evicted)
+        self.assertEqual(len(kept), 2)
+
+    def test_invalid_resume_from_asks_for_resync(self):
+        user = User.objects.create_user(username='resumer', password='secret')
+        project = Project.objects.create(name='Resumed', manager=user)
+        project.members.add(user)
+
+        async def scenario():
+            communicator = WebsocketCommunicator(TaskConsumer.as_asgi(), f'/ws/projects/{project.id}/tasks/?resume_from=abc')
+            communicator.scope['user'] = user
+            communicator.scope['url_route'] = {'kwargs': {'project_id': str(project.id)}}
+            connected, _ = await communicator.connect()
+            frame = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return connected, frame
+
+        connected, frame = async_to_sync(scenario)()
+        self.assertTrue(connected)
+        self.assertEqual(frame, {'resync': True, 'seq': 0})
+
+    def test_cross_process_layer_needs_a_shared_cache(self):
+        self.assertEqual(check_shared_caches(None), [])
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'tasks.layers.PostgresChannelLayer'}}):
+            self.assertEqual(check_shared_caches(None), [])
+            with override_settings(READ_CACHE={'SHARED': None}):
+                warnings = check_shared_caches(None)
+        self.assertEqual([warning.id for warning in warnings], ['tasks.W001', 'tasks.W001'])
+        self.assertIn('MEMBERSHIP_CACHE', warnings[1].msg)
+
+
+# Without the dispatcher thread, which would outlive the test database
+@override_settings(OUTBOX={'MODE': 'inline'})
+class LoadTestHarnessTests(TransactionTestCase):
+    def test_small_run_reports_rest_and_websocket_numbers(self):
+        report = run_load_test(projects=1, tasks=5, users=2, requests=20, concurrency=1, sockets=2, messages=3, interval=0)
+
+        self.assertEqual(report['rest']['requests'], 20)
+        self.assertEqual(report['rest']['errors'], 0)
+        self.assertIn('p99', report['rest']['latency_ms'])
+        self.assertEqual(report['websocket']['tasks']['deliveries'], 6)
+        self.assertEqual(report['websocket']['chat']['deliveries'], 6)
+        self.assertFalse(Project.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_refuses_to_run_outside_a_test_database(self):
+        with mock.patch.dict(connection.settings_dict, NAME='railway'), self.assertRaises(RuntimeError):
+            run_load_test(projects=1, tasks=1, users=1, requests=1)
+        self.assertFalse(User.objects.exists())
+
+
+class ReminderSchedulerTests(TestCase):
+    def test_due_soon_then_overdue(self):
+        now = timezone.now()
+        scheduler = ReminderScheduler(timedelta(hours=1))
+        scheduler.schedule(1, 7, 'Ship', now + timedelta(hours=3), 'Doing', now)
+        scheduler.schedule(2, 7, 'Soon', now + timedelta(minutes=30), 'To-Do', now)
+        scheduler.schedule(3, 7, 'Done', now + timedelta(hours=1), 'Done', now)
+
+        self.assertEqual([(event['kind'], event['task_id']) for event in scheduler.due(now)], [('due_soon', 2)])
+        # Moving a deadline replaces the pending event
+        scheduler.schedule(2, 7, 'Soon', now + timedelta(hours=5), 'To-Do', now)
+        self.assertEqual(scheduler.due(now + timedelta(minutes=119)), [])
+        events = scheduler.due(now + timedelta(hours=3))
+        self.assertEqual([(event['kind'], event['task_id']) for event in events], [('due_soon', 1), ('overdue', 1)])
+        self.assertEqual(len(scheduler), 1)
+
+    def test_saving_a_deadline_notifies_the_worker(self):
+        project = Project.objects.create(name='Deadlines')
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(title='Plain', status='To-Do', project=project)
+            task = Task.objects.create(title='Due', status='To-Do', project=project, deadline=timezone.now() + timedelta(hours=2))
+
+        message = async_to_sync(get_channel_layer().receive)('task-reminders')
+        self.assertEqual((message['task_id'], message['status']), (task.id, 'To-Do'))
+
+        # Bulk moves ask the worker to reload its window
+        user = User.objects.create_user(username='mover', password='secret')
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/projects/{project.id}/tasks/reorder/', {'moves': [{'id': task.id, 'status': 'Done'}]}, content_type='application/json')
+        self.assertEqual(async_to_sync(get_channel_layer().receive)('task-reminders')['type'], 'reminders.reload')
+
+    def test_worker_runs_in_process_with_the_in_memory_layer(self):
+        self.assertTrue(runs_in_process())
+        with self.assertRaises(CommandError):
+            call_command('run_reminders')
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'tasks.layers.PostgresChannelLayer'}}):
+            self.assertFalse(runs_in_process())
+
+
+class ProjectSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searcher', password='secret')
+        self.project = Project.objects.create(name='Search')
+        self.other = Project.objects.create(name='Elsewhere')
+        self.task = Task.objects.create(title='Deploy billing service', description='Roll out the invoices worker', status='To-Do', project=self.project)
+        SubTask.objects.create(task=self.task, title='Write invoices migration')
+        ChatMessage.objects.create(project=self.project, user=self.user, message='invoices are late again')
+        ChatMessage.objects.create(project=self.other, user=self.user, message='invoices elsewhere')
+
+    def search(self, **params):
+        return self.client.get(f'/api/projects/{self.project.id}/search/', params).json()
+
+    def test_hits_come_from_every_source_of_the_project(self):
+        results = self.search(q='invoices')['results']
+        self.assertEqual(sorted(hit['kind'] for hit in results), ['chat', 'subtask', 'task'])
+
+    def test_index_follows_updates_and_pages(self):
+        self.task.title = 'Deploy payroll service'
+        self.task.save()
+        self.assertEqual([hit['id'] for hit in self.search(q='payroll')['results']], [self.task.id])
+        self.assertEqual(self.search(q='billing')['results'], [])
+
+        page = self.search(q='invoices', limit=2)
+        self.assertEqual(len(page['results']), 2)
+        self.assertEqual(len(self.search(q='invoices', limit=2, offset=page['next_offset'])['results']), 1)
+
+    def test_other_databases_fall_back_to_unranked_matching(self):
+        hits = search_fallback(self.project.id, 'INVOICES worker')
+        self.assertEqual([(hit['kind'], hit['id']) for hit in hits], [('task', self.task.id)])
+        self.assertEqual(sorted(hit['kind'] for hit in search_fallback(self.project.id, 'invoices')), ['chat', 'subtask', 'task'])
+        self.assertEqual(len(search_fallback(self.project.id, 'invoices', limit=2, offset=2)), 1)
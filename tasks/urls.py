@@ -14,6 +14,12 @@ urlpatterns = [
     path('create_project/', create_project, name='create-project'),
     path('projects/<int:project_id>/', project_detail, name='project-detail'),
     path('projects/<int:project_id>/members/', project_members, name='project-members'),
+    path('projects/<int:project_id>/board/', project_board, name='project-board'),
+    path('projects/<int:project_id>/changes/', project_changes, name='project-changes'),
+    path('projects/<int:project_id>/search/', project_search, name='project-search'),
+    path('projects/<int:project_id>/analytics/', project_analytics_view, name='project-analytics'),
+    path('projects/<int:project_id>/export/', project_export, name='project-export'),
+    path('projects/<int:project_id>/import/', project_import, name='project-import'),
     path('projects/<int:project_id>/invite/', invite_members_to_project, name='invite_members_to_project'),
     path('projects/<int:project_id>/set_manager/', set_project_manager, name='set-project-manager'), 
     path('projects/<int:project_id>/kickmember/<int:member_id>/', kick_member_from_project, name='kick-member'),
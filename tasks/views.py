@@ -1,14 +1,33 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+import io
+from datetime import date, timedelta
 from rest_framework import viewsets, status
 from .models import *
 from .serializers import *
-from rest_framework.decorators import api_view
+from .broadcast import task_group_name
+from .pagination import ActivityLogPagination, ChatMessagePagination
+from .ordering import apply_moves, next_order
+from .activity import build_activity_log, create_activity_log
+from .analytics import project_analytics, record_logs
+from .batch import apply_batch
+from .membership import add_members, is_manager_or_member, read_members_csv, user_project_ids
+from .revisions import SUBTASK, TASK
+from .search import search_project
+from .export import export_project, stream_chunks
+from .importer import import_project
+from .outbox import enqueue
+from . import readcache
+from .archive import ACTIVITY_LOG, CHAT_MESSAGE
+from .conditional import ConditionalViewSetMixin, conditional, history_validators, project_etag, project_revision, revision_etag, subtask_etag
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -21,7 +40,10 @@ class ProjectViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save()
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(ConditionalViewSetMixin, viewsets.ModelViewSet):
+    # Writes run in a transaction so the project revision bump (see
+    # tasks.revisions) and the WebSocket notification (see tasks.outbox)
+    # commit together with the change they describe
     serializer_class = TaskSerializer
     
     def get_queryset(self):
@@ -30,10 +52,18 @@ class TaskViewSet(viewsets.ModelViewSet):
             return Task.objects.filter(project_id=project_id)
         return Task.objects.none()
 
+    def get_validators(self, request):
+        return revision_etag(request, self.kwargs.get('project_id')), None
+
+    @transaction.atomic
     def perform_create(self, serializer):
         project_id = self.kwargs.get('project_id')
         project = get_object_or_404(Project, id=project_id)
-        task = serializer.save(project=project)
+        if 'order' in serializer.validated_data:
+            task = serializer.save(project=project)
+        else:
+            # Append to the bottom of the column, leaving a gap for later drops
+            task = serializer.save(project=project, order=next_order(project.id, serializer.validated_data.get('status')))
 
         # Log the activity
         create_activity_log(
@@ -41,11 +71,14 @@ class TaskViewSet(viewsets.ModelViewSet):
             project=project,
             action='created',
             task_title=task.title,
+            to_status=task.status,
+            task=task,
         )
 
         # Notify WebSocket clients
         notify_ws_clients(task, self.request.user, 'created')
 
+    @transaction.atomic
     def perform_update(self, serializer):
         task = self.get_object()  # Get the existing task instance
         project = task.project
@@ -58,8 +91,13 @@ class TaskViewSet(viewsets.ModelViewSet):
             'status': task.status,
         }
 
-        # Save the new data
-        task = serializer.save()
+        # Save the new data; a task moved to another column without a rank
+        # goes to the bottom of it
+        new_status = serializer.validated_data.get('status', task.status)
+        if new_status != task.status and 'order' not in serializer.validated_data:
+            task = serializer.save(order=next_order(project.id, new_status))
+        else:
+            task = serializer.save()
 
         edited_fields = []
 
@@ -94,6 +132,7 @@ class TaskViewSet(viewsets.ModelViewSet):
                 task_title=task.title,
                 from_status=original_status,
                 to_status=new_status,
+                task=task,
             )
             notify_ws_clients(task, self.request.user, 'moved', from_status=original_status, to_status=new_status)
         else:
@@ -104,15 +143,83 @@ class TaskViewSet(viewsets.ModelViewSet):
                     action='edited',
                     task_title=task.title,
                     edited_fields=edited_fields,
+                    task=task,
                 )
                 notify_ws_clients(task, self.request.user, 'edited', edited_fields=edited_fields)
 
+    @action(detail=False, methods=['post'])
+    def reorder(self, request, project_id=None):
+        # Moves one or many cards in a single transaction:
+        # {"moves": [{"id": 1, "status": "Doing", "before_id": 7}, ...]}
+        project = get_object_or_404(Project, id=project_id)
+        moves = request.data.get('moves', [])
+        if not isinstance(moves, list) or not moves:
+            return Response({"error": "moves must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            changed, status_changes = apply_moves(project, moves)
+            logs = ActivityLog.objects.bulk_create([
+                build_activity_log(
+                    user=request.user,
+                    project=project,
+                    action='moved',
+                    task_title=task.title,
+                    from_status=from_status,
+                    to_status=to_status,
+                    task=task,
+                )
+                for task, from_status, to_status in status_changes
+            ])
+            record_logs(logs)
+            notify_ws_clients_reorder(project.id, changed, request.user)
+
+        return Response({'tasks': [{'id': task.id, 'status': task.status, 'order': task.order} for task in changed]})
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request, project_id=None):
+        # {"operations": [{"op": "create", "data": {...}},
+        #                 {"op": "update", "id": 3, "data": {...}},
+        #                 {"op": "delete", "id": 4}]}
+        project = get_object_or_404(Project, id=project_id)
+        with transaction.atomic():
+            result = apply_batch(project, request.user, request.data.get('operations'))
+
+            payload = {
+                'created': TaskSerializer(result['created'], many=True).data,
+                'updated': TaskSerializer(result['updated'], many=True).data,
+                'deleted': result['deleted'],
+            }
+            notify_ws_clients_batch(project.id, payload, request.user)
+        return Response(payload)
+
+    @action(detail=True, methods=['get'], url_path='status-durations')
+    def status_durations(self, request, project_id=None, pk=None):
+        # Time the task has spent in each status, from the analytics rollups
+        task = self.get_object()
+        now = timezone.now()
+        periods = [
+            {
+                'status': period.status,
+                'started_at': period.started_at,
+                'ended_at': period.ended_at,
+                'seconds': ((period.ended_at or now) - period.started_at).total_seconds(),
+            }
+            for period in task.status_periods.order_by('started_at', 'id')
+        ]
+        totals = {}
+        for period in periods:
+            totals[period['status']] = totals.get(period['status'], 0) + period['seconds']
+        return Response({'periods': periods, 'totals': totals})
+
+    @transaction.atomic
     def perform_destroy(self, instance):
         create_activity_log(
             user=self.request.user,
             project=instance.project,
             action='deleted',
             task_title=instance.title,
+            from_status=instance.status,
+            task=instance,
         )
         notify_ws_clients(instance, self.request.user, 'deleted')
         instance.delete()
@@ -125,7 +232,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         except Task.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-class SubTaskViewSet(viewsets.ModelViewSet):
+class SubTaskViewSet(ConditionalViewSetMixin, viewsets.ModelViewSet):
     serializer_class = SubTaskSerializer
 
     def get_queryset(self):
@@ -134,34 +241,51 @@ class SubTaskViewSet(viewsets.ModelViewSet):
             return SubTask.objects.filter(task_id=task_id)
         return SubTask.objects.none()
 
+    def get_validators(self, request):
+        return subtask_etag(request, self.kwargs.get('task_id')), None
+
+    @transaction.atomic
     def perform_create(self, serializer):
         task = get_object_or_404(Task, id=self.kwargs.get('task_id'))
         sub_task = serializer.save(task=task)
         notify_ws_clients_subtask(sub_task, self.request.user, 'created')
 
+    @transaction.atomic
     def perform_update(self, serializer):
         sub_task = serializer.save()
         notify_ws_clients_subtask(sub_task, self.request.user, 'updated')
 
+    @transaction.atomic
     def perform_destroy(self, instance):
-        notify_ws_clients_subtask(instance, self.request.user, 'deleted')
+        # Deleted first so that the broadcast carries the updated counters
+        sub_task_id = instance.id
         instance.delete()
+        instance.id = sub_task_id
+        notify_ws_clients_subtask(instance, self.request.user, 'deleted')
 
-class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
+class ActivityLogViewSet(ConditionalViewSetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = ActivityLogSerializer
+    pagination_class = ActivityLogPagination
 
     def get_queryset(self):
         project_id = self.kwargs.get('project_id')
         if project_id:
-            return ActivityLog.objects.filter(project_id=project_id).order_by('-timestamp')
+            return ActivityLog.objects.filter(project_id=project_id).select_related('user').order_by('-timestamp', '-id')
         return ActivityLog.objects.none()
 
-class ChatMessageViewSet(viewsets.ReadOnlyModelViewSet):
+    def get_validators(self, request):
+        return history_validators(request, ACTIVITY_LOG, self.kwargs.get('project_id'))
+
+class ChatMessageViewSet(ConditionalViewSetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = ChatMessageSerializer
+    pagination_class = ChatMessagePagination
 
     def get_queryset(self):
         project_id = self.kwargs['project_id']
-        return ChatMessage.objects.filter(project_id=project_id).order_by('timestamp')
+        return ChatMessage.objects.filter(project_id=project_id).select_related('user').order_by('timestamp', 'id')
+
+    def get_validators(self, request):
+        return history_validators(request, CHAT_MESSAGE, self.kwargs['project_id'])
 
 ####### END of View Set #######
 
@@ -178,30 +302,29 @@ def create_project(request):
     # Validate the data
     if not project_name:
         return Response({"error": "Project name is required."}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(member_ids, list):
+        return Response({"error": "members must be a list of user ids."}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
         manager = User.objects.get(id=manager_id) if manager_id else None
-        project = Project.objects.create(
-            name=project_name,
-            description=project_description,
-            manager=manager
-        )
-    
-        # Add the manager as a member
-        if manager:
-            project.members.add(manager)
-
-        # Add members to the project
-        for member_id in member_ids:
-            try:
-                member = User.objects.get(id=member_id)
-                project.members.add(member)
-            except User.DoesNotExist:
-                return Response({"error": f"User with ID {member_id} does not exist."}, status=status.HTTP_404_NOT_FOUND)
+        # The manager is a member too, reported only when the caller listed them
+        manager_listed = manager is not None and str(manager.id) in [str(member_id) for member_id in member_ids]
+        with transaction.atomic():
+            project = Project.objects.create(
+                name=project_name,
+                description=project_description,
+                manager=manager
+            )
 
+            # Add the manager and members in one bulk insert
+            report = add_members(project, user_ids=([manager.id] if manager and not manager_listed else []) + member_ids)
+        if manager and not manager_listed:
+            report['added'].remove(manager.id)
 
-        return Response({'project': ProjectSerializer(project).data, "success": "Project created successfully!"}, status=status.HTTP_201_CREATED)
+        return Response({'project': ProjectSerializer(project).data, 'members': report, "success": "Project created successfully!"}, status=status.HTTP_201_CREATED)
 
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -213,23 +336,30 @@ def invite_members_to_project(request, project_id):
         project = Project.objects.get(id=project_id)
 
         # Ensure the user making the request is either a project manager or member
-        if request.user != project.manager and request.user not in project.members.all():
+        if not is_manager_or_member(project, request.user):
             return Response({"error": "You do not have permission to add members to this project."}, status=status.HTTP_403_FORBIDDEN)
 
-        # Get the list of usernames from the request data
-        usernames = request.data.get('usernames', [])
-
-        for username in usernames:
-            try:
-                member = User.objects.get(username=username)
-                project.members.add(member)
-            except User.DoesNotExist:
-                return Response({"error": f"User with username {username} does not exist."}, status=status.HTTP_404_NOT_FOUND)
-
-        return Response({"success": "Members added successfully!"}, status=status.HTTP_200_OK)
+        # Usernames and ids from the request data or an uploaded CSV file
+        if hasattr(request.data, 'getlist'):
+            usernames = request.data.getlist('usernames')
+            user_ids = request.data.getlist('user_ids')
+        else:
+            usernames = request.data.get('usernames', [])
+            user_ids = request.data.get('user_ids', [])
+            if not isinstance(usernames, list) or not isinstance(user_ids, list):
+                return Response({"error": "usernames and user_ids must be lists."}, status=status.HTTP_400_BAD_REQUEST)
+        if 'file' in request.FILES:
+            csv_usernames, csv_user_ids = read_members_csv(request.FILES['file'])
+            usernames += csv_usernames
+            user_ids += csv_user_ids
+
+        report = add_members(project, usernames=usernames, user_ids=user_ids)
+        return Response({"success": f"{len(report['added'])} members added.", **report}, status=status.HTTP_200_OK)
 
     except Project.DoesNotExist:
         return Response({"error": "Project not found."}, status=status.HTTP_404_NOT_FOUND)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -240,7 +370,7 @@ def project_list(request):
     try:
         user = request.user
         print(f"User {user.username} is requesting projects.")
-        projects = Project.objects.filter(members=user)
+        projects = Project.objects.filter(id__in=user_project_ids(user.id))
         serializer = ProjectSerializer(projects, many=True)
         print(f"Found {len(projects)} projects for user {user.username}.")
         return Response(serializer.data)
@@ -250,15 +380,170 @@ def project_list(request):
     
 @api_view(['GET'])
 def project_detail(request, project_id):
-    project = get_object_or_404(Project, id=project_id)
-    return JsonResponse({'name': project.name, 'manager': project.manager_id})
+    def respond():
+        project = readcache.project_detail(project_id)
+        if project is None:
+            raise Http404
+        return JsonResponse(project)
+    return conditional(request, respond, project_etag(request, project_id))
 
 @api_view(['GET'])
 def project_members(request, project_id):
+    def respond():
+        members_data = readcache.project_members(project_id)
+        if members_data is None:
+            raise Http404
+        return JsonResponse(members_data, safe=False)
+    return conditional(request, respond, project_etag(request, project_id))
+
+@api_view(['GET'])
+def project_board(request, project_id):
+    # Tasks change the revision, members the project's read cache version
+    revision = project_revision(project_id)
+    etag = project_etag(request, project_id, revision) if revision is not None else None
+    return conditional(request, lambda: board_response(request, project_id), etag)
+
+def board_response(request, project_id):
+    # Everything a kanban board needs in a fixed number of queries:
+    # project, members, tasks and task owners. Cards carry the subtask
+    # counters; ?sub_tasks=1 adds the subtasks themselves in one more query
+    project = get_object_or_404(Project, id=project_id)
+    members = project.members.only('id', 'username', 'email')
+    tasks = Task.objects.filter(project=project).prefetch_related(
+        Prefetch('owner', queryset=User.objects.only('id', 'username')),
+    )
+    serializer_class = BoardTaskSerializer
+    if request.query_params.get('sub_tasks') in ('1', 'true'):
+        tasks = tasks.prefetch_related(Prefetch('sub_tasks', queryset=SubTask.objects.order_by('id')))
+        serializer_class = BoardTaskWithSubTasksSerializer
+
+    columns = {value: [] for value, _ in Task._meta.get_field('status').choices}
+    for task in serializer_class(tasks, many=True).data:
+        columns.setdefault(task['status'], []).append(task)
+
+    return Response({
+        'project': {
+            'id': project.id,
+            'name': project.name,
+            'description': project.description,
+            'manager': project.manager_id,
+        },
+        'members': [{'username': member.username, 'email': member.email, 'id': member.id} for member in members],
+        'columns': columns,
+    })
+
+@api_view(['GET'])
+def project_changes(request, project_id):
+    # Everything that changed after ?since=<revision>, for cheap reconnects
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        return Response({"error": "since must be an integer revision."}, status=status.HTTP_400_BAD_REQUEST)
+
+    return conditional(request, lambda: changes_response(project_id, since), revision_etag(request, project_id))
+
+def changes_response(project_id, since):
+    project = get_object_or_404(Project.objects.only('id', 'revision'), id=project_id)
+    changes = ProjectChange.objects.filter(project=project, revision__gt=since)
+
+    changed = {TASK: [], SUBTASK: []}
+    deleted = {TASK: [], SUBTASK: []}
+    for kind, object_id, is_deleted in changes.values_list('kind', 'object_id', 'deleted'):
+        (deleted if is_deleted else changed)[kind].append(object_id)
+
+    tasks = Task.objects.filter(project=project, id__in=changed[TASK]).prefetch_related('owner')
+    sub_tasks = SubTask.objects.filter(task__project=project, id__in=changed[SUBTASK])
+
+    return Response({
+        'revision': project.revision,
+        'tasks': TaskSerializer(tasks, many=True).data,
+        'sub_tasks': SubTaskSerializer(sub_tasks, many=True).data,
+        'deleted': {'tasks': deleted[TASK], 'sub_tasks': deleted[SUBTASK]},
+    })
+
+@api_view(['GET'])
+def project_search(request, project_id):
+    # Ranked full-text search over tasks, subtasks and chat: ?q=&limit=&offset=
+    query = request.query_params.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        offset = max(0, int(request.query_params.get('offset', 0)))
+    except ValueError:
+        return Response({"error": "limit and offset must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+    project = get_object_or_404(Project.objects.only('id'), id=project_id)
+    results = search_project(project.id, query, limit=limit + 1, offset=offset) if query else []
+
+    return Response({
+        'results': results[:limit],
+        'offset': offset,
+        'limit': limit,
+        'next_offset': offset + limit if len(results) > limit else None,
+    })
+
+@api_view(['GET'])
+def project_analytics_view(request, project_id):
+    # Cumulative flow, throughput and cycle time per day: ?days=30 or ?start=&end= (YYYY-MM-DD)
+    project = get_object_or_404(Project.objects.only('id'), id=project_id)
+    try:
+        end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params else timezone.localdate()
+        if 'start' in request.query_params:
+            start = date.fromisoformat(request.query_params['start'])
+        else:
+            start = end - timedelta(days=max(1, min(int(request.query_params.get('days', 30)), 366)) - 1)
+    except ValueError:
+        return Response({"error": "start and end must be YYYY-MM-DD dates and days an integer."}, status=status.HTTP_400_BAD_REQUEST)
+    if start > end or (end - start).days > 366:
+        return Response({"error": "The range must be at most 366 days, start before end."}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(project_analytics(project.id, start, end))
+
+@api_view(['GET'])
+def project_export(request, project_id):
+    # Streams the whole project: ?output=ndjson (default) or ?output=csv&section=tasks
     project = get_object_or_404(Project, id=project_id)
-    members = project.members.all()
-    members_data = [{'username': member.username, 'email': member.email, 'id': member.id} for member in members]
-    return JsonResponse(members_data, safe=False)
+    if not is_manager_or_member(project, request.user):
+        return Response({"error": "You do not have permission to export this project."}, status=status.HTTP_403_FORBIDDEN)
+
+    output = request.query_params.get('output', 'ndjson')
+    section = request.query_params.get('section')
+    try:
+        chunks = export_project(project, format=output, section=section)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if isinstance(request._request, ASGIRequest):
+        chunks = stream_chunks(chunks)
+
+    if output == 'csv':
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+        filename = f'project-{project.id}-{section}.csv'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+        filename = f'project-{project.id}.ndjson'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@api_view(['POST'])
+def project_import(request, project_id):
+    # Bulk import of an uploaded 'file': ?input=ndjson (default) or ?input=csv&section=tasks
+    project = get_object_or_404(Project, id=project_id)
+    if not is_manager_or_member(project, request.user):
+        return Response({"error": "You do not have permission to import into this project."}, status=status.HTTP_403_FORBIDDEN)
+    if 'file' not in request.FILES:
+        return Response({"error": "Upload the data to import as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+
+    stream = io.TextIOWrapper(request.FILES['file'], encoding='utf-8-sig', newline='')
+    try:
+        report = import_project(
+            stream,
+            format=request.query_params.get('input', 'ndjson'),
+            section=request.query_params.get('section'),
+            project=project,
+            user=request.user,
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report)
 
 @api_view(['PATCH'])
 def set_project_manager(request, project_id):
@@ -300,43 +585,20 @@ def kick_member_from_project(request, project_id, member_id):
 
     return Response({"success": f"{member.username} has been removed from the project."}, status=status.HTTP_204_NO_CONTENT)
 
-def create_activity_log(user, project, action, task_title, from_status=None, to_status=None, edited_fields=None):
-    # Check if edited_fields are provided and are valid
-    if edited_fields:
-        formatted_edited_fields = []
-        for field in edited_fields:
-            # Check that both from_value and to_value are not None
-            from_value = field.get('from_value', 'None')
-            to_value = field.get('to_value', 'None')
-            field_name = field.get('field', 'undefined')
-
-            formatted_edited_fields.append(f"{field_name}: '{from_value}' to '{to_value}'")
-
-        edited_fields_str = ', '.join(formatted_edited_fields) if formatted_edited_fields else None
-    else:
-        edited_fields_str = None
-
-    ActivityLog.objects.create(
-        user=user,
-        project=project,
-        action=action,
-        task_title=task_title,
-        from_status=from_status,
-        to_status=to_status,
-        edited_fields=edited_fields_str,
-    )
+# The notifications below are written to the outbox in the caller's
+# transaction and published once it commits, see tasks.outbox
 
 def notify_ws_clients(task, user, action, from_status=None, to_status=None, edited_fields=None):
-    channel_layer = get_channel_layer()
+    username = user.username if user else 'Unknown User'
 
     message = {
-        'user': user.username if user else 'Unknown User',
+        'user': username,
         'id': task.id,
         'title': task.title,
         'description': task.description,
-        'owner': task.owner,
+        'owner': list(task.owner.values_list('id', flat=True)),
         'status': task.status,
-        'project_id': task.project.id,
+        'project_id': task.project_id,
         'action': action
     }
     
@@ -346,36 +608,37 @@ def notify_ws_clients(task, user, action, from_status=None, to_status=None, edit
     if action == 'edited':
         message['edited_fields'] = edited_fields
 
-    try:
-        async_to_sync(channel_layer.group_send)(
-            f"project_{task.project.id}",
-            {
-                'type': 'task_message',
-                'message': message
-            }
-        )
-    except Exception as e:
-        # Log the error or handle it appropriately
-        print(f"Failed to send WebSocket message: {e}")
+    enqueue(task.project_id, task_group_name(task.project_id), {
+        'message': message,
+        'user': username,
+    })
         
         
+def notify_ws_clients_reorder(project_id, tasks, user):
+    # One coalesced event for every card touched by a reorder
+    enqueue(project_id, task_group_name(project_id), {
+        'reorder': [{'id': task.id, 'status': task.status, 'order': task.order} for task in tasks],
+        'user': user.username if user.is_authenticated else 'Anonymous',
+    })
+
+def notify_ws_clients_batch(project_id, payload, user):
+    # One aggregated event per batch instead of one per task
+    enqueue(project_id, task_group_name(project_id), {
+        'batch': payload,
+        'user': user.username if user.is_authenticated else 'Anonymous',
+    })
+
 def notify_ws_clients_subtask(sub_task, user, action):
-    project_id = sub_task.task.project.id
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"task_group_{project_id}",
-        {
-            'type': 'subtask_message',
-            'subtask': {
-                'id': sub_task.id,
-                'task_id': sub_task.task.id,
-                'title': sub_task.title,
-                'completed': sub_task.completed,
-                'action': action,
-                'user': user.username if user.is_authenticated else 'Anonymous'
-            }
+    project_id = sub_task.task.project_id
+    counts = Task.objects.filter(id=sub_task.task_id).values('subtask_total', 'subtask_completed', 'percentage').first() or {}
+    enqueue(project_id, task_group_name(project_id), {
+        'subtask': {
+            'id': sub_task.id,
+            'task_id': sub_task.task_id,
+            'title': sub_task.title,
+            'completed': sub_task.completed,
+            'action': action,
+            'task_counts': counts,
+            'user': user.username if user.is_authenticated else 'Anonymous'
         }
-    )
-    
-
-
+    })